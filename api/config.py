@@ -3,5 +3,80 @@ import os
 class Settings:
     PROJECT_NAME: str = "Smart Agence API"
     DATABASE_URL: str = os.getenv("DATABASE_URL", "sqlite:///./smart_agence.db")
+    # Agences servies (codes séparés par des virgules) : la première utilise DATABASE_URL,
+    # chacune des autres sa propre base construite à partir du gabarit
+    AGENCES: list = [code.strip() for code in os.getenv("AGENCES", "principale").split(",") if code.strip()]
+    AGENCE_PAR_DEFAUT: str = AGENCES[0]
+    AGENCE_DATABASE_URL: str = os.getenv("AGENCE_DATABASE_URL", "sqlite:///./agences/{agence}.db")
+    # Requêtes compilées gardées par moteur (cache SQLAlchemy) et requêtes préparées gardées
+    # par connexion SQLite (cache du module sqlite3, 128 par défaut)
+    QUERY_CACHE_SIZE: int = int(os.getenv("QUERY_CACHE_SIZE", "1500"))
+    SQLITE_STATEMENT_CACHE: int = int(os.getenv("SQLITE_STATEMENT_CACHE", "256"))
+    # Seuil (ms) au-delà duquel une requête SQL est journalisée comme lente
+    SLOW_QUERY_MS: float = float(os.getenv("SLOW_QUERY_MS", "100"))
+    # Nombre de tickets dont le statut courant est gardé en mémoire
+    TICKET_STATE_CACHE_SIZE: int = int(os.getenv("TICKET_STATE_CACHE_SIZE", "50000"))
+    # Nombre maximal de tickets ouverts gardés en mémoire par agence (les plus anciens sont écartés au-delà)
+    OPEN_TICKETS_CAPACITY: int = int(os.getenv("OPEN_TICKETS_CAPACITY", "100000"))
+    # Durée de conservation des clés Idempotency-Key et taille du cache mémoire associé
+    IDEMPOTENCY_TTL_SECONDS: int = int(os.getenv("IDEMPOTENCY_TTL_SECONDS", "86400"))
+    IDEMPOTENCY_CACHE_SIZE: int = int(os.getenv("IDEMPOTENCY_CACHE_SIZE", "10000"))
+    # Rapport de charge : ancienneté maximale d'un ticket en cours avant la fenêtre demandée
+    WORKLOAD_LOOKBACK_HOURS: int = int(os.getenv("WORKLOAD_LOOKBACK_HOURS", "24"))
+    # Prévision d'attente : historique chargé au démarrage, fenêtre au-delà de laquelle un
+    # ticket en attente est considéré abandonné, fréquence de mise à jour des profils
+    FORECAST_HISTORY_DAYS: int = int(os.getenv("FORECAST_HISTORY_DAYS", "56"))
+    FORECAST_QUEUE_HOURS: int = int(os.getenv("FORECAST_QUEUE_HOURS", "12"))
+    FORECAST_REFRESH_SECONDS: float = float(os.getenv("FORECAST_REFRESH_SECONDS", "5"))
+    # Endpoints de maintenance destructifs (POST /reset, POST /seed?reset=true) ; à désactiver en production
+    ALLOW_RESET: bool = os.getenv("ALLOW_RESET", "1") == "1"
+    # Maintenance de la base en arrière-plan : intervalles en secondes (0 = tâche désactivée),
+    # part maximale du temps passée en maintenance, pages rendues par étape de vacuum
+    MAINTENANCE_ENABLED: bool = os.getenv("MAINTENANCE_ENABLED", "1") == "1"
+    MAINTENANCE_CHECKPOINT_SECONDS: float = float(os.getenv("MAINTENANCE_CHECKPOINT_SECONDS", "60"))
+    MAINTENANCE_VACUUM_SECONDS: float = float(os.getenv("MAINTENANCE_VACUUM_SECONDS", "600"))
+    MAINTENANCE_OPTIMIZE_SECONDS: float = float(os.getenv("MAINTENANCE_OPTIMIZE_SECONDS", "3600"))
+    MAINTENANCE_INTEGRITY_SECONDS: float = float(os.getenv("MAINTENANCE_INTEGRITY_SECONDS", "86400"))
+    MAINTENANCE_DUTY_CYCLE: float = float(os.getenv("MAINTENANCE_DUTY_CYCLE", "0.1"))
+    MAINTENANCE_VACUUM_PAGES: int = int(os.getenv("MAINTENANCE_VACUUM_PAGES", "500"))
+    # Journal des modifications (GET /changes) : nombre d'entrées conservées, fréquence de la purge
+    CHANGES_KEEP: int = int(os.getenv("CHANGES_KEEP", "100000"))
+    MAINTENANCE_CHANGES_SECONDS: float = float(os.getenv("MAINTENANCE_CHANGES_SECONDS", "3600"))
+    # Rapports d'activité : délai de prise en charge du SLA (minutes), jours de rapports
+    # précalculés par la maintenance, fréquence de la tâche
+    REPORTS_SLA_WAIT_MINUTES: float = float(os.getenv("REPORTS_SLA_WAIT_MINUTES", "15"))
+    REPORTS_HISTORY_DAYS: int = int(os.getenv("REPORTS_HISTORY_DAYS", "35"))
+    MAINTENANCE_REPORTS_SECONDS: float = float(os.getenv("MAINTENANCE_REPORTS_SECONDS", "3600"))
+    # Taille (octets) à partir de laquelle les réponses sont compressées
+    COMPRESSION_MIN_SIZE: int = int(os.getenv("COMPRESSION_MIN_SIZE", "1024"))
+    # Contrôle d'admission (par worker) : requêtes traitées simultanément, attente maximale en file,
+    # requêtes en file au-delà desquelles une classe est délestée (429)
+    ADMISSION_ENABLED: bool = os.getenv("ADMISSION_ENABLED", "1") == "1"
+    ADMISSION_MAX_CONCURRENCY: int = int(os.getenv("ADMISSION_MAX_CONCURRENCY", "16"))
+    ADMISSION_QUEUE_TIMEOUT_SECONDS: float = float(os.getenv("ADMISSION_QUEUE_TIMEOUT_SECONDS", "10"))
+    ADMISSION_QUEUE_KIOSK: int = int(os.getenv("ADMISSION_QUEUE_KIOSK", "500"))
+    ADMISSION_QUEUE_READ: int = int(os.getenv("ADMISSION_QUEUE_READ", "100"))
+    ADMISSION_QUEUE_ANALYTICS: int = int(os.getenv("ADMISSION_QUEUE_ANALYTICS", "20"))
+    # Débit par client (requêtes/s, 0 = illimité) et rafale tolérée, par classe de route
+    RATE_LIMIT_KIOSK_PER_SECOND: float = float(os.getenv("RATE_LIMIT_KIOSK_PER_SECOND", "0"))
+    RATE_LIMIT_KIOSK_BURST: int = int(os.getenv("RATE_LIMIT_KIOSK_BURST", "100"))
+    RATE_LIMIT_READ_PER_SECOND: float = float(os.getenv("RATE_LIMIT_READ_PER_SECOND", "50"))
+    RATE_LIMIT_READ_BURST: int = int(os.getenv("RATE_LIMIT_READ_BURST", "200"))
+    RATE_LIMIT_ANALYTICS_PER_SECOND: float = float(os.getenv("RATE_LIMIT_ANALYTICS_PER_SECOND", "5"))
+    RATE_LIMIT_ANALYTICS_BURST: int = int(os.getenv("RATE_LIMIT_ANALYTICS_BURST", "20"))
+    # Tâches différées (outbox) : attente maximale entre deux lots, taille d'un lot,
+    # tentatives avant abandon, premier délai de nouvel essai (doublé à chaque échec), bail
+    OUTBOX_POLL_SECONDS: float = float(os.getenv("OUTBOX_POLL_SECONDS", "1"))
+    OUTBOX_BATCH_SIZE: int = int(os.getenv("OUTBOX_BATCH_SIZE", "100"))
+    OUTBOX_MAX_ATTEMPTS: int = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "8"))
+    OUTBOX_RETRY_SECONDS: float = float(os.getenv("OUTBOX_RETRY_SECONDS", "1"))
+    OUTBOX_LEASE_SECONDS: float = float(os.getenv("OUTBOX_LEASE_SECONDS", "60"))
+    # Sauvegardes à chaud (désactivées tant que BACKUP_DIR n'est pas renseigné)
+    BACKUP_DIR: str = os.getenv("BACKUP_DIR", "")
+    BACKUP_INTERVAL_SECONDS: float = float(os.getenv("BACKUP_INTERVAL_SECONDS", "21600"))
+    BACKUP_KEEP: int = int(os.getenv("BACKUP_KEEP", "7"))
+    # Renseignés par le lanceur multi-workers (api.serve)
+    SCHEMA_READY: bool = os.getenv("SCHEMA_READY") == "1"
+    COORDINATION_FILE: str = os.getenv("COORDINATION_FILE", "")
 
 settings = Settings()
\ No newline at end of file
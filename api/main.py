@@ -1,12 +1,71 @@
-from fastapi import FastAPI, Depends, HTTPException, status
+import json
+import logging
+import os
+import sys
+import threading
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+from typing import Optional
+from fastapi import FastAPI, Depends, Header, HTTPException, Query, Request, Response, status
+from fastapi.responses import JSONResponse, PlainTextResponse
+from sqlalchemy.exc import OperationalError
 from sqlalchemy.orm import Session
-from .src import models, schemas, crud
-from .src.database import SessionLocal, engine
+from .config import settings
+from .src import models, schemas, crud, metrics, transitions, idempotency, schema, workload, routing, forecast, maintenance, open_tickets, outbox, admission, http_cache, changes, reports, agent_cache
 from fastapi.middleware.cors import CORSMiddleware
 
-models.Base.metadata.create_all(bind=engine)
+logger = logging.getLogger("smart_agence.api")
 
-app = FastAPI()
+def _uvicorn_workers():
+    """Workers demandés à uvicorn : les processus « spawn » gardent la ligne de commande du parent"""
+    value = os.getenv("WEB_CONCURRENCY", "1")
+    for i, arg in enumerate(sys.argv):
+        if arg == "--workers" and i + 1 < len(sys.argv):
+            value = sys.argv[i + 1]
+        elif arg.startswith("--workers="):
+            value = arg.split("=", 1)[1]
+    return int(value) if value.isdigit() else 1
+
+def _warm_state_caches():
+    for agence in routing.router.codes:
+        db = routing.router.session(agence)
+        try:
+            transitions.state_cache_for(db).warm(db)
+            # Tickets ouverts (file d'attente, compteurs en direct)
+            open_tickets.store_for(db).sync(db)
+            # Premier chargement des profils de prévision (historique complet)
+            forecast.forecaster_for(db).refresh(db)
+            # Fiches des agents (validation des agent_id, agents embarqués dans les tickets)
+            agent_cache.cache_for(db).agents(db)
+        finally:
+            db.close()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # `uvicorn --workers N` seul : pas de journal d'invalidation, chaque worker garde des caches
+    # périmés (agents, statuts) et tous préparent le schéma en même temps
+    if _uvicorn_workers() > 1 and not settings.COORDINATION_FILE:
+        logger.warning(
+            "Plusieurs workers sans COORDINATION_FILE : caches incohérents entre workers. "
+            "Lancer l'API avec `python -m api.serve --workers N`."
+        )
+    # En mode multi-workers, le schéma est préparé une seule fois par api.serve
+    if not settings.SCHEMA_READY:
+        for engine in routing.router.engines.values():
+            schema.ensure_schema(engine)
+    # Statut courant des tickets récents, chargé en arrière-plan pour ne pas retarder
+    # la première requête ; en attendant, un défaut de cache lit la base
+    threading.Thread(target=_warm_state_caches, name="warm-state-cache", daemon=True).start()
+    # Checkpoint, vacuum, statistiques, intégrité et sauvegardes à intervalles réguliers
+    if settings.MAINTENANCE_ENABLED:
+        maintenance.scheduler.start()
+    # Effets de bord différés, exécutés après la réponse
+    outbox.worker.start()
+    yield
+    outbox.worker.stop()
+    maintenance.scheduler.stop()
+
+app = FastAPI(lifespan=lifespan)
 
 # Middleware CORS
 app.add_middleware(
@@ -17,9 +76,59 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Dépendance pour obtenir la session DB
-def get_db():
-    db = SessionLocal()
+# Instrumentation : latence par route, activité SQL, requêtes lentes
+for engine in routing.router.engines.values():
+    metrics.instrument_engine(engine, slow_query_ms=settings.SLOW_QUERY_MS)
+# Compression gzip/brotli des réponses JSON au-delà du seuil
+app.add_middleware(http_cache.CompressionMiddleware, minimum_size=settings.COMPRESSION_MIN_SIZE)
+# Limites de débit, priorité aux bornes et délestage (429) sous forte charge ;
+# ajouté avant les métriques pour que les requêtes refusées y soient comptées
+if settings.ADMISSION_ENABLED:
+    app.add_middleware(admission.AdmissionMiddleware, controller=admission.controller)
+app.add_middleware(metrics.MetricsMiddleware)
+
+# Base SQLite verrouillée par un autre écrivain : erreur transitoire, le client peut réessayer
+@app.exception_handler(OperationalError)
+def handle_operational_error(request, exc):
+    if "database is locked" in str(exc.orig):
+        return JSONResponse(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            content={"detail": "database is locked"},
+            headers={"Retry-After": "1"},
+        )
+    raise exc
+
+# Clé d'idempotence réutilisée avec un corps différent
+@app.exception_handler(idempotency.IdempotencyConflict)
+def handle_idempotency_conflict(request, exc):
+    return JSONResponse(
+        status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, content={"detail": str(exc)}
+    )
+
+# Modification concurrente (PATCH avec une version périmée) : le client relit puis réessaie
+@app.exception_handler(crud.VersionConflict)
+def handle_version_conflict(request, exc):
+    return JSONResponse(
+        status_code=status.HTTP_409_CONFLICT,
+        content={"detail": str(exc), "version": exc.current_version},
+    )
+
+# Email déjà porté par un autre agent présent (création ou modification d'agent)
+@app.exception_handler(crud.DuplicateEmail)
+def handle_duplicate_email(request, exc):
+    return JSONResponse(status_code=status.HTTP_409_CONFLICT, content={"detail": str(exc)})
+
+# agent_id inconnu à la création ou à la modification d'un ticket ou d'un événement
+@app.exception_handler(agent_cache.UnknownAgent)
+def handle_unknown_agent(request, exc):
+    return JSONResponse(status_code=status.HTTP_404_NOT_FOUND, content={"detail": "Agent not found"})
+
+# Dépendance pour obtenir la session DB de l'agence demandée (en-tête X-Agence)
+def get_db(x_agence: Optional[str] = Header(default=None)):
+    try:
+        db = routing.router.session(x_agence)
+    except routing.UnknownBranch:
+        raise HTTPException(status_code=404, detail="Agence not found")
     try:
         yield db
     finally:
@@ -30,10 +139,62 @@ def get_db():
 def create_agent(agent: schemas.AgentCreate, db: Session = Depends(get_db)):
     return crud.create_agent(db=db, agent=agent)
 
+# Listes : ETag dérivé de la version de la table, 304 sans requête SQL si le client est à jour
 @app.get("/agents/", response_model=list[schemas.Agent])
-def read_agents(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
+def read_agents(request: Request, response: Response, skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
+    unchanged = http_cache.not_modified(request, response, http_cache.etag(db, request, changes.AGENTS))
+    if unchanged is not None:
+        return unchanged
     return crud.get_agents(db, skip=skip, limit=limit)
 
+# Recherche par préfixe (nom, prénoms, email, téléphone), insensible à la casse et aux accents
+@app.get("/agents/search", response_model=list[schemas.Agent])
+def search_agents(
+    request: Request,
+    response: Response,
+    q: str = Query(..., min_length=1, max_length=100),
+    limit: int = Query(20, ge=1, le=100),
+    db: Session = Depends(get_db),
+):
+    unchanged = http_cache.not_modified(request, response, http_cache.etag(db, request, changes.AGENTS))
+    if unchanged is not None:
+        return unchanged
+    return crud.search_agents(db, q, limit=limit)
+
+# Charge de travail : temps occupé, pics de tickets simultanés et débit, par agent et par tranche
+@app.get("/agents/workload", response_model=schemas.WorkloadReport)
+def read_agents_workload(
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    bucket_minutes: Optional[int] = None,
+    db: Session = Depends(get_db),
+):
+    end = end or datetime.utcnow()
+    start = start or end - timedelta(days=1)
+    if start >= end:
+        raise HTTPException(status_code=400, detail="start must be before end")
+    if bucket_minutes is not None:
+        if bucket_minutes <= 0:
+            raise HTTPException(status_code=400, detail="bucket_minutes must be positive")
+        if (end - start) / timedelta(minutes=bucket_minutes) > 1000:
+            raise HTTPException(status_code=400, detail="too many buckets (max 1000)")
+    return workload.compute_workload(db, start, end, bucket_minutes)
+
+# Départ de plusieurs agents en une transaction
+@app.post("/agents/offboard", response_model=schemas.OffboardingReport)
+def offboard_agents(offboarding: schemas.AgentOffboarding, db: Session = Depends(get_db)):
+    report = crud.delete_agents(db, offboarding.agent_ids, reassign=offboarding.reassign)
+    if report is None:
+        raise HTTPException(status_code=404, detail="Agent not found")
+    return report
+
+@app.get("/agents/{agent_id}", response_model=schemas.Agent)
+def read_agent(agent_id: int, db: Session = Depends(get_db)):
+    db_agent = crud.get_agent(db, agent_id=agent_id)
+    if db_agent is None:
+        raise HTTPException(status_code=404, detail="Agent not found")
+    return db_agent
+
 @app.put("/agents/{agent_id}", response_model=schemas.Agent)
 def update_agent(agent_id: int, agent: schemas.AgentCreate, db: Session = Depends(get_db)):
     db_agent = crud.update_agent(db, agent_id=agent_id, agent=agent)
@@ -41,21 +202,114 @@ def update_agent(agent_id: int, agent: schemas.AgentCreate, db: Session = Depend
         raise HTTPException(status_code=404, detail="Agent not found")
     return db_agent
 
+# Modification partielle : seuls les champs envoyés sont écrits, en un UPDATE ... RETURNING
+@app.patch("/agents/{agent_id}", response_model=schemas.Agent)
+def patch_agent(agent_id: int, patch: schemas.AgentPatch, db: Session = Depends(get_db)):
+    fields = patch.dict(exclude_unset=True)
+    expected_version = fields.pop("version", None)
+    db_agent = crud.patch_agent(db, agent_id, fields, expected_version=expected_version)
+    if db_agent is None:
+        raise HTTPException(status_code=404, detail="Agent not found")
+    return db_agent
+
+# Suppression : l'agent est marqué parti (historique conservé), ses tickets ouverts sont
+# répartis entre les agents restants de sa catégorie
 @app.delete("/agents/{agent_id}", response_model=schemas.Agent)
-def delete_agent(agent_id: int, db: Session = Depends(get_db)):
-    db_agent = crud.delete_agent(db, agent_id=agent_id)
+def delete_agent(agent_id: int, reassign: bool = True, db: Session = Depends(get_db)):
+    db_agent = crud.delete_agent(db, agent_id=agent_id, reassign=reassign)
     if db_agent is None:
         raise HTTPException(status_code=404, detail="Agent not found")
     return db_agent
 
 # Routes Tickets
-@app.post("/tickets/", response_model=schemas.Ticket, status_code=status.HTTP_201_CREATED)
-def create_ticket(ticket: schemas.TicketCreate, db: Session = Depends(get_db)):
-    return crud.create_ticket(db=db, ticket=ticket)
+# Le reçu de la borne inclut l'attente estimée pour la catégorie de service
+@app.post("/tickets/", response_model=schemas.TicketReceipt, status_code=status.HTTP_201_CREATED)
+def create_ticket(
+    ticket: schemas.TicketCreate,
+    idempotency_key: Optional[str] = Header(default=None),
+    db: Session = Depends(get_db),
+):
+    db_ticket = crud.create_ticket(db=db, ticket=ticket, idempotency_key=idempotency_key)
+    receipt = schemas.TicketReceipt.model_validate(db_ticket, from_attributes=True)
+    wait = forecast.forecaster_for(db).predict_wait(db, db_ticket.categorie_service, ticket_id=db_ticket.id)
+    receipt.queue_ahead = wait["queue_ahead"]
+    receipt.estimated_wait_minutes = wait["estimated_wait_minutes"]
+    return receipt
+
+# Chaque ticket embarque son agent : l'ETag suit aussi les modifications d'agents
+@app.get("/tickets/", response_model=list[schemas.TicketWithState])
+def read_tickets(request: Request, response: Response, skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
+    unchanged = http_cache.not_modified(request, response, http_cache.etag(db, request, changes.TICKETS, changes.AGENTS))
+    if unchanged is not None:
+        return unchanged
+    return crud.with_states(db, crud.get_tickets(db, skip=skip, limit=limit))
 
-@app.get("/tickets/", response_model=list[schemas.Ticket])
-def read_tickets(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    return crud.get_tickets(db, skip=skip, limit=limit)
+# Liste paginée, filtrée et triée côté serveur (tableaux Streamlit)
+@app.get("/tickets/page", response_model=schemas.TicketPage)
+def read_tickets_page(
+    request: Request,
+    response: Response,
+    page: int = Query(default=1, ge=1),
+    page_size: int = Query(default=50, ge=1, le=500),
+    sort: str = "-id",
+    categorie_service: Optional[str] = None,
+    agent_id: Optional[int] = None,
+    statut: Optional[schemas.TicketStatus] = None,
+    db: Session = Depends(get_db),
+):
+    if sort.lstrip("-") not in crud.TICKET_SORT_COLUMNS:
+        raise HTTPException(status_code=400, detail=f"sort must be one of {sorted(crud.TICKET_SORT_COLUMNS)}")
+    unchanged = http_cache.not_modified(request, response, http_cache.etag(db, request, changes.TICKETS, changes.AGENTS))
+    if unchanged is not None:
+        return unchanged
+    total, tickets = crud.get_tickets_page(
+        db, page=page, page_size=page_size, sort=sort, categorie_service=categorie_service,
+        agent_id=agent_id, statut=statut.value if statut else None,
+    )
+    return schemas.TicketPage(items=crud.with_states(db, tickets), total=total, page=page, page_size=page_size)
+
+# Tickets ouverts, servis depuis la mémoire : file d'attente dans l'ordre d'arrivée et compteurs
+@app.get("/tickets/open", response_model=schemas.OpenTicketQueue)
+def read_open_tickets(
+    statut: Optional[schemas.TicketStatus] = None,
+    categorie_service: Optional[str] = None,
+    agent_id: Optional[int] = None,
+    limit: int = Query(default=100, ge=1, le=1000),
+    db: Session = Depends(get_db),
+):
+    if statut is not None and statut.value not in open_tickets.OPEN_STATUSES:
+        raise HTTPException(status_code=400, detail=f"statut must be one of {list(open_tickets.OPEN_STATUSES)}")
+    total, items = open_tickets.store_for(db).queue(
+        db, statut=statut.value if statut else None, categorie_service=categorie_service,
+        agent_id=agent_id, limit=limit,
+    )
+    return schemas.OpenTicketQueue(total=total, items=items)
+
+@app.get("/tickets/open/counts", response_model=schemas.OpenTicketCounts)
+def read_open_ticket_counts(db: Session = Depends(get_db)):
+    return open_tickets.store_for(db).counts(db)
+
+# Actions groupées : transitions et/ou réaffectation de plusieurs tickets en une transaction
+@app.post("/tickets/batch", response_model=list[schemas.TicketWithState])
+def update_tickets_batch(batch: schemas.TicketBatchUpdate, db: Session = Depends(get_db)):
+    if batch.statut is None and batch.agent_id is None:
+        raise HTTPException(status_code=400, detail="statut or agent_id is required")
+    try:
+        tickets = crud.update_tickets_batch(db, batch)
+    except transitions.InvalidBatch as exc:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT, detail={"message": str(exc), "errors": exc.errors}
+        )
+    if tickets is None:
+        raise HTTPException(status_code=404, detail="Agent not found")
+    return tickets
+
+@app.get("/tickets/{ticket_id}", response_model=schemas.TicketWithState)
+def read_ticket(ticket_id: int, db: Session = Depends(get_db)):
+    db_ticket = crud.get_ticket(db, ticket_id=ticket_id)
+    if db_ticket is None:
+        raise HTTPException(status_code=404, detail="Ticket not found")
+    return crud.with_states(db, [db_ticket])[0]
 
 @app.put("/tickets/{ticket_id}", response_model=schemas.Ticket)
 def update_ticket(ticket_id: int, ticket: schemas.TicketCreate, db: Session = Depends(get_db)):
@@ -64,7 +318,148 @@ def update_ticket(ticket_id: int, ticket: schemas.TicketCreate, db: Session = De
         raise HTTPException(status_code=404, detail="Ticket not found")
     return db_ticket
 
+@app.patch("/tickets/{ticket_id}", response_model=schemas.Ticket)
+def patch_ticket(ticket_id: int, patch: schemas.TicketPatch, db: Session = Depends(get_db)):
+    fields = patch.dict(exclude_unset=True)
+    expected_version = fields.pop("version", None)
+    db_ticket = crud.patch_ticket(db, ticket_id, fields, expected_version=expected_version)
+    if db_ticket is None:
+        raise HTTPException(status_code=404, detail="Ticket not found")
+    return db_ticket
+
 # Routes Événements
+@app.get("/tickets/{ticket_id}/status", response_model=schemas.TicketState)
+def read_ticket_state(ticket_id: int, db: Session = Depends(get_db)):
+    statut = crud.get_ticket_state(db, ticket_id=ticket_id)
+    if statut is None:
+        raise HTTPException(status_code=404, detail="Ticket not found")
+    return schemas.TicketState(
+        ticket_id=ticket_id,
+        statut=statut,
+        transitions=transitions.allowed_transitions(statut),
+    )
+
 @app.post("/tickets/{ticket_id}/status", response_model=schemas.Evenement)
-def create_evenement(ticket_id: int, evenement: schemas.EvenementCreate, db: Session = Depends(get_db)):
-    return crud.create_evenement(db=db, ticket_id=ticket_id, evenement=evenement)
\ No newline at end of file
+def create_evenement(
+    ticket_id: int,
+    evenement: schemas.EvenementCreate,
+    idempotency_key: Optional[str] = Header(default=None),
+    db: Session = Depends(get_db),
+):
+    try:
+        db_evenement = crud.create_evenement(
+            db=db, ticket_id=ticket_id, evenement=evenement, idempotency_key=idempotency_key
+        )
+    except transitions.InvalidTransition as exc:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(exc))
+    if db_evenement is None:
+        raise HTTPException(status_code=404, detail="Ticket not found")
+    return db_evenement
+
+# Prévisions d'attente
+@app.get("/forecast/wait", response_model=schemas.WaitForecast)
+def read_wait_forecast(categorie_service: str, db: Session = Depends(get_db)):
+    return forecast.forecaster_for(db).predict_wait(db, categorie_service)
+
+@app.get("/forecast/profile", response_model=schemas.ServiceProfile)
+def read_service_profile(categorie_service: str, db: Session = Depends(get_db)):
+    return forecast.forecaster_for(db).profile(db, categorie_service)
+
+# Routes Agences
+@app.get("/agences/", response_model=list[str])
+def read_agences():
+    return routing.router.codes
+
+# Agrégats réseau : chaque agence est interrogée en parallèle, puis les résultats sont fusionnés
+@app.get("/agences/summary", response_model=schemas.NetworkSummary)
+def read_agences_summary():
+    branches = routing.router.fan_out(crud.get_branch_summary)
+    total = schemas.BranchSummary(agence="*", agents=0, tickets=0, tickets_by_service={}, tickets_by_status={})
+    for summary in branches.values():
+        total.agents += summary.agents
+        total.tickets += summary.tickets
+        for service, count in summary.tickets_by_service.items():
+            total.tickets_by_service[service] = total.tickets_by_service.get(service, 0) + count
+        for statut, count in summary.tickets_by_status.items():
+            total.tickets_by_status[statut] = total.tickets_by_status.get(statut, 0) + count
+    return schemas.NetworkSummary(agences=list(branches.values()), total=total)
+
+# Journal des modifications : synchronisation incrémentale d'une copie locale
+@app.get("/changes", response_model=schemas.ChangeFeed)
+def read_changes(
+    since: int = Query(default=0, ge=0),
+    limit: int = Query(default=1000, ge=1, le=10000),
+    db: Session = Depends(get_db),
+):
+    return crud.get_changes(db, since=since, limit=limit)
+
+# Rapports d'activité : périodes closes calculées une fois et servies telles quelles
+@app.get("/reports", response_model=list[schemas.ReportEntry])
+def read_reports(
+    kind: Optional[str] = Query(None, pattern=f"^({'|'.join(reports.KINDS)})$"),
+    granularity: Optional[str] = Query(None, pattern=f"^({'|'.join(reports.GRANULARITIES)})$"),
+    db: Session = Depends(get_db),
+):
+    return reports.index(db, kind=kind, granularity=granularity)
+
+@app.get("/reports/{kind}/{period}")
+def read_report(
+    kind: str,
+    period: str,
+    request: Request,
+    format: str = Query("json", pattern="^(json|csv)$"),
+    db: Session = Depends(get_db),
+):
+    if kind not in reports.KINDS:
+        raise HTTPException(status_code=404, detail="Unknown report")
+    try:
+        content, stored = reports.get(db, kind, period)
+    except reports.UnknownPeriod as exc:
+        raise HTTPException(status_code=404, detail=str(exc))
+    if format == "csv":
+        result = Response(
+            reports.to_csv(json.loads(content)),
+            media_type="text/csv",
+            headers={"Content-Disposition": f'attachment; filename="{kind}-{period}.csv"'},
+        )
+    else:
+        result = Response(content, media_type="application/json")
+    if stored is None:
+        return result
+    # Rapport d'une période close : ne change plus jusqu'à une remise à zéro
+    tag = f'"report.{kind}.{period}.{format}.{stored.generated_at:%Y%m%d%H%M%S%f}"'
+    return http_cache.not_modified(request, result, tag) or result
+
+# Maintenance (par agence, en-tête X-Agence)
+@app.post("/reset", response_model=schemas.MaintenanceReport)
+def reset_database(db: Session = Depends(get_db)):
+    if not settings.ALLOW_RESET:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Reset disabled")
+    return crud.reset_database(db)
+
+@app.post("/seed", response_model=schemas.MaintenanceReport, status_code=status.HTTP_201_CREATED)
+def seed_database(
+    agents: int = Query(50, ge=1, le=10000),
+    tickets: int = Query(10000, ge=0, le=5_000_000),
+    days: int = Query(30, ge=1, le=3650),
+    seed: int = 42,
+    reset: bool = False,
+    db: Session = Depends(get_db),
+):
+    if reset and not settings.ALLOW_RESET:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Reset disabled")
+    report = crud.seed_database(db, agents=agents, tickets=tickets, days=days, seed_value=seed, reset=reset)
+    if report is None:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Database is not empty")
+    return report
+
+@app.get("/maintenance/jobs", response_model=list[schemas.MaintenanceJob])
+def read_maintenance_jobs():
+    return maintenance.scheduler.report()
+
+# Métriques
+@app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+def read_metrics():
+    return PlainTextResponse(
+        metrics.registry.render(), media_type="text/plain; version=0.0.4"
+    )
@@ -0,0 +1,68 @@
+"""Lanceur de production : l'API sur plusieurs processus workers
+
+Usage :
+    python -m api.serve --workers 4 --port 8000
+
+Le schéma est préparé une seule fois avant le démarrage des workers, la base
+passe en journal WAL (lectures concurrentes entre processus) et un fichier
+de coordination permet aux caches de chaque worker de rester cohérents.
+"""
+import argparse
+import os
+import sys
+import tempfile
+
+import uvicorn
+
+
+def prepare_database():
+    from sqlalchemy import text
+
+    from .src import schema
+    from .src.routing import router
+
+    # Une base par agence : chacune est préparée de la même façon
+    for engine in router.engines.values():
+        schema.ensure_schema(engine)
+        if engine.dialect.name == "sqlite":
+            with engine.connect() as conn:
+                # Persistant dans le fichier : lecteurs et écrivain ne se bloquent plus entre workers
+                conn.execute(text("PRAGMA journal_mode=WAL"))
+        # Les workers ouvrent leurs propres connexions
+        engine.dispose()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="API Smart Agence multi-workers")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--log-level", default="info")
+    args = parser.parse_args(argv)
+
+    if args.workers > 1 and sys.platform == "win32":
+        parser.error("le mode multi-workers coordonné nécessite un système POSIX")
+
+    prepare_database()
+    os.environ["SCHEMA_READY"] = "1"
+
+    if args.workers > 1:
+        from .src import coordination
+
+        runtime_dir = tempfile.mkdtemp(prefix="smart_agence_")
+        coordination_file = os.path.join(runtime_dir, "coordination")
+        coordination.create_file(coordination_file)
+        # Les workers (processus "spawn") héritent de l'environnement
+        os.environ["COORDINATION_FILE"] = coordination_file
+
+    uvicorn.run(
+        "api.main:app",
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        log_level=args.log_level,
+    )
+
+
+if __name__ == "__main__":
+    main()
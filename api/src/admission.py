@@ -0,0 +1,224 @@
+"""Contrôle d'admission : limites de débit, file prioritaire et délestage
+
+Chaque requête est rangée dans une classe :
+
+- `kiosk` : création de ticket et changements de statut (bornes, guichets) ;
+- `analytics` : agrégats des tableaux de bord (charge, synthèse, profils) ;
+- `read` : tout le reste.
+
+Un seau à jetons par client et par classe limite le débit (`429` avec
+`Retry-After` une fois le seau vide). Le nombre de requêtes traitées en même
+temps par le worker est borné ; au-delà, les requêtes attendent dans une file
+où les bornes passent avant les lectures, et les lectures avant les tableaux
+de bord. Quand la file d'une classe dépasse son seuil, ou qu'une requête y
+attend trop longtemps, elle est délestée (`429`) plutôt que de faire grossir
+la latence de toutes les autres.
+
+Les limites s'appliquent par worker : avec N workers, la capacité totale est
+N fois celle configurée.
+"""
+import asyncio
+import heapq
+import itertools
+import json
+import math
+import re
+import time
+from collections import OrderedDict
+
+from ..config import settings
+from .metrics import registry
+
+KIOSK = "kiosk"
+READ = "read"
+ANALYTICS = "analytics"
+# Ordre de passage dans la file d'attente
+PRIORITIES = {KIOSK: 0, READ: 1, ANALYTICS: 2}
+
+_ROUTE_CLASSES = [
+    ("POST", re.compile(r"^/tickets/?$"), KIOSK),
+    ("POST", re.compile(r"^/tickets/(\d+/status|batch)$"), KIOSK),
+    ("GET", re.compile(r"^/(agents/workload|agences/summary|forecast/profile|tickets/open/counts)$"), ANALYTICS),
+    ("GET", re.compile(r"^/reports/"), ANALYTICS),
+]
+# Jamais limités : supervision
+EXEMPT_PATHS = {"/metrics"}
+
+# Nombre maximal de seaux gardés (clients récents) ; les plus anciens sont oubliés
+MAX_BUCKETS = 10000
+
+
+def route_class(method, path):
+    for route_method, pattern, name in _ROUTE_CLASSES:
+        if method == route_method and pattern.match(path):
+            return name
+    return READ
+
+
+class TokenBucket:
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def take(self):
+        """Consomme un jeton ; renvoie 0 ou le délai (s) avant le prochain jeton"""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+
+class AdmissionController:
+    """État d'admission d'un worker ; manipulé uniquement depuis la boucle asyncio"""
+
+    def __init__(self, max_concurrency, limits, max_queue, queue_timeout):
+        self.max_concurrency = max_concurrency
+        # {classe: (jetons par seconde, rafale)} ; débit nul : pas de limite
+        self.limits = limits
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        self._buckets = OrderedDict()
+        self._waiters = []
+        self._order = itertools.count()
+        # Requêtes en attente par classe (les entrées abandonnées de la file n'y figurent plus)
+        self.queued = {name: 0 for name in PRIORITIES}
+
+    def load(self):
+        return self.in_flight, dict(self.queued)
+
+    def check_rate(self, client, name):
+        """0 si le client a encore du débit pour cette classe, sinon le délai d'attente conseillé"""
+        rate, burst = self.limits.get(name, (0, 0))
+        if rate <= 0:
+            return 0
+        key = (client, name)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(rate, burst)
+            if len(self._buckets) > MAX_BUCKETS:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+        return bucket.take()
+
+    async def acquire(self, name):
+        """Attend une place de traitement ; False si la requête est délestée"""
+        if self.in_flight < self.max_concurrency and not any(self.queued.values()):
+            self.in_flight += 1
+            return True
+        if self.queued[name] >= self.max_queue.get(name, 0):
+            return False
+        future = asyncio.get_running_loop().create_future()
+        entry = [PRIORITIES[name], next(self._order), future]
+        heapq.heappush(self._waiters, entry)
+        self.queued[name] += 1
+        try:
+            # La place est transmise par `release` (in_flight déjà compté)
+            await asyncio.wait_for(asyncio.shield(future), self.queue_timeout)
+        except asyncio.TimeoutError:
+            # Place attribuée au moment de l'expiration : elle est gardée
+            return not self._withdraw(entry)
+        except BaseException:
+            # Requête annulée pendant l'attente (client parti, arrêt du worker) : elle quitte
+            # la file, et une place qui lui a été transmise entre-temps passe à la suivante
+            if not self._withdraw(entry):
+                self.release()
+            raise
+        finally:
+            self.queued[name] -= 1
+        return True
+
+    def _withdraw(self, entry):
+        """Retire une attente de la file ; False si une place lui a déjà été transmise"""
+        future = entry[2]
+        if future.done():
+            return False
+        future.cancel()
+        self._waiters.remove(entry)
+        heapq.heapify(self._waiters)
+        return True
+
+    def release(self):
+        # Place rendue : transmise à la requête en attente la plus prioritaire
+        while self._waiters:
+            future = heapq.heappop(self._waiters)[2]
+            if not future.done():
+                future.set_result(None)
+                return
+        self.in_flight -= 1
+
+
+async def _reject(send, retry_after, detail):
+    body = json.dumps({"detail": detail}).encode()
+    await send({
+        "type": "http.response.start",
+        "status": 429,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+            (b"retry-after", str(max(1, math.ceil(retry_after))).encode()),
+        ],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+class AdmissionMiddleware:
+    """Middleware ASGI appliquant le contrôle d'admission avant le routage"""
+
+    def __init__(self, app, controller, retry_after=1):
+        self.app = app
+        self.controller = controller
+        self.retry_after = retry_after
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in EXEMPT_PATHS:
+            await self.app(scope, receive, send)
+            return
+        controller = self.controller
+        name = route_class(scope["method"], scope["path"])
+        client = scope["client"][0] if scope.get("client") else "unknown"
+        wait = controller.check_rate(client, name)
+        if wait:
+            registry.record_admission(name, "rate_limited")
+            await _reject(send, wait, "Rate limit exceeded")
+            return
+        if not await controller.acquire(name):
+            registry.record_admission(name, "shed")
+            await _reject(send, self.retry_after, "Server busy, retry later")
+            return
+        registry.record_admission(name, "admitted")
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            controller.release()
+
+
+def _create():
+    controller = AdmissionController(
+        settings.ADMISSION_MAX_CONCURRENCY,
+        limits={
+            KIOSK: (settings.RATE_LIMIT_KIOSK_PER_SECOND, settings.RATE_LIMIT_KIOSK_BURST),
+            READ: (settings.RATE_LIMIT_READ_PER_SECOND, settings.RATE_LIMIT_READ_BURST),
+            ANALYTICS: (settings.RATE_LIMIT_ANALYTICS_PER_SECOND, settings.RATE_LIMIT_ANALYTICS_BURST),
+        },
+        max_queue={
+            KIOSK: settings.ADMISSION_QUEUE_KIOSK,
+            READ: settings.ADMISSION_QUEUE_READ,
+            ANALYTICS: settings.ADMISSION_QUEUE_ANALYTICS,
+        },
+        queue_timeout=settings.ADMISSION_QUEUE_TIMEOUT_SECONDS,
+    )
+    if settings.ADMISSION_ENABLED:
+        registry.admission_load = controller.load
+    return controller
+
+
+controller = _create()
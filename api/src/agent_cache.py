@@ -0,0 +1,92 @@
+"""Cache des agents partagé par toutes les requêtes d'un worker
+
+La table des agents est petite et change rarement : chaque agence en garde
+une copie résumée en mémoire (nom, prénoms, catégorie), étiquetée par la
+version de la table lue dans la même transaction que les agents. Chaque
+lecture compare l'étiquette à la version courante, elle aussi gardée en
+mémoire par `changes.TableVersions` : tant qu'aucun agent n'a été écrit,
+aucune requête SQL.
+
+Toute création, modification ou suppression d'agent, comme une remise à zéro
+ou un chargement de données, est journalisée et change la version après
+validation, dans ce worker comme dans les autres (coordination des caches) :
+la lecture suivante recharge les agents, en une requête.
+
+La création d'un ticket ou d'un événement vérifie ainsi `agent_id` sans
+requête, et les tickets renvoyés embarquent la fiche de leur agent sans
+jointure. Les agents partis restent dans le cache pour les tickets clos qui
+les référencent, mais ne sont plus assignables.
+"""
+import threading
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from ..config import settings
+from . import changes, models, schemas
+
+
+class UnknownAgent(LookupError):
+    def __init__(self, agent_id):
+        super().__init__(f"Agent {agent_id} not found")
+        self.agent_id = agent_id
+
+
+class AgentCache:
+    def __init__(self):
+        # (version de la table des agents, {id: fiche résumée}, identifiants des agents partis)
+        self._snapshot = (None, {}, frozenset())
+        self._lock = threading.Lock()
+
+    def agents(self, db: Session):
+        """{id: fiche résumée} des agents de l'agence, partis compris, rechargés si la table a changé"""
+        return self._current(db)[1]
+
+    def _current(self, db: Session):
+        table_versions = changes.versions_for(db)
+        version = table_versions.get(db, changes.AGENTS)
+        snapshot = self._snapshot
+        if snapshot[0] == version:
+            return snapshot
+        with self._lock:
+            # Rechargé entre-temps par une autre requête
+            snapshot = self._snapshot
+            if snapshot[0] == version:
+                return snapshot
+            # Version et agents lus dans la même transaction : l'étiquette décrit exactement
+            # le contenu chargé
+            loaded = changes.read_version(db, changes.AGENTS)
+            if loaded != version:
+                # Version gardée en mémoire différente (journal purgé depuis, transaction plus
+                # ancienne que la dernière écriture) : relue à la prochaine lecture
+                table_versions.invalidate({changes.AGENTS})
+            agent = models.Agent
+            agents, retired = {}, set()
+            for agent_id, nom, prenoms, categorie, deleted_at in db.execute(
+                select(agent.id, agent.nom, agent.prenoms, agent.categorie, agent.deleted_at)
+            ):
+                agents[agent_id] = schemas.AgentSummary(id=agent_id, nom=nom, prenoms=prenoms, categorie=categorie.value)
+                if deleted_at is not None:
+                    retired.add(agent_id)
+            snapshot = self._snapshot = (loaded, agents, frozenset(retired))
+        return snapshot
+
+    def get(self, db: Session, agent_id):
+        """Fiche résumée de l'agent ; None s'il n'existe pas ou est parti"""
+        _, agents, retired = self._current(db)
+        return None if agent_id in retired else agents.get(agent_id)
+
+    def require(self, db: Session, agent_id):
+        """Fiche résumée de l'agent ; UnknownAgent s'il n'existe pas ou est parti"""
+        summary = self.get(db, agent_id)
+        if summary is None:
+            raise UnknownAgent(agent_id)
+        return summary
+
+
+def cache_for(db: Session):
+    """Cache de l'agence à laquelle la session est rattachée"""
+    return caches[db.info.get("agence", settings.AGENCE_PAR_DEFAUT)]
+
+
+caches = {agence: AgentCache() for agence in settings.AGENCES}
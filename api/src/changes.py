@@ -0,0 +1,180 @@
+"""Journal des modifications (change data capture) pour la synchronisation incrémentale
+
+Chaque écriture de crud ajoute, dans sa propre transaction, une ligne par
+ligne modifiée : numéro de séquence, table, identifiant, opération. Un client
+qui garde une copie locale des agents et des tickets demande
+`GET /changes?since=<seq>` et n'applique que les lignes modifiées depuis,
+accompagnées de leur état courant.
+
+SQLite sérialise les écrivains : les numéros sont attribués dans l'ordre des
+validations, un client ne peut donc pas manquer une modification déjà
+validée avec un numéro inférieur à son curseur.
+
+Une remise à zéro ou un chargement de données (`POST /reset`, `POST /seed`)
+est journalisé par une seule opération `reset` : le client recharge alors les
+listes complètes.
+
+Le journal donne aussi la version de chaque table (numéro de sa dernière
+modification), gardée en mémoire par `TableVersions` et servant aux ETag des
+listes : une liste inchangée est reconnue sans aucune requête SQL.
+"""
+import threading
+from datetime import datetime
+
+from sqlalchemy import event, func, insert, select
+from sqlalchemy.orm import Session
+
+from ..config import settings
+from . import models
+from .coordination import coordinator
+
+INSERT = "insert"
+UPDATE = "update"
+DELETE = "delete"
+RESET = "reset"
+
+AGENTS = models.Agent.__tablename__
+TICKETS = models.Ticket.__tablename__
+EVENEMENTS = models.Evenement.__tablename__
+TABLES = (AGENTS, TICKETS, EVENEMENTS)
+
+
+def record(db: Session, table, row_ids, operation):
+    """Journalise les lignes modifiées, dans la transaction en cours (avant validation)"""
+    now = datetime.utcnow()
+    rows = [
+        {"table_name": table, "row_id": row_id, "operation": operation, "date": now}
+        for row_id in row_ids
+    ]
+    if rows:
+        db.execute(insert(models.Change), rows)
+        db.info.setdefault("changes_recorded", set()).add(table)
+
+
+def last_seq(db: Session):
+    return db.scalar(select(func.max(models.Change.seq))) or 0
+
+
+def record_reset(db: Session, previous_seq):
+    """Journalise le remplacement complet du contenu de la base
+
+    Le journal a pu être vidé avec la base : la séquence reprend après
+    `previous_seq`, relevé avant la remise à zéro, pour que les curseurs des
+    clients restent valides.
+    """
+    db.add(models.Change(
+        seq=max(previous_seq, last_seq(db)) + 1,
+        table_name="*",
+        operation=RESET,
+        date=datetime.utcnow(),
+    ))
+    db.info.setdefault("changes_recorded", set()).add(RESET)
+
+
+def since(db: Session, seq: int, limit: int = 1000):
+    """Modifications postérieures à `seq` ; (dernier numéro, resynchronisation requise, modifications)
+
+    Une resynchronisation complète est demandée quand le curseur précède les
+    modifications conservées (journal purgé), dépasse le dernier numéro (base
+    d'une autre instance) ou qu'une remise à zéro a eu lieu depuis.
+    """
+    latest = last_seq(db)
+    first = db.scalar(select(func.min(models.Change.seq)))
+    if seq > latest or (first is not None and seq < first - 1):
+        return latest, True, []
+    entries = db.scalars(
+        select(models.Change).where(models.Change.seq > seq).order_by(models.Change.seq).limit(limit)
+    ).all()
+    if any(entry.operation == RESET for entry in entries):
+        # Contenu remplacé : le rechargement complet couvre tout jusqu'à `latest`
+        return latest, True, []
+    return latest, False, entries
+
+
+class TableVersions:
+    """Version courante des tables d'une agence, relue seulement après une écriture dans la table
+
+    La version d'une table est le numéro de sa dernière modification, ou de la
+    dernière remise à zéro ; si le journal a été purgé au-delà, le numéro qui
+    précède la plus ancienne entrée conservée (plus grand que toute
+    modification purgée). Deux versions égales désignent donc le même contenu.
+    """
+
+    def __init__(self):
+        self._versions = None
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def invalidate(self, tables=None):
+        """Oublie la version des tables modifiées (de toutes si None)"""
+        with self._lock:
+            self._generation += 1
+            if tables is None or self._versions is None:
+                self._versions = None
+            else:
+                self._versions = {table: version for table, version in self._versions.items() if table not in tables}
+
+    def get(self, db: Session, table):
+        coordinator.sync()
+        versions = self._versions
+        if versions is None or table not in versions:
+            generation = self._generation
+            versions = _read_versions(db)
+            with self._lock:
+                # Écriture validée pendant la lecture : le résultat n'est pas gardé
+                if generation == self._generation:
+                    self._versions = versions
+        return versions[table]
+
+
+def _read_versions(db: Session):
+    def last(*tables):
+        return select(func.max(models.Change.seq)).where(models.Change.table_name.in_(tables)).scalar_subquery()
+
+    first, *lasts = db.execute(select(
+        select(func.min(models.Change.seq)).scalar_subquery(),
+        *(last(table, "*") for table in TABLES),
+    )).one()
+    floor = first - 1 if first is not None else 0
+    return {table: max(version or 0, floor) for table, version in zip(TABLES, lasts)}
+
+
+def read_version(db: Session, table):
+    """Version de la table lue dans la transaction en cours, sans passer par le cache"""
+    return _read_versions(db)[table]
+
+
+def versions_for(db: Session):
+    return versions[db.info.get("agence", settings.AGENCE_PAR_DEFAUT)]
+
+
+@event.listens_for(Session, "after_commit")
+def _after_commit(db):
+    # Après validation seulement : une lecture concurrente ne peut pas remettre en cache l'ancienne version.
+    # Seules les tables écrites sont oubliées : une création de ticket ne fait pas relire la version des agents
+    tables = db.info.pop("changes_recorded", None)
+    if tables:
+        agence = db.info.get("agence", settings.AGENCE_PAR_DEFAUT)
+        if RESET in tables:
+            versions[agence].invalidate()
+            coordinator.publish_clear(_cache_ids[agence])
+            return
+        versions[agence].invalidate(tables)
+        for table in tables:
+            coordinator.publish(_cache_ids[agence], TABLES.index(table))
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _after_rollback(db, previous_transaction):
+    db.info.pop("changes_recorded", None)
+
+
+versions = {agence: TableVersions() for agence in settings.AGENCES}
+_cache_ids = {
+    # Clé publiée : rang de la table modifiée dans TABLES
+    agence: coordinator.register(
+        lambda key, table_versions=table_versions: table_versions.invalidate({TABLES[key]}),
+        table_versions.invalidate,
+    )
+    for agence, table_versions in versions.items()
+}
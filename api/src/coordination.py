@@ -0,0 +1,115 @@
+"""Coordination des caches entre workers uvicorn
+
+Chaque worker garde ses propres caches (aucun état partagé à lire sur le
+chemin chaud). Les écritures publient les clés modifiées dans un journal
+circulaire en mémoire partagée (fichier mmap) ; avant d'utiliser un cache,
+un worker applique les invalidations publiées par les autres depuis son
+dernier passage. Lire la tête du journal coûte une lecture mémoire.
+
+Le journal n'est actif que si `COORDINATION_FILE` est défini (mode
+multi-workers lancé par `api.serve`) ; sinon toutes les opérations sont
+des no-op.
+"""
+import mmap
+import os
+import struct
+import threading
+
+from ..config import settings
+
+HEADER = struct.Struct("<Q")
+ENTRY = struct.Struct("<IIq")
+RING_SIZE = 65536
+FILE_SIZE = HEADER.size + ENTRY.size * RING_SIZE
+# Marge de sécurité : au-delà, des entrées ont pu être écrasées pendant la lecture
+MAX_LAG = RING_SIZE - 1024
+# Clé réservée : le cache doit être vidé entièrement (base réinitialisée)
+CLEAR_ALL = -1
+
+
+def create_file(path):
+    """Crée (ou remet à zéro) le fichier de coordination avant le démarrage des workers"""
+    with open(path, "wb") as f:
+        f.truncate(FILE_SIZE)
+
+
+class Coordinator:
+    def __init__(self, path):
+        import fcntl
+
+        self._fcntl = fcntl
+        self._fd = os.open(path, os.O_RDWR)
+        self._map = mmap.mmap(self._fd, FILE_SIZE)
+        self._lock = threading.Lock()
+        self._caches = []
+        self._seen = HEADER.unpack_from(self._map, 0)[0]
+
+    def register(self, discard, clear):
+        """Déclare un cache ; renvoie son identifiant dans le journal"""
+        self._caches.append((discard, clear))
+        return len(self._caches) - 1
+
+    def publish(self, cache_id, key):
+        """Signale aux autres workers que `key` a changé dans le cache `cache_id`"""
+        self._fcntl.flock(self._fd, self._fcntl.LOCK_EX)
+        try:
+            head = HEADER.unpack_from(self._map, 0)[0]
+            ENTRY.pack_into(
+                self._map, HEADER.size + ENTRY.size * (head % RING_SIZE),
+                cache_id, os.getpid(), key,
+            )
+            # L'entrée est écrite avant d'avancer la tête : un lecteur ne voit que des entrées complètes
+            HEADER.pack_into(self._map, 0, head + 1)
+        finally:
+            self._fcntl.flock(self._fd, self._fcntl.LOCK_UN)
+
+    def publish_clear(self, cache_id):
+        """Signale aux autres workers que tout le cache `cache_id` est périmé"""
+        self.publish(cache_id, CLEAR_ALL)
+
+    def sync(self):
+        """Applique les invalidations publiées par les autres workers"""
+        head = HEADER.unpack_from(self._map, 0)[0]
+        if head == self._seen:
+            return
+        with self._lock:
+            if head - self._seen > MAX_LAG:
+                for _, clear in self._caches:
+                    clear()
+                self._seen = head
+                return
+            pid = os.getpid()
+            for seq in range(self._seen, head):
+                cache_id, writer_pid, key = ENTRY.unpack_from(
+                    self._map, HEADER.size + ENTRY.size * (seq % RING_SIZE)
+                )
+                if writer_pid != pid and cache_id < len(self._caches):
+                    discard, clear = self._caches[cache_id]
+                    if key == CLEAR_ALL:
+                        clear()
+                    else:
+                        discard(key)
+            self._seen = head
+
+
+class _Disabled:
+    def register(self, discard, clear):
+        return 0
+
+    def publish(self, cache_id, key):
+        pass
+
+    def publish_clear(self, cache_id):
+        pass
+
+    def sync(self):
+        pass
+
+
+def _open():
+    if not settings.COORDINATION_FILE:
+        return _Disabled()
+    return Coordinator(settings.COORDINATION_FILE)
+
+
+coordinator = _open()
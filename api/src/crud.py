@@ -1,63 +1,491 @@
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from sqlalchemy import String, bindparam, func, insert, literal, select, update
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
-from . import models, schemas
+from . import models, schemas, transitions, idempotency, routing, forecast, seed, open_tickets, changes, search, offboarding, reports, agent_cache
+
+# Lectures fréquentes construites une seule fois : leur clé de cache est calculée au premier
+# appel et leur forme compilée réutilisée ensuite, seuls les paramètres liés changent
+_AGENTS_PAGE = (
+    select(models.Agent).where(models.Agent.deleted_at.is_(None)).offset(bindparam("skip")).limit(bindparam("limit"))
+)
+_TICKETS_PAGE = select(models.Ticket).offset(bindparam("skip")).limit(bindparam("limit"))
+
+class VersionConflict(Exception):
+    """Modification refusée : la ligne a changé depuis la version lue par le client"""
+
+    def __init__(self, current_version):
+        super().__init__(f"Modified concurrently (current version: {current_version})")
+        self.current_version = current_version
+
+class DuplicateEmail(Exception):
+    """Email déjà utilisé par un autre agent présent"""
+
+    def __init__(self, email):
+        super().__init__(f"Email already used by another agent: {email}")
+        self.email = email
+
+@contextmanager
+def _unique_email(db: Session, email):
+    """Traduit la violation de l'index unique sur l'email en DuplicateEmail (transaction annulée)"""
+    try:
+        yield
+    except IntegrityError as exc:
+        if "email" not in str(exc.orig):
+            raise
+        db.rollback()
+        raise DuplicateEmail(email) from exc
+
+def _patch_row(db: Session, model, row_id: int, values: dict, expected_version: int = None, visible=None):
+    """Un seul UPDATE ... RETURNING des colonnes fournies (version incrémentée) ; None si la ligne n'existe pas
+
+    Avec `expected_version`, la modification n'a lieu que si la ligne en est
+    toujours à cette version ; sinon `VersionConflict`. `visible` : condition
+    supplémentaire hors de laquelle la ligne est traitée comme absente.
+    """
+    table = model.__table__
+    match = table.c.id == row_id
+    if visible is not None:
+        match &= visible
+    if not values:
+        row = db.execute(select(*table.c).where(match)).first()
+        if row is not None and expected_version not in (None, row.version):
+            raise VersionConflict(row.version)
+        return row
+    statement = update(table).where(match)
+    if expected_version is not None:
+        statement = statement.where(table.c.version == expected_version)
+    row = db.execute(statement.values(**values, version=table.c.version + 1).returning(*table.c)).first()
+    if row is None:
+        # Ligne absente ou modifiée entre-temps : une lecture, seulement en cas d'échec
+        current_version = db.scalar(select(table.c.version).where(match))
+        db.rollback()
+        if current_version is not None:
+            raise VersionConflict(current_version)
+    return row
 
 # Agents
 def create_agent(db: Session, agent: schemas.AgentCreate):
     db_agent = models.Agent(**agent.dict())
     db.add(db_agent)
+    with _unique_email(db, agent.email):
+        db.flush()
+    search.index(db, [db_agent])
+    changes.record(db, changes.AGENTS, [db_agent.id], changes.INSERT)
     db.commit()
     db.refresh(db_agent)
     return db_agent
 
 def get_agents(db: Session, skip: int = 0, limit: int = 100):
-    return db.query(models.Agent).offset(skip).limit(limit).all()
+    return db.scalars(_AGENTS_PAGE, {"skip": skip, "limit": limit}).all()
+
+def search_agents(db: Session, query: str, limit: int = 20):
+    return search.search_agents(db, query, limit=limit)
 
 def get_agent(db: Session, agent_id: int):
-    return db.query(models.Agent).filter(models.Agent.id == agent_id).first()
+    # Clé primaire : carte d'identité de la session, sinon requête de chargement précompilée
+    agent = db.get(models.Agent, agent_id)
+    # Agent parti : absent pour l'API, seuls ses tickets et événements le référencent encore
+    return agent if agent is not None and agent.deleted_at is None else None
 
 def update_agent(db: Session, agent_id: int, agent: schemas.AgentCreate):
-    db_agent = get_agent(db, agent_id)
-    if db_agent:
-        for key, value in agent.dict().items():
-            setattr(db_agent, key, value)
-        db.commit()
-        db.refresh(db_agent)
-    return db_agent
+    return patch_agent(db, agent_id, agent.dict())
 
-def delete_agent(db: Session, agent_id: int):
-    db_agent = get_agent(db, agent_id)
-    if db_agent:
-        db.delete(db_agent)
+def patch_agent(db: Session, agent_id: int, fields: dict, expected_version: int = None):
+    """Modifie seulement les champs fournis ; renvoie la ligne à jour, None si l'agent n'existe pas"""
+    with _unique_email(db, fields.get("email")):
+        row = _patch_row(db, models.Agent, agent_id, fields, expected_version, visible=models.Agent.deleted_at.is_(None))
+    if row is not None and fields:
+        search.index(db, [row])
+        changes.record(db, changes.AGENTS, [agent_id], changes.UPDATE)
         db.commit()
-    return db_agent
+    return row
+
+def delete_agent(db: Session, agent_id: int, reassign: bool = True):
+    report = delete_agents(db, [agent_id], reassign=reassign)
+    return report["deleted"][0] if report else None
+
+def delete_agents(db: Session, agent_ids, reassign: bool = True):
+    """Départ d'agents en une transaction, tickets ouverts répartis entre les agents restants
+
+    Les agents sont marqués partis, pas supprimés : tickets clos et événements
+    gardent leur agent. Renvoie None si aucun des agents n'existe (ou s'ils
+    sont tous déjà partis).
+    """
+    deleted, reassigned, unassigned = offboarding.remove_agents(db, agent_ids, reassign=reassign)
+    if not deleted:
+        db.rollback()
+        return None
+    deleted_ids = [agent.id for agent in deleted]
+    search.unindex(db, deleted_ids)
+    changes.record(db, changes.AGENTS, deleted_ids, changes.DELETE)
+    changes.record(db, changes.TICKETS, sorted([*reassigned, *unassigned]), changes.UPDATE)
+    db.commit()
+    open_tickets.changed(db, [*reassigned, *unassigned])
+    return {
+        "deleted": deleted,
+        "reassigned": [
+            {"ticket_id": ticket_id, "agent_id": agent_id} for ticket_id, agent_id in sorted(reassigned.items())
+        ],
+        "unassigned": sorted(unassigned),
+    }
 
 # Tickets
-def create_ticket(db: Session, ticket: schemas.TicketCreate):
+def create_ticket(db: Session, ticket: schemas.TicketCreate, idempotency_key: str = None):
+    if idempotency_key is not None:
+        request_fingerprint = idempotency.fingerprint(ticket)
+        original_id = idempotency.store.lookup(db, "tickets", idempotency_key, request_fingerprint)
+        if original_id is not None:
+            return get_ticket(db, original_id)
+    # Agent vérifié dans le cache (sans requête) ; UnknownAgent s'il n'existe pas
+    agent_cache.cache_for(db).require(db, ticket.agent_id)
     db_ticket = models.Ticket(**ticket.dict())
     db.add(db_ticket)
-    db.commit()
+    db.flush()
+    changes.record(db, changes.TICKETS, [db_ticket.id], changes.INSERT)
+    if idempotency_key is not None:
+        original_id = idempotency.commit_once(db, "tickets", idempotency_key, request_fingerprint, db_ticket)
+        if original_id is not None:
+            return get_ticket(db, original_id)
+    else:
+        db.commit()
     db.refresh(db_ticket)
+    # Un ticket neuf est en attente : la première transition ne coûte aucune lecture
+    transitions.state_cache_for(db).put(db_ticket.id, transitions.INITIAL_STATUS)
+    open_tickets.opened(db, db_ticket)
     return db_ticket
 
 def get_tickets(db: Session, skip: int = 0, limit: int = 100):
-    return db.query(models.Ticket).offset(skip).limit(limit).all()
+    return db.scalars(_TICKETS_PAGE, {"skip": skip, "limit": limit}).all()
+
+# Colonnes autorisées pour le tri de la liste paginée ("-" en préfixe : ordre décroissant)
+TICKET_SORT_COLUMNS = {
+    "id": models.Ticket.id,
+    "date_creation": models.Ticket.date_creation,
+    "categorie_service": models.Ticket.categorie_service,
+    "agent_id": models.Ticket.agent_id,
+}
+
+def get_tickets_page(db: Session, page: int = 1, page_size: int = 50, sort: str = "-id",
+                     categorie_service: str = None, agent_id: int = None, statut: str = None):
+    """Une page de tickets filtrés et triés côté base, avec le nombre total de résultats"""
+    query = select(models.Ticket)
+    if categorie_service is not None:
+        query = query.where(models.Ticket.categorie_service == categorie_service)
+    if agent_id is not None:
+        query = query.where(models.Ticket.agent_id == agent_id)
+    if statut is not None:
+        # Statut courant = dernier événement (index sur ticket_id), statut initial sans événement
+        last_status = (
+            select(models.Evenement.statut)
+            .where(models.Evenement.ticket_id == models.Ticket.id)
+            .order_by(models.Evenement.id.desc())
+            .limit(1)
+            .scalar_subquery()
+        )
+        if statut == transitions.INITIAL_STATUS:
+            # Une seule évaluation de la sous-requête par ticket
+            query = query.where(func.coalesce(last_status, statut, type_=String) == statut)
+        else:
+            query = query.where(last_status == models.TicketStatus(statut))
+    total = db.scalar(select(func.count()).select_from(query.subquery()))
+    column = TICKET_SORT_COLUMNS[sort.lstrip("-")]
+    order = column.desc() if sort.startswith("-") else column.asc()
+    # L'identifiant départage les ex aequo : l'ordre des pages est stable
+    tickets = db.scalars(
+        query.order_by(order, models.Ticket.id).offset((page - 1) * page_size).limit(page_size)
+    ).all()
+    return total, tickets
 
 def get_ticket(db: Session, ticket_id: int):
-    return db.query(models.Ticket).filter(models.Ticket.id == ticket_id).first()
+    return db.get(models.Ticket, ticket_id)
 
 def update_ticket(db: Session, ticket_id: int, ticket: schemas.TicketCreate):
-    db_ticket = get_ticket(db, ticket_id)
-    if db_ticket:
-        for key, value in ticket.dict().items():
-            setattr(db_ticket, key, value)
+    return patch_ticket(db, ticket_id, ticket.dict())
+
+def patch_ticket(db: Session, ticket_id: int, fields: dict, expected_version: int = None):
+    """Modifie seulement les champs fournis ; renvoie la ligne à jour, None si le ticket n'existe pas"""
+    if fields.get("agent_id") is not None:
+        agent_cache.cache_for(db).require(db, fields["agent_id"])
+    row = _patch_row(db, models.Ticket, ticket_id, fields, expected_version)
+    if row is not None and fields:
+        changes.record(db, changes.TICKETS, [ticket_id], changes.UPDATE)
         db.commit()
-        db.refresh(db_ticket)
-    return db_ticket
+        open_tickets.changed(db, [ticket_id])
+    return row
 
 # Événements
-def create_evenement(db: Session, ticket_id: int, evenement: schemas.EvenementCreate):
-    db_evenement = models.Evenement(ticket_id=ticket_id, **evenement.dict())
-    db.add(db_evenement)
+def create_evenement(db: Session, ticket_id: int, evenement: schemas.EvenementCreate,
+                     idempotency_key: str = None):
+    scope = f"tickets/{ticket_id}/status"
+    with transitions.state_cache_for(db).ticket_lock(ticket_id):
+        # Rejeu d'une requête déjà appliquée : on renvoie l'événement d'origine
+        if idempotency_key is not None:
+            request_fingerprint = idempotency.fingerprint(evenement)
+            original_id = idempotency.store.lookup(db, scope, idempotency_key, request_fingerprint)
+            if original_id is not None:
+                return db.get(models.Evenement, original_id)
+        statut = transitions.current_state(db, ticket_id)
+        if statut is None:
+            return None
+        agent_cache.cache_for(db).require(db, evenement.agent_id)
+        transitions.check_transition(statut, evenement.statut.value)
+        # Le statut lu (cache de ce worker) a pu changer dans un autre worker : l'événement n'est
+        # écrit que si le statut en base autorise toujours la transition, dans la même instruction
+        db_evenement = db.execute(
+            insert(models.Evenement).from_select(
+                ["ticket_id", "agent_id", "statut", "date"],
+                select(
+                    models.Ticket.id,
+                    literal(evenement.agent_id, models.Evenement.agent_id.type),
+                    literal(evenement.statut, models.Evenement.statut.type),
+                    literal(datetime.utcnow(), models.Evenement.date.type),
+                ).where(models.Ticket.id == ticket_id, transitions.allows(evenement.statut.value)),
+            ).returning(*models.Evenement.__table__.c)
+        ).first()
+        if db_evenement is None:
+            db.rollback()
+            # Transition écrite entre-temps par un autre worker (les statuts ne reviennent jamais
+            # en arrière : elle reste refusée) ou ticket supprimé
+            transitions.state_cache_for(db).discard(ticket_id)
+            statut = transitions.current_state(db, ticket_id)
+            if statut is None:
+                return None
+            raise transitions.InvalidTransition(statut, evenement.statut.value)
+        # Le statut courant du ticket change avec le nouvel événement
+        changes.record(db, changes.EVENEMENTS, [db_evenement.id], changes.INSERT)
+        changes.record(db, changes.TICKETS, [ticket_id], changes.UPDATE)
+        if idempotency_key is not None:
+            original_id = idempotency.commit_once(db, scope, idempotency_key, request_fingerprint, db_evenement)
+            if original_id is not None:
+                return db.get(models.Evenement, original_id)
+        else:
+            db.commit()
+        transitions.record_status(db, ticket_id, evenement.statut.value)
+        open_tickets.status_changed(db, [ticket_id], evenement.statut.value, db_evenement.date)
+        forecast.status_changed(db, [ticket_id], evenement.statut.value)
+    return db_evenement
+
+def get_ticket_state(db: Session, ticket_id: int):
+    return transitions.current_state(db, ticket_id)
+
+def with_states(db: Session, tickets):
+    """Tickets accompagnés de leur statut courant (une requête au plus pour les absents du cache)
+    et de la fiche de leur agent (cache des agents, sans jointure)"""
+    states = transitions.current_states(db, [ticket.id for ticket in tickets])
+    agents = agent_cache.cache_for(db).agents(db)
+    return [
+        schemas.TicketWithState(
+            id=ticket.id,
+            agent_id=ticket.agent_id,
+            date_creation=ticket.date_creation,
+            categorie_service=ticket.categorie_service,
+            description=ticket.description,
+            version=ticket.version,
+            statut=states[ticket.id],
+            agent=agents.get(ticket.agent_id),
+        )
+        for ticket in tickets
+    ]
+
+def update_tickets_batch(db: Session, batch: schemas.TicketBatchUpdate):
+    """Applique un lot de transitions et/ou de réaffectations en une seule transaction
+
+    Tout ou rien : si un ticket est absent ou ne peut pas changer de statut,
+    `InvalidBatch` est levée et rien n'est écrit. Renvoie None si l'agent
+    indiqué n'existe pas. Sans agent indiqué, chaque événement est attribué à
+    l'agent du ticket.
+    """
+    ticket_ids = sorted(set(batch.ticket_ids))
+    if batch.agent_id is not None and agent_cache.cache_for(db).get(db, batch.agent_id) is None:
+        return None
+    state_cache = transitions.state_cache_for(db)
+    with state_cache.tickets_lock(ticket_ids):
+        states = transitions.current_states(db, ticket_ids)
+        errors = []
+        for ticket_id in ticket_ids:
+            statut = states.get(ticket_id)
+            if statut is None:
+                errors.append({"ticket_id": ticket_id, "detail": "Ticket not found"})
+            elif batch.statut is not None and batch.statut.value not in transitions.ALLOWED_TRANSITIONS[statut]:
+                errors.append({"ticket_id": ticket_id, "detail": str(transitions.InvalidTransition(statut, batch.statut.value))})
+        if errors:
+            raise transitions.InvalidBatch(errors)
+
+        if batch.agent_id is not None:
+            db.execute(
+                update(models.Ticket)
+                .where(models.Ticket.id.in_(ticket_ids))
+                .values(agent_id=batch.agent_id, version=models.Ticket.version + 1)
+            )
+        now = datetime.utcnow()
+        if batch.statut is not None:
+            # Un seul INSERT ... SELECT : l'événement est attribué à l'agent (éventuellement
+            # tout juste réaffecté) du ticket
+            evenement_ids = db.scalars(insert(models.Evenement).from_select(
+                ["ticket_id", "agent_id", "statut", "date"],
+                select(
+                    models.Ticket.id,
+                    models.Ticket.agent_id,
+                    literal(batch.statut, models.Evenement.statut.type),
+                    literal(now, models.Evenement.date.type),
+                )
+                # Vérification atomique en base : un autre worker a pu changer un statut depuis la lecture
+                .where(models.Ticket.id.in_(ticket_ids), transitions.allows(batch.statut.value))
+                .order_by(models.Ticket.id),
+            ).returning(models.Evenement.id)).all()
+            if len(evenement_ids) < len(ticket_ids):
+                db.rollback()
+                for ticket_id in ticket_ids:
+                    state_cache.discard(ticket_id)
+                states = transitions.current_states(db, ticket_ids)
+                raise transitions.InvalidBatch([
+                    {"ticket_id": ticket_id, "detail": str(transitions.InvalidTransition(states[ticket_id], batch.statut.value))}
+                    if ticket_id in states else {"ticket_id": ticket_id, "detail": "Ticket not found"}
+                    for ticket_id in ticket_ids
+                    if batch.statut.value not in transitions.ALLOWED_TRANSITIONS.get(states.get(ticket_id), ())
+                ])
+            changes.record(db, changes.EVENEMENTS, evenement_ids, changes.INSERT)
+        changes.record(db, changes.TICKETS, ticket_ids, changes.UPDATE)
+        db.commit()
+        if batch.statut is not None:
+            for ticket_id in ticket_ids:
+                transitions.record_status(db, ticket_id, batch.statut.value)
+                states[ticket_id] = batch.statut.value
+            open_tickets.status_changed(db, ticket_ids, batch.statut.value, now)
+            forecast.status_changed(db, ticket_ids, batch.statut.value)
+        if batch.agent_id is not None:
+            open_tickets.changed(db, ticket_ids)
+
+    tickets = db.scalars(
+        select(models.Ticket).where(models.Ticket.id.in_(ticket_ids)).order_by(models.Ticket.id)
+    ).all()
+    return with_states(db, tickets)
+
+# Agences
+def get_branch_summary(db: Session):
+    """Compteurs d'une agence ; le statut d'un ticket est celui de son dernier événement"""
+    tickets = db.scalar(select(func.count(models.Ticket.id)))
+    tickets_by_service = dict(db.execute(
+        select(models.Ticket.categorie_service, func.count(models.Ticket.id))
+        .group_by(models.Ticket.categorie_service)
+    ).all())
+    latest = (
+        select(func.max(models.Evenement.id).label("id"))
+        .group_by(models.Evenement.ticket_id)
+        .subquery()
+    )
+    tickets_by_status = {
+        statut.value: count
+        for statut, count in db.execute(
+            select(models.Evenement.statut, func.count())
+            .join(latest, models.Evenement.id == latest.c.id)
+            .group_by(models.Evenement.statut)
+        )
+    }
+    # Tickets sans événement : statut initial implicite
+    pending = tickets - sum(tickets_by_status.values())
+    if pending:
+        tickets_by_status[transitions.INITIAL_STATUS] = tickets_by_status.get(transitions.INITIAL_STATUS, 0) + pending
+    return schemas.BranchSummary(
+        agence=routing.branch_of(db),
+        agents=db.scalar(select(func.count(models.Agent.id)).where(models.Agent.deleted_at.is_(None))),
+        tickets=tickets,
+        tickets_by_service=tickets_by_service,
+        tickets_by_status=tickets_by_status,
+    )
+
+# Journal des modifications
+# Tables dont l'état courant accompagne chaque modification (les tickets avec leur statut)
+_CHANGE_SCHEMAS = {
+    changes.AGENTS: (models.Agent, schemas.Agent),
+    changes.EVENEMENTS: (models.Evenement, schemas.Evenement),
+}
+
+def get_changes(db: Session, since: int, limit: int = 1000):
+    """Modifications postérieures à `since`, avec l'état courant des lignes (une requête par table)"""
+    latest, resync, entries = changes.since(db, since, limit)
+    wanted = {}
+    for entry in entries:
+        if entry.operation != changes.DELETE:
+            wanted.setdefault(entry.table_name, set()).add(entry.row_id)
+    current = {}
+    for table, row_ids in wanted.items():
+        if table == changes.TICKETS:
+            tickets = db.scalars(select(models.Ticket).where(models.Ticket.id.in_(row_ids))).all()
+            rows = with_states(db, tickets)
+        else:
+            model, schema = _CHANGE_SCHEMAS[table]
+            rows = [
+                schema.model_validate(row, from_attributes=True)
+                for row in db.scalars(select(model).where(model.id.in_(row_ids)))
+            ]
+        current[table] = {row.id: row.model_dump(mode="json") for row in rows}
+    next_since = entries[-1].seq if entries else latest
+    return schemas.ChangeFeed(
+        last_seq=latest,
+        next_since=next_since,
+        has_more=next_since < latest,
+        resync=resync,
+        changes=[
+            schemas.Change(
+                seq=entry.seq,
+                table=entry.table_name,
+                row_id=entry.row_id,
+                operation=entry.operation,
+                date=entry.date,
+                data=current.get(entry.table_name, {}).get(entry.row_id),
+            )
+            for entry in entries
+        ],
+    )
+
+# Maintenance
+def _forget_caches(db: Session):
+    # Après validation seulement : les autres workers relisent la base dès le vidage reçu
+    transitions.forget_all(db)
+    idempotency.store.forget_all()
+    forecast.forget_all(db)
+    open_tickets.forget_all(db)
+
+def reset_database(db: Session):
+    """Vide la base de l'agence ; la transaction éventuelle de la session est abandonnée"""
+    started = time.perf_counter()
+    db.rollback()
+    previous_seq = changes.last_seq(db)
+    db.rollback()
+    seed.reset(db.get_bind())
+    changes.record_reset(db, previous_seq)
+    db.commit()
+    _forget_caches(db)
+    return schemas.MaintenanceReport(
+        agence=routing.branch_of(db),
+        duration_ms=round((time.perf_counter() - started) * 1000, 1),
+    )
+
+def seed_database(db: Session, agents: int, tickets: int, days: int, seed_value: int, reset: bool = False):
+    """Charge un jeu de données synthétique ; None si la base n'est pas vide (sans `reset`)"""
+    started = time.perf_counter()
+    previous_seq = changes.last_seq(db)
+    if reset:
+        db.rollback()
+        seed.reset(db.get_bind())
+        _forget_caches(db)
+    conn = db.connection()
+    if not reset and not seed.is_empty(conn):
+        db.rollback()
+        return None
+    created = seed.populate(conn, agents=agents, tickets=tickets, days=days, seed=seed_value)
+    # Rapports gardés calculés sur les anciennes données
+    reports.forget_all(db)
+    # Données chargées en masse : une seule entrée, les clients rechargent tout
+    changes.record_reset(db, previous_seq)
     db.commit()
-    db.refresh(db_evenement)
-    return db_evenement
\ No newline at end of file
+    _forget_caches(db)
+    return schemas.MaintenanceReport(
+        agence=routing.branch_of(db),
+        created=created,
+        duration_ms=round((time.perf_counter() - started) * 1000, 1),
+    )
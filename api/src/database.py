@@ -1,12 +1,24 @@
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from ..config import settings
 
-SQLALCHEMY_DATABASE_URL = "sqlite:///./smart_agence.db"
+SQLALCHEMY_DATABASE_URL = settings.DATABASE_URL
 
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
+
+def make_engine(url):
+    """Moteur d'une base de l'API, avec les caches de requêtes compilées et préparées"""
+    connect_args = {"check_same_thread": False}
+    if make_url(url).get_backend_name() == "sqlite":
+        # Chaque connexion garde ses requêtes préparées : les requêtes fréquentes ne sont plus analysées par SQLite
+        connect_args["cached_statements"] = settings.SQLITE_STATEMENT_CACHE
+    return create_engine(url, connect_args=connect_args, query_cache_size=settings.QUERY_CACHE_SIZE)
+
+
+engine = make_engine(SQLALCHEMY_DATABASE_URL)
+SessionLocal = sessionmaker(
+    autocommit=False, autoflush=False, bind=engine, info={"agence": settings.AGENCE_PAR_DEFAUT}
 )
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 Base = declarative_base()
\ No newline at end of file
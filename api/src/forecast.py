@@ -0,0 +1,372 @@
+"""Prévision du temps d'attente à partir des profils horaires historiques
+
+Pour chaque catégorie de service, on tient deux profils par heure de la
+semaine (168 cases) : les arrivées (création des tickets) et les prises en
+charge (événements in_progress). Les profils sont mis à jour de façon
+incrémentale (uniquement les lignes postérieures au dernier identifiant lu)
+et tous les calculs se font sur des tableaux NumPy.
+
+L'attente estimée d'un nouveau ticket est le temps nécessaire, au rythme de
+prise en charge historique des heures à venir, pour servir les tickets de la
+même catégorie encore en attente devant lui. La file est gardée en colonnes
+NumPy (identifiant, catégorie, date de création) : les tickets devant un
+nouveau ticket sont comptés par un masque, et un ticket pris en charge ou
+annulé dans ce worker en sort dès l'écriture validée, sans attendre le
+prochain passage.
+"""
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import DateTime, Integer, cast, func, select
+from sqlalchemy.orm import Session, aliased
+
+from ..config import settings
+from . import models
+from .coordination import coordinator
+
+# NumPy (~70 ms à l'import) n'est chargé qu'au premier calcul, hors du démarrage de l'API
+
+HOURS_PER_WEEK = 168
+# Le 1er janvier 1970 est un jeudi : décalage pour que la case 0 soit lundi 0 h
+_EPOCH_OFFSET_HOURS = 3 * 24
+
+
+def hour_of_week(dates):
+    """Case horaire (0 = lundi 0 h) de chaque date d'un tableau datetime64"""
+    import numpy as np
+
+    hours = np.asarray(dates, dtype="datetime64[h]").astype(np.int64)
+    return (hours + _EPOCH_OFFSET_HOURS) % HOURS_PER_WEEK
+
+
+def _occurrences(first, now):
+    """Nombre de fois où chaque case horaire a été observée entre `first` et `now`"""
+    import numpy as np
+
+    start = np.datetime64(first, "h")
+    total = int((np.datetime64(now, "h") - start).astype(np.int64)) + 1
+    counts = np.full(HOURS_PER_WEEK, total // HOURS_PER_WEEK, dtype=np.float64)
+    offsets = (np.arange(HOURS_PER_WEEK) - hour_of_week(start)) % HOURS_PER_WEEK
+    counts[offsets < total % HOURS_PER_WEEK] += 1
+    # Case pas encore observée (moins d'une semaine d'historique) : rien n'y a été compté
+    return np.maximum(counts, 1)
+
+
+class WaitForecaster:
+    """Profils d'arrivée et de prise en charge d'une agence, mis à jour à la demande"""
+
+    def __init__(self, history_days, queue_hours, refresh_seconds):
+        self.history = timedelta(days=history_days)
+        self.queue_window = timedelta(hours=queue_hours)
+        self.refresh_seconds = refresh_seconds
+        self._lock = threading.Lock()
+        self._reset_state()
+
+    def _reset_state(self):
+        self._rows = {}
+        # Tableaux alloués au premier passage (voir `_allocate`)
+        self.arrivals = self.started = self.service_seconds = self.served = None
+        self.waiting_ids = self.waiting_rows = self.waiting_created = None
+        self.first_seen = None
+        self.last_ticket_id = 0
+        self.last_event_id = 0
+        self._refreshed_at = None
+
+    def reset(self):
+        """Oublie les profils et la file : tout sera relu au prochain passage"""
+        with self._lock:
+            self._reset_state()
+
+    def _allocate(self):
+        import numpy as np
+
+        self.arrivals = np.zeros((0, HOURS_PER_WEEK))
+        self.started = np.zeros((0, HOURS_PER_WEEK))
+        self.service_seconds = np.zeros(0)
+        self.served = np.zeros(0)
+        # Tickets en attente, en colonnes : identifiant, ligne de la catégorie, date de création
+        self.waiting_ids = np.zeros(0, dtype=np.int64)
+        self.waiting_rows = np.zeros(0, dtype=np.int64)
+        self.waiting_created = np.zeros(0, dtype="datetime64[us]")
+
+    def _row(self, categorie_service):
+        import numpy as np
+
+        row = self._rows.get(categorie_service)
+        if row is None:
+            row = self._rows[categorie_service] = len(self._rows)
+            self.arrivals = np.vstack([self.arrivals, np.zeros(HOURS_PER_WEEK)])
+            self.started = np.vstack([self.started, np.zeros(HOURS_PER_WEEK)])
+            self.service_seconds = np.append(self.service_seconds, 0.0)
+            self.served = np.append(self.served, 0.0)
+        return row
+
+    def _enqueue(self, ids, rows, created):
+        """Ajoute des tickets à la file (ceux qui y sont déjà sont ignorés)"""
+        import numpy as np
+
+        ids = np.asarray(ids, dtype=np.int64)
+        fresh = ~np.isin(ids, self.waiting_ids)
+        self.waiting_ids = np.concatenate([self.waiting_ids, ids[fresh]])
+        self.waiting_rows = np.concatenate([self.waiting_rows, np.asarray(rows, dtype=np.int64)[fresh]])
+        self.waiting_created = np.concatenate([
+            self.waiting_created, np.asarray(created, dtype="datetime64[us]")[fresh],
+        ])
+
+    def _keep(self, mask):
+        self.waiting_ids = self.waiting_ids[mask]
+        self.waiting_rows = self.waiting_rows[mask]
+        self.waiting_created = self.waiting_created[mask]
+
+    def taken(self, ticket_ids):
+        """Retire de la file des tickets pris en charge ou annulés"""
+        import numpy as np
+
+        with self._lock:
+            if self.waiting_ids is None:
+                # File pas encore chargée : le premier passage lira ces tickets en base
+                return
+            self._keep(~np.isin(self.waiting_ids, np.asarray(ticket_ids, dtype=np.int64)))
+
+    def _accumulate(self, target, groups):
+        """Ajoute des comptes (catégorie, jour SQLite, heure, nombre) dans un profil"""
+        import numpy as np
+
+        if not groups:
+            return
+        rows = np.fromiter((self._row(group[0]) for group in groups), dtype=np.int64, count=len(groups))
+        days, hours, counts = np.array([group[1:4] for group in groups], dtype=np.int64).T
+        # strftime('%w') : 0 = dimanche ; la case 0 du profil est lundi 0 h
+        slots = ((days + 6) % 7) * 24 + hours
+        np.add.at(getattr(self, target), (rows, slots), counts)
+
+    def refresh(self, db: Session, now=None):
+        """Intègre les tickets et événements apparus depuis le dernier passage"""
+        with self._lock:
+            self._refresh(db, now)
+
+    def _refresh(self, db: Session, now=None):
+        """Corps de `refresh`, appelé verrou tenu
+
+        Les comptes par heure de la semaine sont agrégés par SQLite (GROUP BY) :
+        seules quelques centaines de lignes remontent, même au premier passage.
+        Chaque requête est bornée par l'identifiant maximal lu au préalable,
+        pour qu'aucune ligne ne soit comptée deux fois ni oubliée.
+        """
+        import numpy as np
+
+        if self.arrivals is None:
+            self._allocate()
+        now = now or datetime.utcnow()
+        cutoff = now - self.history
+        queue_cutoff = now - self.queue_window
+        ticket, ev = models.Ticket, models.Evenement
+        first_pass = not self.last_ticket_id
+
+        # Événements d'abord : un ticket créé entre-temps sera retiré de la file au
+        # prochain passage au lieu d'y rester indéfiniment
+        last_event_id = db.scalar(select(func.max(ev.id))) or 0
+        new_events = (ev.id > self.last_event_id) & (ev.id <= last_event_id)
+        if not self.last_event_id:
+            new_events &= ev.date >= cutoff
+        started = (
+            select(
+                ticket.categorie_service,
+                cast(func.strftime("%w", ev.date), Integer),
+                cast(func.strftime("%H", ev.date), Integer),
+                func.count(),
+            )
+            .join(ticket, ticket.id == ev.ticket_id)
+            .where(new_events, ev.statut == models.TicketStatus.in_progress)
+            .group_by(ticket.categorie_service, func.strftime("%w", ev.date), func.strftime("%H", ev.date))
+        )
+        # Prises en charge par heure de la semaine
+        self._accumulate("started", db.execute(started).all())
+
+        # Durée de service des tickets terminés (prise en charge -> fin)
+        begin = aliased(ev)
+        service = (
+            select(
+                ticket.categorie_service,
+                func.sum((func.julianday(ev.date) - func.julianday(begin.date)) * 86400),
+                func.count(),
+            )
+            .join(ticket, ticket.id == ev.ticket_id)
+            .join(begin, (begin.ticket_id == ev.ticket_id) & (begin.statut == models.TicketStatus.in_progress))
+            .where(new_events, ev.statut == models.TicketStatus.done)
+            .group_by(ticket.categorie_service)
+        )
+        for categorie_service, seconds, count in db.execute(service):
+            row = self._row(categorie_service)
+            self.service_seconds[row] += seconds or 0.0
+            self.served[row] += count
+
+        # Tickets récents sortis de la file (pris en charge ou annulés)
+        taken = np.fromiter(db.scalars(
+            select(ev.ticket_id).where(
+                new_events,
+                ev.date >= queue_cutoff,
+                ev.statut.in_([models.TicketStatus.in_progress, models.TicketStatus.canceled]),
+            )
+        ), dtype=np.int64)
+        self._keep(~np.isin(self.waiting_ids, taken))
+
+        # Arrivées par heure de la semaine
+        last_ticket_id = db.scalar(select(func.max(ticket.id))) or 0
+        new_tickets = (ticket.id > self.last_ticket_id) & (ticket.id <= last_ticket_id)
+        if first_pass:
+            new_tickets &= ticket.date_creation >= cutoff
+            self.first_seen = db.scalar(select(func.min(ticket.date_creation, type_=DateTime)).where(new_tickets))
+        arrivals = (
+            select(
+                ticket.categorie_service,
+                cast(func.strftime("%w", ticket.date_creation), Integer),
+                cast(func.strftime("%H", ticket.date_creation), Integer),
+                func.count(),
+            )
+            .where(new_tickets)
+            .group_by(
+                ticket.categorie_service,
+                func.strftime("%w", ticket.date_creation),
+                func.strftime("%H", ticket.date_creation),
+            )
+        )
+        self._accumulate("arrivals", db.execute(arrivals).all())
+
+        # File d'attente : tickets récents sans prise en charge
+        waiting = db.execute(
+            select(ticket.id, ticket.categorie_service, ticket.date_creation)
+            .where(new_tickets, ticket.date_creation >= queue_cutoff)
+        ).all()
+        if waiting:
+            ids, services, created = zip(*waiting)
+            ids = np.asarray(ids, dtype=np.int64)
+            still = ~np.isin(ids, taken)
+            rows = np.fromiter((self._row(service) for service in services), dtype=np.int64, count=len(ids))
+            self._enqueue(ids[still], rows[still], np.asarray(created, dtype="datetime64[us]")[still])
+
+        self.last_event_id = max(self.last_event_id, last_event_id)
+        self.last_ticket_id = max(self.last_ticket_id, last_ticket_id)
+        # Les tickets restés en attente au-delà de la fenêtre sont considérés abandonnés
+        self._keep(self.waiting_created >= np.datetime64(queue_cutoff, "us"))
+        self._refreshed_at = time.monotonic()
+
+    def _refresh_if_stale(self, db: Session, now=None):
+        if self._refreshed_at is None or time.monotonic() - self._refreshed_at >= self.refresh_seconds:
+            self._refresh(db, now)
+
+    def _rates(self, row, now):
+        """Prises en charge par heure, moyennées sur les semaines observées"""
+        import numpy as np
+
+        if self.first_seen is None:
+            return np.zeros(HOURS_PER_WEEK)
+        return self.started[row] / _occurrences(self.first_seen, now)
+
+    def profile(self, db: Session, categorie_service, now=None):
+        """Arrivées et prises en charge moyennes par heure de la semaine"""
+        import numpy as np
+
+        now = now or datetime.utcnow()
+        coordinator.sync()
+        with self._lock:
+            self._refresh_if_stale(db, now)
+            row = self._rows.get(categorie_service)
+            if row is None:
+                zeros = [0.0] * HOURS_PER_WEEK
+                return {"categorie_service": categorie_service, "arrivals_per_hour": zeros,
+                        "service_rate_per_hour": zeros, "mean_service_minutes": None}
+            occurrences = _occurrences(self.first_seen, now)
+            return {
+                "categorie_service": categorie_service,
+                "arrivals_per_hour": np.round(self.arrivals[row] / occurrences, 3).tolist(),
+                "service_rate_per_hour": np.round(self.started[row] / occurrences, 3).tolist(),
+                "mean_service_minutes": self._mean_service_minutes(row),
+            }
+
+    def _mean_service_minutes(self, row):
+        if not self.served[row]:
+            return None
+        return round(float(self.service_seconds[row] / self.served[row]) / 60, 1)
+
+    def predict_wait(self, db: Session, categorie_service, ticket_id=None, now=None):
+        """Attente estimée (minutes) d'un ticket de la catégorie créé maintenant
+
+        Seuls les tickets en attente créés avant `ticket_id` sont comptés devant
+        lui. Renvoie None pour l'attente si la catégorie n'a pas d'historique de
+        prise en charge.
+        """
+        import numpy as np
+
+        now = now or datetime.utcnow()
+        coordinator.sync()
+        with self._lock:
+            self._refresh_if_stale(db, now)
+            row = self._rows.get(categorie_service)
+            if ticket_id is not None and ticket_id > self.last_ticket_id:
+                # Ticket tout juste créé : compté dans la file sans attendre le prochain passage
+                row = self._row(categorie_service)
+                self._enqueue([ticket_id], [row], [now])
+            ahead = 0
+            if row is not None:
+                ahead_mask = self.waiting_rows == row
+                if ticket_id is not None:
+                    ahead_mask &= self.waiting_ids < ticket_id
+                ahead = int(np.count_nonzero(ahead_mask))
+            forecast = {
+                "categorie_service": categorie_service,
+                "queue_ahead": ahead,
+                "estimated_wait_minutes": None,
+                "mean_service_minutes": self._mean_service_minutes(row) if row is not None else None,
+            }
+            if ahead == 0:
+                forecast["estimated_wait_minutes"] = 0.0
+                return forecast
+            if row is None:
+                return forecast
+            rates = self._rates(row, now)
+
+        # Capacité de chaque heure à venir (sur deux semaines), la première au prorata
+        slot = int(hour_of_week(np.datetime64(now, "s")))
+        remaining = 1 - (now.minute * 60 + now.second) / 3600
+        capacity = np.tile(np.roll(rates, -slot), 2)
+        capacity[0] *= remaining
+        cumulative = np.cumsum(capacity)
+        index = int(np.searchsorted(cumulative, ahead))
+        if index >= len(capacity):
+            return forecast
+        before = cumulative[index - 1] if index else 0.0
+        hours = (remaining + index - 1 if index else 0.0) + (ahead - before) / rates[(slot + index) % HOURS_PER_WEEK]
+        forecast["estimated_wait_minutes"] = round(float(hours) * 60, 1)
+        return forecast
+
+
+def forecaster_for(db: Session):
+    """Prévisionniste de l'agence à laquelle la session est rattachée"""
+    return forecasters[db.info.get("agence", settings.AGENCE_PAR_DEFAUT)]
+
+
+def status_changed(db: Session, ticket_ids, statut):
+    """Tickets sortis de la file d'attente par un changement de statut validé"""
+    if statut != models.TicketStatus.pending.value:
+        forecaster_for(db).taken(ticket_ids)
+
+
+def forget_all(db: Session):
+    """Repart de zéro pour l'agence (base réinitialisée) dans tous les workers"""
+    agence = db.info.get("agence", settings.AGENCE_PAR_DEFAUT)
+    forecasters[agence].reset()
+    coordinator.publish_clear(_cache_ids[agence])
+
+
+forecasters = {
+    agence: WaitForecaster(
+        settings.FORECAST_HISTORY_DAYS, settings.FORECAST_QUEUE_HOURS, settings.FORECAST_REFRESH_SECONDS
+    )
+    for agence in settings.AGENCES
+}
+# Pas d'invalidation clé par clé : les profils se mettent à jour seuls, seul le vidage est diffusé
+_cache_ids = {
+    agence: coordinator.register(lambda key: None, forecaster.reset) for agence, forecaster in forecasters.items()
+}
@@ -0,0 +1,139 @@
+"""Compression des réponses et requêtes conditionnelles (ETag / If-None-Match)
+
+Les listes (`/agents/`, `/tickets/`, `/tickets/page`) portent un ETag fort
+calculé à partir de la version des tables servies (journal des modifications)
+et de l'URL demandée ; les listes de tickets, qui embarquent leur agent,
+dépendent aussi de la version de la table des agents. Un client qui renvoie cet ETag dans `If-None-Match` reçoit
+`304 Not Modified` sans corps, avant toute requête SQL.
+
+Les réponses JSON au-delà d'un seuil sont compressées (brotli si le module
+`brotli` est installé et accepté par le client, gzip sinon). Comme le fait
+nginx, l'ETag d'une réponse compressée devient faible (`W/`) : le corps
+transmis n'est plus octet pour octet celui de la version identité, et
+`If-None-Match` compare les ETag en mode faible.
+"""
+import gzip
+import zlib
+
+from fastapi import Request, Response
+
+from . import changes, routing
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+GZIP_LEVEL = 6
+# Qualité brotli adaptée aux réponses dynamiques (compression rapide)
+BROTLI_QUALITY = 5
+COMPRESSIBLE_TYPES = (b"application/json", b"text/")
+
+
+def etag(db, request: Request, *tables):
+    """ETag fort de la liste : version de chaque table servie, agence et URL (pagination, filtres, tri)"""
+    table_versions = changes.versions_for(db)
+    versions = ".".join(str(table_versions.get(db, table)) for table in tables)
+    target = f"{routing.branch_of(db)} {request.url.path}?{request.url.query}"
+    return f'"{"+".join(tables)}.{versions}.{zlib.crc32(target.encode()):08x}"'
+
+
+def _matches(if_none_match, tag):
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # Comparaison faible : W/"x" et "x" désignent la même version
+    return any(candidate.strip().removeprefix("W/") == tag for candidate in if_none_match.split(","))
+
+
+def not_modified(request: Request, response: Response, tag):
+    """Réponse 304 si le client a déjà cette version ; sinon ajoute l'ETag à la réponse"""
+    headers = {"ETag": tag, "Cache-Control": "no-cache", "Vary": "X-Agence"}
+    if _matches(request.headers.get("if-none-match"), tag):
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return None
+
+
+def _choose_encoding(accept_encoding):
+    accepted = {
+        token.split(";")[0]
+        for token in accept_encoding.lower().replace(" ", "").split(",")
+        if not token.endswith(";q=0")
+    }
+    if brotli is not None and "br" in accepted:
+        return "br"
+    if "gzip" in accepted:
+        return "gzip"
+    return None
+
+
+def _compress(body, encoding):
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+class CompressionMiddleware:
+    """Middleware ASGI compressant les réponses JSON et texte au-delà de `minimum_size` octets"""
+
+    def __init__(self, app, minimum_size=1024):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        accept_encoding = ""
+        for name, value in scope["headers"]:
+            if name == b"accept-encoding":
+                accept_encoding = value.decode("latin-1")
+        encoding = _choose_encoding(accept_encoding)
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start = None
+        passthrough = False
+
+        async def send_wrapper(message):
+            nonlocal start, passthrough
+            if message["type"] == "http.response.start":
+                start = message
+                return
+            if passthrough or message["type"] != "http.response.body":
+                await send(message)
+                return
+            body = message.get("body", b"")
+            headers = dict(start["headers"])
+            if (
+                message.get("more_body")
+                or len(body) < self.minimum_size
+                or b"content-encoding" in headers
+                or not headers.get(b"content-type", b"").startswith(COMPRESSIBLE_TYPES)
+            ):
+                # Réponse en flux, petite, déjà compressée ou binaire : transmise telle quelle
+                passthrough = True
+                await send(start)
+                await send(message)
+                return
+            body = _compress(body, encoding)
+            vary = headers.get(b"vary")
+            tag = headers.get(b"etag")
+            rewritten = [
+                (name, value) for name, value in start["headers"]
+                if name not in (b"content-length", b"vary", b"etag")
+            ]
+            rewritten += [
+                (b"content-encoding", encoding.encode()),
+                (b"content-length", str(len(body)).encode()),
+                (b"vary", vary + b", Accept-Encoding" if vary else b"Accept-Encoding"),
+            ]
+            if tag is not None:
+                rewritten.append((b"etag", tag if tag.startswith(b"W/") else b"W/" + tag))
+            await send({**start, "headers": rewritten})
+            await send({**message, "body": body})
+
+        await self.app(scope, receive, send_wrapper)
@@ -0,0 +1,150 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from ..config import settings
+from . import models, outbox
+from .coordination import coordinator
+
+
+class IdempotencyConflict(ValueError):
+    """Clé déjà utilisée pour une requête au contenu différent"""
+
+
+def fingerprint(payload):
+    """Empreinte courte du corps de la requête, pour détecter la réutilisation d'une clé"""
+    canonical = json.dumps(payload.dict(), sort_keys=True, default=str)
+    return hashlib.sha256(canonical.encode()).hexdigest()[:32]
+
+
+class IdempotencyStore:
+    """Clés d'idempotence expirantes : table SQLite + cache mémoire en frontal
+
+    Une clé est enregistrée dans la même transaction que l'écriture qu'elle
+    protège ; un rejeu renvoie l'identifiant de la ligne créée à l'origine.
+    """
+
+    def __init__(self, ttl_seconds, cache_size, purge_interval=60):
+        self.ttl = timedelta(seconds=ttl_seconds)
+        self.cache_size = cache_size
+        self.purge_interval = purge_interval
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._last_purge = time.monotonic()
+
+    def _cache_get(self, cache_key):
+        with self._lock:
+            entry = self._cache.get(cache_key)
+            if entry is None:
+                return None
+            if entry[2] <= datetime.utcnow():
+                del self._cache[cache_key]
+                return None
+            self._cache.move_to_end(cache_key)
+            return entry
+
+    def _cache_put(self, cache_key, entry):
+        with self._lock:
+            self._cache[cache_key] = entry
+            self._cache.move_to_end(cache_key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def lookup(self, db: Session, scope: str, key: str, request_fingerprint: str):
+        """Identifiant de la ressource déjà créée pour cette clé, ou None"""
+        cache_key = (db.info.get("agence"), scope, key)
+        coordinator.sync()
+        entry = self._cache_get(cache_key)
+        if entry is None:
+            row = db.get(models.IdempotencyKey, (scope, key))
+            if row is None or row.expires_at <= datetime.utcnow():
+                return None
+            entry = (row.fingerprint, row.resource_id, row.expires_at)
+            self._cache_put(cache_key, entry)
+        if entry[0] != request_fingerprint:
+            raise IdempotencyConflict(
+                "Idempotency-Key déjà utilisée pour une requête différente"
+            )
+        return entry[1]
+
+    def remember(self, db: Session, scope: str, key: str, request_fingerprint: str, resource_id: int):
+        """Ajoute la clé à la transaction en cours ; le cache est alimenté par `committed`"""
+        now = datetime.utcnow()
+        expires_at = now + self.ttl
+        # Clé réutilisée après expiration mais avant la purge : l'ancienne ligne est remplacée
+        # dans la même transaction, seule une clé encore valide fait échouer l'insertion
+        key_row = models.IdempotencyKey
+        db.execute(
+            delete(key_row)
+            .where(key_row.scope == scope, key_row.key == key, key_row.expires_at <= now)
+        )
+        db.add(models.IdempotencyKey(
+            scope=scope,
+            key=key,
+            fingerprint=request_fingerprint,
+            resource_id=resource_id,
+            expires_at=expires_at,
+        ))
+        if time.monotonic() - self._last_purge >= self.purge_interval:
+            self._last_purge = time.monotonic()
+            # Purge hors de la requête : seule la mise en file s'ajoute à la transaction
+            outbox.enqueue(db, PURGE_JOB)
+        return (request_fingerprint, resource_id, expires_at)
+
+    def committed(self, db: Session, scope: str, key: str, entry):
+        self._cache_put((db.info.get("agence"), scope, key), entry)
+
+    def purge_expired(self, db: Session):
+        return db.execute(
+            delete(models.IdempotencyKey).where(models.IdempotencyKey.expires_at <= datetime.utcnow())
+        ).rowcount
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+    def forget_all(self):
+        """Vide le cache dans tous les workers (base réinitialisée)"""
+        self.clear()
+        coordinator.publish_clear(_cache_id)
+
+
+def commit_once(db: Session, scope: str, key: str, request_fingerprint: str, db_object):
+    """Valide l'écriture protégée par la clé
+
+    Renvoie l'identifiant d'origine si une requête concurrente avec la même
+    clé a été validée entre-temps (l'écriture courante est alors annulée).
+    """
+    db.flush()
+    entry = store.remember(db, scope, key, request_fingerprint, db_object.id)
+    try:
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        original_id = store.lookup(db, scope, key, request_fingerprint)
+        if original_id is None:
+            raise
+        return original_id
+    store.committed(db, scope, key, entry)
+    return None
+
+
+PURGE_JOB = "idempotency.purge"
+
+
+@outbox.handler(PURGE_JOB)
+def _purge(db: Session, payloads):
+    # Une seule purge pour toutes les demandes du lot
+    store.purge_expired(db)
+
+
+store = IdempotencyStore(settings.IDEMPOTENCY_TTL_SECONDS, settings.IDEMPOTENCY_CACHE_SIZE)
+# Les entrées ne changent jamais : seul le vidage complet est diffusé aux autres workers
+_cache_id = coordinator.register(lambda key: None, store.clear)
@@ -0,0 +1,331 @@
+"""Maintenance de la base en arrière-plan : checkpoint WAL, vacuum incrémental,
+statistiques du planificateur, contrôle d'intégrité, purge du journal des
+modifications, rapports des périodes closes et sauvegardes à chaud
+
+Un seul thread par processus exécute les tâches à leur échéance, agence par
+agence, sur une connexion qui lui est propre (jamais celles du pool des
+requêtes). Chaque tâche avance par petites étapes séparées de pauses, pour
+n'occuper la base qu'une fraction `duty_cycle` du temps ; un écrivain qui
+attend le verrou n'attend jamais plus d'une étape.
+
+En mode multi-workers, un seul worker (celui qui obtient le verrou de
+maintenance) exécute les tâches ; il publie leur état dans un fichier JSON
+que les autres workers relisent pour `GET /maintenance/jobs`.
+"""
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy.exc import DBAPIError
+
+from ..config import settings
+
+logger = logging.getLogger("smart_agence.maintenance")
+
+# Délai avant un nouvel essai quand la base était verrouillée
+RETRY_SECONDS = 30
+# Entrées du journal des modifications supprimées par étape
+PRUNE_BATCH = 5000
+# Nom exact des sauvegardes (horodatage UTC) : la rotation ne touche à aucun autre fichier
+BACKUP_NAME = re.compile(r"\d{8}-\d{6}\.db")
+
+
+class Skipped(Exception):
+    """Tâche sans objet pour cette base (ex. checkpoint hors mode WAL)"""
+
+
+class MaintenanceScheduler:
+    def __init__(self, engines, intervals, duty_cycle=0.1, vacuum_pages=500, changes_keep=100000,
+                 backup_dir="", backup_keep=7, lock_path=None, status_path=None, tick=1.0):
+        # Bases SQLite sur fichier uniquement : une base en mémoire n'a rien à maintenir
+        self.databases = {
+            agence: engine.url.database
+            for agence, engine in engines.items()
+            if engine.dialect.name == "sqlite" and engine.url.database not in (None, "", ":memory:")
+        }
+        self.jobs = {
+            "checkpoint": self.checkpoint,
+            "vacuum": self.incremental_vacuum,
+            "optimize": self.optimize,
+            "integrity": self.quick_check,
+            "changes": self.prune_changes,
+            "reports": self.generate_reports,
+            "backup": self.backup,
+        }
+        # Intervalle nul : tâche désactivée ; pas de sauvegarde sans répertoire cible
+        self.intervals = {
+            job: interval for job, interval in intervals.items()
+            if interval > 0 and (job != "backup" or backup_dir)
+        }
+        self.duty_cycle = duty_cycle
+        self.vacuum_pages = vacuum_pages
+        self.changes_keep = changes_keep
+        self.backup_dir = backup_dir
+        self.backup_keep = backup_keep
+        self.lock_path = lock_path
+        self.status_path = status_path
+        self.tick = tick
+        self._lock_fd = None
+        self._stop = threading.Event()
+        self._thread = None
+        self._status = {}
+        # Premier passage après un intervalle complet : le démarrage n'est pas ralenti
+        now = datetime.utcnow()
+        for agence in self.databases:
+            for job, interval in self.intervals.items():
+                self._status[(agence, job)] = {
+                    "agence": agence, "job": job, "interval_seconds": interval, "runs": 0,
+                    "last_started": None, "last_duration_ms": None, "last_status": None,
+                    "last_detail": None, "next_run": now + timedelta(seconds=interval),
+                }
+
+    def start(self):
+        if not self._status:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="db-maintenance", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    def _is_leader(self):
+        """Un seul worker exécute les tâches ; un autre prend le relais s'il s'arrête"""
+        if self.lock_path is None or self._lock_fd is not None:
+            return True
+        import fcntl
+
+        fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        self._lock_fd = fd
+        return True
+
+    def _run(self):
+        while not self._stop.wait(self.tick):
+            try:
+                self._run_due()
+            except Exception:
+                # Le thread ne doit jamais mourir : sinon plus aucune maintenance jusqu'au redémarrage
+                logger.exception("Planificateur de maintenance en échec, nouvel essai au prochain tour")
+
+    def _run_due(self):
+        if not self._is_leader():
+            return
+        for (agence, job), status in self._status.items():
+            if self._stop.is_set():
+                return
+            if status["next_run"] <= datetime.utcnow():
+                self.run_job(agence, job)
+
+    def run_job(self, agence, job):
+        status = self._status[(agence, job)]
+        status["last_started"] = datetime.utcnow()
+        started = time.perf_counter()
+        conn = None
+        try:
+            conn = sqlite3.connect(self.databases[agence], isolation_level=None, check_same_thread=False)
+            # Verrou occupé par une requête : la maintenance abandonne l'étape plutôt que d'attendre
+            conn.execute("PRAGMA busy_timeout = 50")
+            status["last_detail"] = self.jobs[job](agence, conn)
+            status["last_status"] = "ok"
+        except Skipped as exc:
+            status["last_status"], status["last_detail"] = "skipped", str(exc)
+        except sqlite3.Error as exc:
+            if "locked" in str(exc):
+                # Base occupée : nouvel essai bientôt plutôt qu'à l'échéance suivante
+                status["last_status"], status["last_detail"] = "deferred", str(exc)
+            else:
+                status["last_status"], status["last_detail"] = "error", str(exc)
+                logger.warning("Maintenance %s (%s) en échec : %s", job, agence, exc)
+        except Exception as exc:
+            # Erreur inattendue (disque plein, bogue) : tâche en erreur, les autres continuent
+            status["last_status"], status["last_detail"] = "error", f"{type(exc).__name__}: {exc}"
+            logger.exception("Maintenance %s (%s) en échec", job, agence)
+        finally:
+            if conn is not None:
+                conn.close()
+        status["runs"] += 1
+        status["last_duration_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        delay = RETRY_SECONDS if status["last_status"] == "deferred" else status["interval_seconds"]
+        status["next_run"] = datetime.utcnow() + timedelta(seconds=min(delay, status["interval_seconds"]))
+        self._publish()
+
+    def _pause(self, busy_seconds):
+        """Pause proportionnelle à l'étape écoulée, pour respecter le `duty_cycle`"""
+        self._stop.wait(busy_seconds * (1 - self.duty_cycle) / self.duty_cycle)
+
+    def checkpoint(self, agence, conn):
+        if conn.execute("PRAGMA journal_mode").fetchone()[0] != "wal":
+            raise Skipped("base hors mode WAL")
+        # PASSIVE : recopie ce qui peut l'être sans attendre lecteurs ni écrivains
+        busy, wal_pages, copied = conn.execute("PRAGMA wal_checkpoint(PASSIVE)").fetchone()
+        return f"{copied}/{wal_pages} pages du WAL recopiées" + (" (partiel)" if busy else "")
+
+    def incremental_vacuum(self, agence, conn):
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            raise Skipped(f"auto_vacuum non incrémental ({free} pages libres)")
+        initial = free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        while free and not self._stop.is_set():
+            started = time.perf_counter()
+            # Une page libérée par pas d'exécution : execute() n'en ferait qu'un,
+            # executescript() exécute l'étape jusqu'au bout
+            conn.executescript(f"PRAGMA incremental_vacuum({self.vacuum_pages});")
+            self._pause(time.perf_counter() - started)
+            free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        return f"{initial - free} pages rendues au système"
+
+    def optimize(self, agence, conn):
+        # ANALYZE borné (échantillon) sur toutes les tables qui en ont besoin
+        conn.execute("PRAGMA analysis_limit = 400")
+        conn.execute("PRAGMA optimize = 0x10002")
+        return "statistiques du planificateur à jour"
+
+    def quick_check(self, agence, conn):
+        problems = [row[0] for row in conn.execute("PRAGMA quick_check(10)")]
+        if problems != ["ok"]:
+            raise sqlite3.DatabaseError("; ".join(problems))
+        return "ok"
+
+    def prune_changes(self, agence, conn):
+        """Ne garde que les `changes_keep` dernières entrées du journal des modifications"""
+        latest = conn.execute("SELECT max(seq) FROM changes").fetchone()[0]
+        if latest is None:
+            raise Skipped("journal vide")
+        # La dernière entrée reste toujours : le numéro courant survit à la purge
+        oldest_kept = latest - max(self.changes_keep, 1)
+        removed = 0
+        while not self._stop.is_set():
+            started = time.perf_counter()
+            deleted = conn.execute(
+                "DELETE FROM changes WHERE seq IN (SELECT seq FROM changes WHERE seq <= ? ORDER BY seq LIMIT ?)",
+                (oldest_kept, PRUNE_BATCH),
+            ).rowcount
+            removed += deleted
+            if deleted < PRUNE_BATCH:
+                break
+            self._pause(time.perf_counter() - started)
+        return f"{removed} entrées purgées"
+
+    def generate_reports(self, agence, conn):
+        """Rapports des périodes closes récentes qui manquent, un par étape
+
+        Les requêtes ORM passent par la connexion de la maintenance (même
+        `busy_timeout` court que les autres tâches), jamais par le pool des
+        requêtes : une connexion prise ici n'en retire aucune à l'API.
+        """
+        from sqlalchemy import create_engine
+        from sqlalchemy.orm import Session
+        from sqlalchemy.pool import StaticPool
+
+        from . import reports
+
+        # Transactions implicites comme dans le pool des requêtes : un rapport est enregistré d'un bloc
+        conn.isolation_level = ""
+        engine = create_engine("sqlite://", creator=lambda: conn, poolclass=StaticPool)
+        generated = 0
+        db = Session(engine, autoflush=False, info={"agence": agence})
+        try:
+            while not self._stop.is_set():
+                started = time.perf_counter()
+                if not reports.generate_missing(db, limit=1):
+                    break
+                generated += 1
+                self._pause(time.perf_counter() - started)
+        except DBAPIError as exc:
+            # Erreur SQLite d'origine : traitée comme celles des autres tâches (verrou, etc.)
+            raise exc.orig
+        finally:
+            db.close()
+        if not generated:
+            raise Skipped("rapports à jour")
+        return f"{generated} rapports calculés"
+
+    def backup(self, agence, conn):
+        """Copie à chaud par l'API de sauvegarde, écrite sous un nom temporaire puis renommée
+
+        Un sous-répertoire par agence : la rotation d'une agence ne voit jamais
+        les sauvegardes d'une autre, même si son code en préfixe un autre.
+        """
+        directory = os.path.join(self.backup_dir, agence)
+        os.makedirs(directory, exist_ok=True)
+        target = os.path.join(directory, f"{datetime.utcnow():%Y%m%d-%H%M%S}.db")
+        destination = sqlite3.connect(target + ".tmp")
+        try:
+            if conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal":
+                # Un seul instantané de lecture : en WAL, les écrivains ne sont pas bloqués
+                conn.backup(destination)
+            else:
+                # Sinon par blocs de pages, en relâchant le verrou de lecture entre deux blocs
+                last = [time.perf_counter()]
+
+                def progress(status, remaining, total):
+                    self._pause(time.perf_counter() - last[0])
+                    last[0] = time.perf_counter()
+
+                conn.backup(destination, pages=1000, progress=progress)
+        finally:
+            destination.close()
+        os.replace(target + ".tmp", target)
+        # Rotation : seules les `backup_keep` sauvegardes les plus récentes sont conservées
+        backups = sorted(name for name in os.listdir(directory) if BACKUP_NAME.fullmatch(name))
+        for old in backups[:-self.backup_keep]:
+            os.remove(os.path.join(directory, old))
+        return f"{os.path.basename(target)} ({os.path.getsize(target) / 1e6:.1f} Mo)"
+
+    def _publish(self):
+        if self.status_path is None:
+            return
+        tmp = f"{self.status_path}.{os.getpid()}"
+        with open(tmp, "w") as f:
+            json.dump(list(self._status.values()), f, default=datetime.isoformat)
+        os.replace(tmp, self.status_path)
+
+    def report(self):
+        """État des tâches ; celui publié par le worker qui les exécute s'il s'agit d'un autre"""
+        if self.status_path is None or self._lock_fd is not None:
+            return list(self._status.values())
+        try:
+            with open(self.status_path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return []
+
+
+def _create():
+    from .routing import router
+
+    shared = settings.COORDINATION_FILE
+    return MaintenanceScheduler(
+        router.engines,
+        intervals={
+            "checkpoint": settings.MAINTENANCE_CHECKPOINT_SECONDS,
+            "vacuum": settings.MAINTENANCE_VACUUM_SECONDS,
+            "optimize": settings.MAINTENANCE_OPTIMIZE_SECONDS,
+            "integrity": settings.MAINTENANCE_INTEGRITY_SECONDS,
+            "changes": settings.MAINTENANCE_CHANGES_SECONDS,
+            "reports": settings.MAINTENANCE_REPORTS_SECONDS,
+            "backup": settings.BACKUP_INTERVAL_SECONDS,
+        },
+        duty_cycle=settings.MAINTENANCE_DUTY_CYCLE,
+        vacuum_pages=settings.MAINTENANCE_VACUUM_PAGES,
+        changes_keep=settings.CHANGES_KEEP,
+        backup_dir=settings.BACKUP_DIR,
+        backup_keep=settings.BACKUP_KEEP,
+        lock_path=f"{shared}.maintenance.lock" if shared else None,
+        status_path=f"{shared}.maintenance.json" if shared else None,
+    )
+
+
+scheduler = _create()
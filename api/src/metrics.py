@@ -0,0 +1,225 @@
+import logging
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+
+from sqlalchemy import event
+
+logger = logging.getLogger("smart_agence.sql")
+
+# Bornes (en secondes) des histogrammes de latence
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+# Bornes (en secondes) du délai entre la mise en file d'une tâche différée et son exécution
+OUTBOX_LAG_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+# Bornes du nombre de requêtes SQL par requête HTTP
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+# Statistiques SQL de la requête HTTP en cours : [nombre, durée]
+_request_sql: ContextVar = ContextVar("request_sql", default=None)
+
+
+class Histogram:
+    """Histogramme cumulatif au format Prometheus"""
+
+    __slots__ = ("buckets", "counts", "total", "count")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.count += 1
+
+
+class MetricsRegistry:
+    """Agrège les mesures des requêtes HTTP et des requêtes SQL"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.request_latency = {}
+        self.request_sql_count = {}
+        self.request_sql_time = {}
+        self.requests_total = {}
+        self.slow_queries_total = 0
+        self.outbox_jobs_total = {}
+        self.outbox_lag = {}
+        self.outbox_depth = {}
+        self.admission_total = {}
+        # Fonction renvoyant (requêtes en cours, {classe: requêtes en attente}), fournie par admission
+        self.admission_load = None
+
+    def record_request(self, method, route, status_code, duration, sql_count, sql_time):
+        key = (method, route)
+        with self._lock:
+            if key not in self.request_latency:
+                self.request_latency[key] = Histogram(LATENCY_BUCKETS)
+                self.request_sql_count[key] = Histogram(QUERY_COUNT_BUCKETS)
+                self.request_sql_time[key] = Histogram(LATENCY_BUCKETS)
+            self.request_latency[key].observe(duration)
+            self.request_sql_count[key].observe(sql_count)
+            self.request_sql_time[key].observe(sql_time)
+            status_key = (method, route, str(status_code))
+            self.requests_total[status_key] = self.requests_total.get(status_key, 0) + 1
+
+    def record_slow_query(self):
+        with self._lock:
+            self.slow_queries_total += 1
+
+    def record_outbox(self, agence, kind, outcome, count, lags=()):
+        with self._lock:
+            key = (agence, kind, outcome)
+            self.outbox_jobs_total[key] = self.outbox_jobs_total.get(key, 0) + count
+            if lags:
+                hist = self.outbox_lag.setdefault((agence, kind), Histogram(OUTBOX_LAG_BUCKETS))
+                for lag in lags:
+                    hist.observe(lag)
+
+    def record_admission(self, route_class, outcome):
+        with self._lock:
+            key = (route_class, outcome)
+            self.admission_total[key] = self.admission_total.get(key, 0) + 1
+
+    def set_outbox_depth(self, agence, queued, dead):
+        with self._lock:
+            self.outbox_depth[agence] = (queued, dead)
+
+    def render(self):
+        """Exporte toutes les métriques au format texte Prometheus"""
+        lines = []
+        with self._lock:
+            _render_histograms(
+                lines, "http_request_duration_seconds",
+                "Latence des requêtes HTTP par route", self.request_latency,
+            )
+            _render_histograms(
+                lines, "http_request_db_queries",
+                "Nombre de requêtes SQL par requête HTTP", self.request_sql_count,
+            )
+            _render_histograms(
+                lines, "http_request_db_duration_seconds",
+                "Temps passé en SQL par requête HTTP", self.request_sql_time,
+            )
+            lines.append("# HELP http_requests_total Nombre de requêtes HTTP par route et statut")
+            lines.append("# TYPE http_requests_total counter")
+            for (method, route, code), value in sorted(self.requests_total.items()):
+                lines.append(
+                    f'http_requests_total{{method="{method}",route="{route}",status="{code}"}} {value}'
+                )
+            lines.append("# HELP db_slow_queries_total Requêtes SQL au-delà du seuil de lenteur")
+            lines.append("# TYPE db_slow_queries_total counter")
+            lines.append(f"db_slow_queries_total {self.slow_queries_total}")
+            lines.append("# HELP admission_requests_total Requêtes admises, limitées ou délestées par classe")
+            lines.append("# TYPE admission_requests_total counter")
+            for (route_class, outcome), value in sorted(self.admission_total.items()):
+                lines.append(
+                    f'admission_requests_total{{class="{route_class}",outcome="{outcome}"}} {value}'
+                )
+            if self.admission_load is not None:
+                in_flight, queued = self.admission_load()
+                lines.append("# HELP admission_in_flight Requêtes en cours de traitement")
+                lines.append("# TYPE admission_in_flight gauge")
+                lines.append(f"admission_in_flight {in_flight}")
+                lines.append("# HELP admission_queue_depth Requêtes en attente d'admission par classe")
+                lines.append("# TYPE admission_queue_depth gauge")
+                for route_class, depth in sorted(queued.items()):
+                    lines.append(f'admission_queue_depth{{class="{route_class}"}} {depth}')
+            lines.append("# HELP outbox_jobs_total Tâches différées traitées par type et résultat")
+            lines.append("# TYPE outbox_jobs_total counter")
+            for (agence, kind, outcome), value in sorted(self.outbox_jobs_total.items()):
+                lines.append(
+                    f'outbox_jobs_total{{agence="{agence}",kind="{kind}",outcome="{outcome}"}} {value}'
+                )
+            lines.append("# HELP outbox_queue_depth Tâches différées en attente d'exécution")
+            lines.append("# TYPE outbox_queue_depth gauge")
+            for agence, (queued, dead) in sorted(self.outbox_depth.items()):
+                lines.append(f'outbox_queue_depth{{agence="{agence}"}} {queued}')
+            lines.append("# HELP outbox_dead_jobs Tâches différées abandonnées après trop d'échecs")
+            lines.append("# TYPE outbox_dead_jobs gauge")
+            for agence, (queued, dead) in sorted(self.outbox_depth.items()):
+                lines.append(f'outbox_dead_jobs{{agence="{agence}"}} {dead}')
+            _render_histograms(
+                lines, "outbox_job_lag_seconds",
+                "Délai entre la mise en file d'une tâche différée et son exécution", self.outbox_lag,
+                label_names=("agence", "kind"),
+            )
+        return "\n".join(lines) + "\n"
+
+
+def _render_histograms(lines, name, help_text, histograms, label_names=("method", "route")):
+    lines.append(f"# HELP {name} {help_text}")
+    lines.append(f"# TYPE {name} histogram")
+    for key, hist in sorted(histograms.items()):
+        labels = ",".join(f'{label}="{value}"' for label, value in zip(label_names, key))
+        cumulative = 0
+        for bound, count in zip(hist.buckets, hist.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {hist.count}')
+        lines.append(f"{name}_sum{{{labels}}} {hist.total}")
+        lines.append(f"{name}_count{{{labels}}} {hist.count}")
+
+
+registry = MetricsRegistry()
+
+
+def instrument_engine(engine, slow_query_ms):
+    """Compte et chronomètre chaque requête SQL exécutée par le moteur"""
+    threshold = slow_query_ms / 1000.0
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_start"].pop()
+        stats = _request_sql.get()
+        if stats is not None:
+            stats[0] += 1
+            stats[1] += elapsed
+        if elapsed >= threshold:
+            registry.record_slow_query()
+            logger.warning(
+                "Requête lente (%.1f ms): %s | paramètres: %r",
+                elapsed * 1000, statement, parameters,
+            )
+
+
+class MetricsMiddleware:
+    """Middleware ASGI mesurant latence et activité SQL par route"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = [0, 0.0]
+        token = _request_sql.set(stats)
+        status_code = 500
+        start = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            duration = time.perf_counter() - start
+            _request_sql.reset(token)
+            # Le gabarit de route (ex. /tickets/{ticket_id}/status) évite l'explosion des labels
+            route = scope.get("route")
+            route_path = getattr(route, "path", None) or "unmatched"
+            registry.record_request(
+                scope["method"], route_path, status_code, duration, stats[0], stats[1]
+            )
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Enum
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Enum, Index, text
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from enum import Enum as PyEnum
@@ -16,31 +16,90 @@ class TicketStatus(PyEnum):
 
 class Agent(Base):
     __tablename__ = "agents"
+    # Email unique parmi les agents présents seulement : l'adresse d'un agent parti est réutilisable
+    __table_args__ = (
+        Index(
+            "uq_agents_email_actif", "email", unique=True,
+            sqlite_where=text("deleted_at IS NULL"), postgresql_where=text("deleted_at IS NULL"),
+        ),
+    )
     id = Column(Integer, primary_key=True, index=True)
     nom = Column(String, nullable=False)
     prenoms = Column(String, nullable=False)
     annee_naissance = Column(Integer)
     categorie = Column(Enum(AgentCategory), nullable=False)
-    email = Column(String, unique=True)
+    email = Column(String)
     telephone = Column(String)
     date_enregistrement = Column(DateTime, default=datetime.utcnow)
+    # Incrémentée à chaque modification (contrôle de concurrence optimiste)
+    version = Column(Integer, nullable=False, default=1, server_default="1")
+    # Date de départ : l'agent n'est plus proposé ni assignable, mais tickets clos et
+    # événements gardent sa référence (historique, rapports)
+    deleted_at = Column(DateTime)
     tickets = relationship("Ticket", back_populates="agent")
 
 class Ticket(Base):
     __tablename__ = "tickets"
     id = Column(Integer, primary_key=True, index=True)
     agent_id = Column(Integer, ForeignKey("agents.id"))
-    date_creation = Column(DateTime, default=datetime.utcnow)
+    date_creation = Column(DateTime, default=datetime.utcnow, index=True)
     categorie_service = Column(String, nullable=False)
     description = Column(String)
+    # Incrémentée à chaque modification du ticket (pas à chaque changement de statut)
+    version = Column(Integer, nullable=False, default=1, server_default="1")
     agent = relationship("Agent", back_populates="tickets")
     evenements = relationship("Evenement", back_populates="ticket")
 
 class Evenement(Base):
     __tablename__ = "evenements"
     id = Column(Integer, primary_key=True, index=True)
-    ticket_id = Column(Integer, ForeignKey("tickets.id"))
+    ticket_id = Column(Integer, ForeignKey("tickets.id"), index=True)
     agent_id = Column(Integer, ForeignKey("agents.id"))
-    date = Column(DateTime, default=datetime.utcnow)
+    date = Column(DateTime, default=datetime.utcnow, index=True)
     statut = Column(Enum(TicketStatus), nullable=False)
-    ticket = relationship("Ticket", back_populates="evenements")
\ No newline at end of file
+    ticket = relationship("Ticket", back_populates="evenements")
+
+class IdempotencyKey(Base):
+    __tablename__ = "idempotency_keys"
+    scope = Column(String, primary_key=True)
+    key = Column(String, primary_key=True)
+    fingerprint = Column(String, nullable=False)
+    resource_id = Column(Integer, nullable=False)
+    expires_at = Column(DateTime, nullable=False, index=True)
+
+class Change(Base):
+    __tablename__ = "changes"
+    # AUTOINCREMENT : un numéro n'est jamais réattribué, même après purge des plus anciens ;
+    # l'index donne en une recherche la dernière modification d'une table (sa version)
+    __table_args__ = (
+        Index("ix_changes_table_seq", "table_name", "seq"),
+        {"sqlite_autoincrement": True},
+    )
+    seq = Column(Integer, primary_key=True)
+    table_name = Column(String, nullable=False)
+    row_id = Column(Integer)
+    operation = Column(String, nullable=False)
+    date = Column(DateTime, default=datetime.utcnow)
+
+class Report(Base):
+    __tablename__ = "reports"
+    # Rapport d'une période close : calculé une fois, servi tel quel (JSON compact)
+    kind = Column(String, primary_key=True)
+    period = Column(String, primary_key=True)
+    granularity = Column(String, nullable=False)
+    start = Column(DateTime, nullable=False, index=True)
+    end = Column(DateTime, nullable=False)
+    generated_at = Column(DateTime, nullable=False)
+    tickets = Column(Integer, nullable=False)
+    content = Column(String, nullable=False)
+
+class OutboxJob(Base):
+    __tablename__ = "outbox"
+    id = Column(Integer, primary_key=True)
+    kind = Column(String, nullable=False)
+    payload = Column(String, nullable=False)
+    attempts = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime, nullable=False)
+    # Prochaine exécution possible ; NULL : abandonnée après trop d'échecs
+    available_at = Column(DateTime, index=True)
+    last_error = Column(String)
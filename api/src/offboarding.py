@@ -0,0 +1,157 @@
+"""Départ d'agents : retrait groupé et réaffectation des tickets ouverts
+
+Tout se fait dans la transaction de l'appelant, en SQL ensembliste : aucun
+ticket n'est chargé en Python, seuls des compteurs le sont.
+
+- Les tickets ouverts (en attente ou en cours) des agents qui partent sont
+  répartis entre les agents restants de la même catégorie, au moins chargé
+  d'abord : chaque ticket, du plus ancien au plus récent, va à l'agent qui a
+  alors le moins de tickets ouverts. Sans agent restant dans la catégorie, le
+  ticket reste ouvert sans agent.
+- Les agents ne sont pas supprimés mais marqués partis (`deleted_at`) : les
+  tickets clos et les événements gardent leur agent, et les rapports
+  d'activité des périodes passées restent exacts.
+"""
+import heapq
+from collections import defaultdict
+from datetime import datetime
+
+from sqlalchemy import Integer, String, and_, column, func, select, update, values
+from sqlalchemy.orm import Session, aliased
+
+from . import models
+from .open_tickets import OPEN_STATUSES
+from .transitions import INITIAL_STATUS
+
+
+def _open_tickets():
+    """Condition « ticket ouvert » : statut du dernier événement, statut initial sans événement"""
+    event = aliased(models.Evenement)
+    last_status = (
+        select(event.statut)
+        .where(event.ticket_id == models.Ticket.id)
+        .order_by(event.id.desc())
+        .limit(1)
+        .correlate(models.Ticket)
+        .scalar_subquery()
+    )
+    return func.coalesce(last_status, INITIAL_STATUS, type_=String).in_(OPEN_STATUSES)
+
+
+def _quotas(loads, tickets):
+    """Nombre de tickets attribués à chaque agent, au moins chargé d'abord
+
+    `loads` : [(charge, agent_id)] ; le rang des tickets attribués suit l'ordre
+    des agents dans le résultat [(agent_id, nombre)].
+    """
+    heap = list(loads)
+    heapq.heapify(heap)
+    counts = defaultdict(int)
+    order = []
+    for _ in range(tickets if heap else 0):
+        load, agent_id = heapq.heappop(heap)
+        if agent_id not in counts:
+            order.append(agent_id)
+        counts[agent_id] += 1
+        heapq.heappush(heap, (load + 1, agent_id))
+    return [(agent_id, counts[agent_id]) for agent_id in order]
+
+
+def remove_agents(db: Session, agent_ids, reassign=True):
+    """Marque les agents partis et répartit leurs tickets ouverts (sauf `reassign=False`)
+
+    Renvoie les agents partis, les réaffectations {ticket: nouvel agent} et
+    les tickets ouverts restés sans agent. Les agents inconnus ou déjà partis
+    sont ignorés.
+    """
+    # Lignes mises à jour (et non objets ORM, expirés à la validation)
+    agents = models.Agent.__table__
+    deleted = db.execute(
+        update(agents)
+        .where(agents.c.id.in_(sorted(set(agent_ids))), agents.c.deleted_at.is_(None))
+        .values(deleted_at=datetime.utcnow(), version=agents.c.version + 1)
+        .returning(*agents.c)
+    ).all()
+    agent_ids = sorted(agent.id for agent in deleted)
+    if not agent_ids:
+        return deleted, {}, []
+    leaving = models.Agent.id.in_(agent_ids)
+    is_open = _open_tickets()
+
+    # Tickets ouverts à répartir, par catégorie de l'agent qui part
+    orphans = dict(db.execute(
+        select(models.Agent.categorie, func.count(models.Ticket.id))
+        .join(models.Agent, models.Agent.id == models.Ticket.agent_id)
+        .where(leaving, is_open)
+        .group_by(models.Agent.categorie)
+    ).all()) if reassign else {}
+
+    quota_rows = []
+    if orphans:
+        open_load = (
+            select(models.Ticket.agent_id, func.count().label("load"))
+            .where(models.Ticket.agent_id.is_not(None), is_open)
+            .group_by(models.Ticket.agent_id)
+            .subquery()
+        )
+        candidates = defaultdict(list)
+        for agent_id, categorie, load in db.execute(
+            select(models.Agent.id, models.Agent.categorie, func.coalesce(open_load.c.load, 0))
+            .outerjoin(open_load, open_load.c.agent_id == models.Agent.id)
+            .where(models.Agent.categorie.in_(orphans), models.Agent.deleted_at.is_(None))
+        ):
+            candidates[categorie].append((load, agent_id))
+        for categorie, tickets in orphans.items():
+            rank = 0
+            for agent_id, count in _quotas(candidates[categorie], tickets):
+                quota_rows.append((categorie, agent_id, rank + 1, rank + count))
+                rank += count
+
+    reassigned = {}
+    if quota_rows:
+        # Rang de chaque ticket ouvert dans sa catégorie, du plus ancien au plus récent ;
+        # calculé une fois avant la mise à jour (qui retire les tickets de cet ensemble)
+        ranked = (
+            select(
+                models.Ticket.id,
+                models.Agent.categorie,
+                func.row_number().over(partition_by=models.Agent.categorie, order_by=models.Ticket.id).label("rank"),
+            )
+            .join(models.Agent, models.Agent.id == models.Ticket.agent_id)
+            .where(leaving, is_open)
+            .cte("ranked")
+            .prefix_with("MATERIALIZED")
+        )
+        quotas = values(
+            column("categorie", models.Agent.categorie.type),
+            column("agent_id", Integer),
+            column("first", Integer),
+            column("last", Integer),
+            name="quotas",
+        ).data(quota_rows).cte()
+        new_agent = (
+            select(quotas.c.agent_id)
+            .join(ranked, and_(ranked.c.categorie == quotas.c.categorie,
+                               ranked.c.rank.between(quotas.c.first, quotas.c.last)))
+            .where(ranked.c.id == models.Ticket.id)
+            .scalar_subquery()
+        )
+        reassigned = dict(db.execute(
+            update(models.Ticket)
+            .where(models.Ticket.id.in_(
+                select(ranked.c.id).where(ranked.c.categorie.in_({row[0] for row in quota_rows}))
+            ))
+            .values(agent_id=new_agent, version=models.Ticket.version + 1)
+            .returning(models.Ticket.id, models.Ticket.agent_id)
+            .execution_options(synchronize_session=False)
+        ).all())
+
+    # Tickets ouverts sans remplaçant : restent ouverts sans agent ; les tickets clos ne changent pas
+    unassigned = db.scalars(
+        update(models.Ticket)
+        .where(models.Ticket.agent_id.in_(agent_ids), is_open)
+        .values(agent_id=None, version=models.Ticket.version + 1)
+        .returning(models.Ticket.id)
+        .execution_options(synchronize_session=False)
+    ).all()
+    return deleted, reassigned, unassigned
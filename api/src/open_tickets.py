@@ -0,0 +1,322 @@
+"""Tickets ouverts (en attente ou en cours) gardés en mémoire
+
+Seuls les tickets ouverts comptent pour l'activité en direct : file
+d'attente, tickets ouverts par agent, compteurs « en attente / en cours » du
+tableau de bord. Ils sont chargés au démarrage puis tenus à jour par les
+écritures (création, changements de statut) ; ces lectures ne touchent plus
+la base.
+
+Les tickets sont rangés dans des colonnes NumPy préallouées (capacité fixe,
+une trentaine d'octets par ticket) : supprimer un ticket déplace la dernière
+ligne dans la case libérée. Les compteurs par statut, agent et service sont
+mis à jour à chaque écriture. Les colonnes (et NumPy lui-même) ne sont
+alloués qu'au premier chargement, pour garder NumPy hors du démarrage de
+l'API : d'ici là, les écritures sont ignorées, le chargement les lira en
+base. Les tickets signalés par les autres workers
+(journal de coordination) sont relus en une requête à la lecture suivante.
+"""
+import threading
+
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session, aliased
+
+from ..config import settings
+from . import models
+from .coordination import coordinator
+
+OPEN_STATUSES = ("pending", "in_progress")
+_STATUS_CODES = {statut: code for code, statut in enumerate(OPEN_STATUSES)}
+# Ticket sans agent
+_NO_AGENT = -1
+
+
+def _latest_event():
+    event = aliased(models.Evenement)
+    return (
+        select(func.max(event.id))
+        .where(event.ticket_id == models.Ticket.id)
+        .correlate(models.Ticket)
+        .scalar_subquery()
+    )
+
+
+def _ticket_rows(db: Session, condition):
+    """Tickets avec le statut et la date de leur dernier événement (aucun : statut initial)"""
+    return db.execute(
+        select(
+            models.Ticket.id,
+            models.Ticket.agent_id,
+            models.Ticket.categorie_service,
+            models.Ticket.date_creation,
+            models.Evenement.statut,
+            models.Evenement.date,
+        )
+        .outerjoin(models.Evenement, models.Evenement.id == _latest_event())
+        .where(condition)
+    ).all()
+
+
+def _bump(counts, key, status, delta):
+    per_status = counts.setdefault(key, [0] * len(OPEN_STATUSES))
+    per_status[status] += delta
+    # Plus aucun ticket ouvert : la clé disparaît (mémoire bornée par les tickets ouverts)
+    if not any(per_status):
+        del counts[key]
+
+
+class OpenTicketStore:
+    """Tickets ouverts d'une agence, en colonnes de taille fixe
+
+    Au-delà de `capacity` tickets ouverts, les plus anciens (vraisemblablement
+    abandonnés) sont écartés et comptés dans `evicted`.
+    """
+
+    __slots__ = (
+        "capacity", "size", "evicted", "ids", "agents", "services", "statuses", "created", "updated",
+        "_slots", "_service_codes", "_service_names", "_counts", "_agent_counts", "_service_counts",
+        "_generation", "_loaded_generation", "_dirty", "_dirty_lock", "_lock",
+    )
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        # Colonnes allouées au premier chargement (voir `_allocate`)
+        self.ids = self.agents = self.services = self.statuses = self.created = self.updated = None
+        # Catégories de service codées sur 2 octets
+        self._service_codes = {}
+        self._service_names = []
+        self._lock = threading.Lock()
+        # Marques posées par le journal de coordination : jamais sous le verrou principal,
+        # pour ne pas bloquer les autres caches pendant un chargement
+        self._dirty = set()
+        self._dirty_lock = threading.Lock()
+        self._generation = 0
+        self._loaded_generation = None
+        self._clear()
+
+    def _allocate(self):
+        import numpy as np
+
+        capacity = self.capacity
+        self.ids = np.zeros(capacity, dtype=np.int64)
+        self.agents = np.zeros(capacity, dtype=np.int64)
+        self.services = np.zeros(capacity, dtype=np.int16)
+        self.statuses = np.zeros(capacity, dtype=np.int8)
+        self.created = np.zeros(capacity, dtype="datetime64[us]")
+        self.updated = np.zeros(capacity, dtype="datetime64[us]")
+
+    def _clear(self):
+        self.size = 0
+        self.evicted = 0
+        self._slots = {}
+        self._counts = [0] * len(OPEN_STATUSES)
+        self._agent_counts = {}
+        self._service_counts = {}
+
+    def _service_code(self, categorie_service):
+        code = self._service_codes.get(categorie_service)
+        if code is None:
+            code = self._service_codes[categorie_service] = len(self._service_names)
+            self._service_names.append(categorie_service)
+        return code
+
+    def _count(self, slot, delta):
+        status = self.statuses[slot]
+        self._counts[status] += delta
+        agent_id = int(self.agents[slot])
+        if agent_id != _NO_AGENT:
+            _bump(self._agent_counts, agent_id, status, delta)
+        _bump(self._service_counts, int(self.services[slot]), status, delta)
+
+    def _put(self, ticket_id, agent_id, categorie_service, statut, created, updated):
+        slot = self._slots.get(ticket_id)
+        if slot is None:
+            if self.size == self.capacity:
+                import numpy as np
+
+                self._remove(int(self.ids[int(np.argmin(self.created[:self.size]))]))
+                self.evicted += 1
+            slot = self._slots[ticket_id] = self.size
+            self.size += 1
+            self.ids[slot] = ticket_id
+        else:
+            self._count(slot, -1)
+        self.agents[slot] = _NO_AGENT if agent_id is None else agent_id
+        self.services[slot] = self._service_code(categorie_service)
+        self.statuses[slot] = _STATUS_CODES[statut]
+        self.created[slot] = created
+        self.updated[slot] = updated
+        self._count(slot, 1)
+
+    def _remove(self, ticket_id):
+        slot = self._slots.pop(ticket_id, None)
+        if slot is None:
+            return
+        self._count(slot, -1)
+        last = self.size - 1
+        if slot != last:
+            # La dernière ligne prend la case libérée : les colonnes restent contiguës
+            for column in (self.ids, self.agents, self.services, self.statuses, self.created, self.updated):
+                column[slot] = column[last]
+            self._slots[int(self.ids[slot])] = slot
+        self.size = last
+
+    def _apply(self, rows):
+        for ticket_id, agent_id, categorie_service, date_creation, statut, date in rows:
+            statut = statut.value if statut is not None else OPEN_STATUSES[0]
+            if statut in _STATUS_CODES:
+                self._put(ticket_id, agent_id, categorie_service, statut, date_creation, date or date_creation)
+            else:
+                self._remove(ticket_id)
+
+    # Écritures de ce worker (données connues : aucune lecture)
+    def opened(self, ticket_id, agent_id, categorie_service, created):
+        with self._lock:
+            if self.ids is None:
+                return
+            self._put(ticket_id, agent_id, categorie_service, OPEN_STATUSES[0], created, created)
+
+    def status_changed(self, ticket_ids, statut, when):
+        with self._lock:
+            if self.ids is None:
+                return
+            for ticket_id in ticket_ids:
+                slot = self._slots.get(ticket_id)
+                if statut not in _STATUS_CODES:
+                    self._remove(ticket_id)
+                elif slot is None:
+                    # Ticket écarté ou inconnu : relu à la prochaine lecture
+                    self.mark_dirty(ticket_id)
+                else:
+                    self._count(slot, -1)
+                    self.statuses[slot] = _STATUS_CODES[statut]
+                    self.updated[slot] = when
+                    self._count(slot, 1)
+
+    # Écritures des autres workers
+    def mark_dirty(self, ticket_id):
+        with self._dirty_lock:
+            self._dirty.add(ticket_id)
+
+    def invalidate(self):
+        """Tout sera rechargé à la prochaine lecture"""
+        self._generation += 1
+
+    def sync(self, db: Session):
+        """Applique les écritures signalées depuis la dernière lecture (chargement complet au besoin)"""
+        coordinator.sync()
+        with self._lock:
+            generation = self._generation
+            if self._loaded_generation != generation:
+                with self._dirty_lock:
+                    self._dirty.clear()
+                rows = _ticket_rows(
+                    db, func.coalesce(models.Evenement.statut, OPEN_STATUSES[0]).in_(OPEN_STATUSES)
+                )
+                if self.ids is None:
+                    self._allocate()
+                self._clear()
+                self._apply(rows)
+                self._loaded_generation = generation
+                return
+            with self._dirty_lock:
+                dirty, self._dirty = self._dirty, set()
+            if dirty:
+                found = _ticket_rows(db, models.Ticket.id.in_(dirty))
+                self._apply(found)
+                # Tickets supprimés entre-temps
+                for ticket_id in dirty - {row[0] for row in found}:
+                    self._remove(ticket_id)
+
+    # Lectures
+    def queue(self, db: Session, statut=None, categorie_service=None, agent_id=None, limit=100):
+        """Tickets ouverts dans l'ordre d'arrivée ; renvoie (total, tickets)"""
+        import numpy as np
+
+        self.sync(db)
+        with self._lock:
+            size = self.size
+            mask = np.ones(size, dtype=bool)
+            if statut is not None:
+                mask &= self.statuses[:size] == _STATUS_CODES[statut]
+            if categorie_service is not None:
+                code = self._service_codes.get(categorie_service)
+                if code is None:
+                    return 0, []
+                mask &= self.services[:size] == code
+            if agent_id is not None:
+                mask &= self.agents[:size] == agent_id
+            slots = np.flatnonzero(mask)
+            # Ordre d'arrivée, l'identifiant départage les ex aequo
+            slots = slots[np.lexsort((self.ids[slots], self.created[slots]))][:limit]
+            tickets = [
+                {
+                    "id": int(self.ids[slot]),
+                    "agent_id": None if self.agents[slot] == _NO_AGENT else int(self.agents[slot]),
+                    "categorie_service": self._service_names[self.services[slot]],
+                    "statut": OPEN_STATUSES[self.statuses[slot]],
+                    "date_creation": self.created[slot].item(),
+                    "updated_at": self.updated[slot].item(),
+                }
+                for slot in slots.tolist()
+            ]
+            return int(np.count_nonzero(mask)), tickets
+
+    def counts(self, db: Session):
+        """Tickets ouverts par statut, par agent et par service"""
+        self.sync(db)
+        with self._lock:
+            def named(per_status):
+                return dict(zip(OPEN_STATUSES, per_status))
+
+            return {
+                **named(self._counts),
+                "by_agent": {agent_id: named(counts) for agent_id, counts in self._agent_counts.items()},
+                "by_service": {
+                    self._service_names[code]: named(counts) for code, counts in self._service_counts.items()
+                },
+                "evicted": self.evicted,
+            }
+
+
+def store_for(db: Session):
+    """Tickets ouverts de l'agence à laquelle la session est rattachée"""
+    return stores[db.info.get("agence", settings.AGENCE_PAR_DEFAUT)]
+
+
+def _publish(db: Session, ticket_ids):
+    cache_id = _cache_ids[db.info.get("agence", settings.AGENCE_PAR_DEFAUT)]
+    for ticket_id in ticket_ids:
+        coordinator.publish(cache_id, ticket_id)
+
+
+def opened(db: Session, ticket):
+    """Ticket tout juste créé (transaction validée)"""
+    store_for(db).opened(ticket.id, ticket.agent_id, ticket.categorie_service, ticket.date_creation)
+    _publish(db, [ticket.id])
+
+
+def status_changed(db: Session, ticket_ids, statut, when):
+    """Nouveau statut validé pour ces tickets"""
+    store_for(db).status_changed(ticket_ids, statut, when)
+    _publish(db, ticket_ids)
+
+
+def changed(db: Session, ticket_ids):
+    """Autres champs modifiés (agent, service) : les tickets sont relus à la prochaine lecture"""
+    store = store_for(db)
+    for ticket_id in ticket_ids:
+        store.mark_dirty(ticket_id)
+    _publish(db, ticket_ids)
+
+
+def forget_all(db: Session):
+    """Rechargement complet (base réinitialisée) dans tous les workers"""
+    agence = db.info.get("agence", settings.AGENCE_PAR_DEFAUT)
+    stores[agence].invalidate()
+    coordinator.publish_clear(_cache_ids[agence])
+
+
+stores = {agence: OpenTicketStore(settings.OPEN_TICKETS_CAPACITY) for agence in settings.AGENCES}
+_cache_ids = {
+    agence: coordinator.register(store.mark_dirty, store.invalidate) for agence, store in stores.items()
+}
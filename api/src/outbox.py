@@ -0,0 +1,206 @@
+"""Tâches différées : effets de bord exécutés après la requête (outbox SQLite)
+
+Une écriture qui déclenche un effet de bord (agrégats, notifications, purge,
+journal d'audit...) l'ajoute à la table `outbox` dans sa propre transaction
+(`enqueue`) : la tâche est durable et n'existe que si l'écriture est validée.
+La requête répond sans l'exécuter ; un thread par processus la traite ensuite.
+
+Le thread réserve un lot de tâches prêtes (bail de `lease_seconds`, qui rend
+la tâche à la file si le processus s'arrête en cours de route), puis appelle
+une seule fois le gestionnaire de chaque type avec toutes les tâches de ce
+type. Les écritures du gestionnaire et la suppression des tâches traitées
+sont validées ensemble. En cas d'échec, les tâches sont reprogrammées avec un
+délai doublé à chaque tentative ; au-delà de `max_attempts`, elles restent
+dans la table (`available_at` à NULL) pour examen.
+
+Plusieurs workers peuvent traiter la même file : la réservation est un seul
+UPDATE ... RETURNING, SQLite sérialisant les écrivains.
+"""
+import json
+import logging
+import threading
+from datetime import datetime, timedelta
+
+from sqlalchemy import event, func, select, update
+from sqlalchemy.orm import Session
+
+from ..config import settings
+from . import models
+from .metrics import registry
+
+logger = logging.getLogger("smart_agence.outbox")
+
+# Délai maximal entre deux tentatives
+MAX_RETRY_SECONDS = 300
+
+# Gestionnaires par type de tâche : fn(db, payloads)
+handlers = {}
+
+
+def handler(kind):
+    """Déclare le gestionnaire d'un type de tâche ; il reçoit toutes les tâches réservées de ce type"""
+    def decorate(fn):
+        handlers[kind] = fn
+        return fn
+    return decorate
+
+
+def enqueue(db: Session, kind, payload=None):
+    """Ajoute une tâche à la transaction en cours ; exécutée après validation"""
+    now = datetime.utcnow()
+    db.add(models.OutboxJob(kind=kind, payload=json.dumps(payload), created_at=now, available_at=now))
+    db.info["outbox_pending"] = True
+
+
+@event.listens_for(Session, "after_commit")
+def _after_commit(db):
+    if db.info.pop("outbox_pending", False):
+        worker.wake()
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _after_rollback(db, previous_transaction):
+    db.info.pop("outbox_pending", None)
+
+
+class OutboxWorker:
+    def __init__(self, sessionmakers, poll_seconds=1.0, batch_size=100, max_attempts=8,
+                 retry_seconds=1.0, lease_seconds=60):
+        self.sessionmakers = sessionmakers
+        self.poll_seconds = poll_seconds
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.retry_seconds = retry_seconds
+        self.lease_seconds = lease_seconds
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="outbox", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    def wake(self):
+        self._wake.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.poll_seconds)
+            self._wake.clear()
+            for agence in self.sessionmakers:
+                try:
+                    # Lots successifs tant que la file n'est pas vide
+                    while not self._stop.is_set() and self.process(agence):
+                        pass
+                except Exception:
+                    # Base indisponible (verrou, fichier) : nouvel essai au tour suivant
+                    logger.exception("File de tâches de l'agence %s inaccessible", agence)
+
+    def _claim(self, db: Session):
+        now = datetime.utcnow()
+        ready = (
+            select(models.OutboxJob.id)
+            .where(models.OutboxJob.available_at <= now)
+            .order_by(models.OutboxJob.id)
+            .limit(self.batch_size)
+        )
+        # Lecture d'abord : une file vide ne prend jamais le verrou d'écriture
+        ids = db.scalars(ready).all()
+        if not ids:
+            db.rollback()
+            return []
+        # Condition revérifiée dans l'UPDATE : une tâche réservée entre-temps par un autre worker est ignorée
+        jobs = db.execute(
+            update(models.OutboxJob)
+            .where(models.OutboxJob.id.in_(ids), models.OutboxJob.available_at <= now)
+            .values(
+                attempts=models.OutboxJob.attempts + 1,
+                available_at=now + timedelta(seconds=self.lease_seconds),
+            )
+            .returning(
+                models.OutboxJob.id, models.OutboxJob.kind, models.OutboxJob.payload,
+                models.OutboxJob.attempts, models.OutboxJob.created_at,
+            )
+        ).all()
+        db.commit()
+        return jobs
+
+    def process(self, agence):
+        """Traite un lot de tâches prêtes ; renvoie le nombre de tâches réservées"""
+        db = self.sessionmakers[agence]()
+        try:
+            jobs = self._claim(db)
+            by_kind = {}
+            for job in jobs:
+                by_kind.setdefault(job.kind, []).append(job)
+            for kind, batch in by_kind.items():
+                self._handle(db, agence, kind, batch)
+            registry.set_outbox_depth(agence, *self.depth(db))
+            return len(jobs)
+        finally:
+            db.close()
+
+    def _handle(self, db: Session, agence, kind, batch):
+        ids = [job.id for job in batch]
+        try:
+            fn = handlers.get(kind)
+            if fn is None:
+                raise LookupError(f"Aucun gestionnaire pour les tâches {kind!r}")
+            fn(db, [json.loads(job.payload) for job in batch])
+            db.execute(models.OutboxJob.__table__.delete().where(models.OutboxJob.id.in_(ids)))
+            db.commit()
+        except Exception as exc:
+            db.rollback()
+            logger.warning("Tâches %s en échec (%d) : %s", kind, len(batch), exc)
+            now = datetime.utcnow()
+            for job in batch:
+                dead = job.attempts >= self.max_attempts
+                delay = min(self.retry_seconds * 2 ** (job.attempts - 1), MAX_RETRY_SECONDS)
+                db.execute(
+                    update(models.OutboxJob)
+                    .where(models.OutboxJob.id == job.id)
+                    .values(
+                        available_at=None if dead else now + timedelta(seconds=delay),
+                        last_error=str(exc)[:500],
+                    )
+                )
+            db.commit()
+            registry.record_outbox(agence, kind, "error", len(batch))
+            return
+        now = datetime.utcnow()
+        registry.record_outbox(
+            agence, kind, "ok", len(batch), lags=[(now - job.created_at).total_seconds() for job in batch]
+        )
+
+    def depth(self, db: Session):
+        """Tâches en file (prêtes, reprogrammées ou en cours) et tâches abandonnées"""
+        queued, dead = db.execute(
+            select(
+                func.count(models.OutboxJob.available_at),
+                func.count() - func.count(models.OutboxJob.available_at),
+            )
+        ).one()
+        return queued, dead
+
+
+def _create():
+    from .routing import router
+
+    return OutboxWorker(
+        router.sessionmakers,
+        poll_seconds=settings.OUTBOX_POLL_SECONDS,
+        batch_size=settings.OUTBOX_BATCH_SIZE,
+        max_attempts=settings.OUTBOX_MAX_ATTEMPTS,
+        retry_seconds=settings.OUTBOX_RETRY_SECONDS,
+        lease_seconds=settings.OUTBOX_LEASE_SECONDS,
+    )
+
+
+worker = _create()
@@ -0,0 +1,294 @@
+"""Rapports d'activité par jour et par semaine (tickets par service, par agent, taux de clôture, SLA)
+
+Un rapport décrit les tickets créés pendant la période, dans l'état où ils
+étaient à sa fin (événements antérieurs à la fin de la période seulement) :
+une fois la période close, son rapport ne change plus. Il est donc calculé
+une seule fois, par la tâche de maintenance `reports` ou à la première
+demande, puis gardé dans la table `reports` sous forme de JSON compact et
+servi tel quel. Seule la période en cours est calculée à chaque demande.
+
+Périodes (UTC) : un jour `2026-10-18` ou une semaine ISO `2026-W42` (lundi
+au dimanche). Le SLA est le délai de prise en charge (premier passage « en
+cours ») : un ticket le respecte s'il est pris en charge en moins de
+`REPORTS_SLA_WAIT_MINUTES` minutes ; un ticket encore en attente au-delà de
+ce délai à la fin de la période compte comme hors délai.
+
+Seules les périodes des `REPORTS_HISTORY_DAYS` derniers jours sont gardées :
+une période plus ancienne est calculée à la demande, sans être enregistrée.
+Les rapports gardés ne sont pas recalculés si des tickets anciens sont
+modifiés après coup ; ils sont effacés par `POST /reset` et `POST /seed`.
+"""
+import csv
+import io
+import json
+import re
+from datetime import date, datetime, time, timedelta
+
+from sqlalchemy import case, delete, func, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from ..config import settings
+from . import models
+
+SERVICES = "services"
+AGENTS = "agents"
+KINDS = (SERVICES, AGENTS)
+
+DAY = "day"
+WEEK = "week"
+GRANULARITIES = (DAY, WEEK)
+
+# Formes canoniques uniquement : une même période n'a qu'une clé
+_DAY = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+_WEEK = re.compile(r"^(\d{4})-W(\d{2})$")
+
+
+class UnknownPeriod(ValueError):
+    """Période mal formée ou pas encore commencée"""
+
+
+def period_key(granularity, day: date):
+    """Clé de la période (jour ou semaine ISO) contenant `day`"""
+    if granularity == DAY:
+        return day.isoformat()
+    year, week, _ = day.isocalendar()
+    return f"{year}-W{week:02d}"
+
+
+def period_bounds(period):
+    """(granularité, début, fin) d'une clé de période ; UnknownPeriod si elle est mal formée"""
+    match = _WEEK.match(period)
+    try:
+        if match:
+            start = date.fromisocalendar(int(match[1]), int(match[2]), 1)
+            granularity, length = WEEK, timedelta(days=7)
+        elif _DAY.match(period):
+            start = date.fromisoformat(period)
+            granularity, length = DAY, timedelta(days=1)
+        else:
+            raise ValueError(period)
+    except ValueError:
+        raise UnknownPeriod(f"Unknown period {period!r} (expected YYYY-MM-DD or YYYY-Www)")
+    start = datetime.combine(start, time())
+    return granularity, start, start + length
+
+
+def _minutes(delta):
+    return delta.total_seconds() / 60
+
+
+def _stats():
+    return {"tickets": 0, "done": 0, "canceled": 0, "open": 0, "_waits": [], "_handling": [], "_sla": [0, 0]}
+
+
+def _finish(stats):
+    """Indicateurs d'un groupe de tickets (moyennes et taux arrondis)"""
+    waits, handling, (met, counted) = stats.pop("_waits"), stats.pop("_handling"), stats.pop("_sla")
+    tickets = stats["tickets"]
+    stats["completion_rate"] = round(stats["done"] / tickets, 4) if tickets else None
+    stats["avg_wait_minutes"] = round(sum(waits) / len(waits), 1) if waits else None
+    stats["avg_handling_minutes"] = round(sum(handling) / len(handling), 1) if handling else None
+    stats["sla_rate"] = round(met / counted, 4) if counted else None
+    return stats
+
+
+def compute(db: Session, kind, start: datetime, end: datetime):
+    """Contenu du rapport : totaux et une ligne par service ou par agent (une requête, plus les agents)"""
+    ev = models.Evenement
+    ticket = models.Ticket
+
+    def first(statut):
+        return func.min(case((ev.statut == statut, ev.date)))
+
+    rows = db.execute(
+        select(
+            ticket.categorie_service,
+            ticket.agent_id,
+            ticket.date_creation,
+            first(models.TicketStatus.in_progress),
+            first(models.TicketStatus.done),
+            first(models.TicketStatus.canceled),
+        )
+        .outerjoin(ev, (ev.ticket_id == ticket.id) & (ev.date < end))
+        .where(ticket.date_creation >= start, ticket.date_creation < end)
+        .group_by(ticket.id)
+    ).all()
+
+    sla = timedelta(minutes=settings.REPORTS_SLA_WAIT_MINUTES)
+    totals = _stats()
+    groups = {}
+    for service, agent_id, created, started, done, canceled in rows:
+        key = service if kind == SERVICES else agent_id
+        for stats in (totals, groups.setdefault(key, _stats())):
+            stats["tickets"] += 1
+            if done is not None:
+                stats["done"] += 1
+            elif canceled is not None:
+                stats["canceled"] += 1
+            else:
+                stats["open"] += 1
+            if started is not None:
+                stats["_waits"].append(_minutes(started - created))
+                if done is not None:
+                    stats["_handling"].append(_minutes(done - started))
+            # Pris en charge : dans les délais ou non ; en attente : hors délai une fois le délai dépassé
+            waited = (started or end) - created
+            if started is not None or waited > sla:
+                stats["_sla"][0] += waited <= sla
+                stats["_sla"][1] += 1
+
+    if kind == SERVICES:
+        lines = [{"categorie_service": service, **_finish(stats)} for service, stats in sorted(groups.items())]
+    else:
+        agents = {
+            agent.id: agent
+            for agent in db.scalars(select(models.Agent).where(models.Agent.id.in_([k for k in groups if k])))
+        }
+
+        def describe(agent_id):
+            agent = agents.get(agent_id)
+            if agent is None:
+                return {"agent_id": agent_id, "nom": None, "prenoms": None, "categorie": None}
+            return {"agent_id": agent_id, "nom": agent.nom, "prenoms": agent.prenoms, "categorie": agent.categorie.value}
+
+        lines = [
+            {**describe(agent_id), **_finish(stats)}
+            for agent_id, stats in sorted(groups.items(), key=lambda item: (item[0] is None, item[0] or 0))
+        ]
+    return {"totals": _finish(totals), "rows": lines}
+
+
+def _content(kind, period, start, end, generated_at, body, live):
+    return {
+        "kind": kind, "period": period, "start": start.isoformat(), "end": end.isoformat(),
+        "generated_at": generated_at.isoformat(), "live": live,
+        "sla_wait_minutes": settings.REPORTS_SLA_WAIT_MINUTES, **body,
+    }
+
+
+def store(db: Session, kind, period):
+    """Calcule et garde le rapport d'une période close ; renvoie la ligne `reports`"""
+    granularity, start, end = period_bounds(period)
+    generated_at = datetime.utcnow()
+    body = compute(db, kind, start, end)
+    report = models.Report(
+        kind=kind, period=period, granularity=granularity, start=start, end=end,
+        generated_at=generated_at, tickets=body["totals"]["tickets"],
+        content=json.dumps(_content(kind, period, start, end, generated_at, body, False), separators=(",", ":")),
+    )
+    db.add(report)
+    try:
+        db.commit()
+    except IntegrityError:
+        # Calculé au même moment par un autre worker : sa version est gardée
+        db.rollback()
+        return db.get(models.Report, (kind, period))
+    return report
+
+
+def _history_start(now):
+    """Début de l'historique gardé : les périodes qui finissent avant ne sont pas enregistrées"""
+    return datetime.combine(now.date() - timedelta(days=settings.REPORTS_HISTORY_DAYS), time())
+
+
+def get(db: Session, kind, period, now=None):
+    """(texte JSON du rapport, ligne gardée ou None si le rapport n'est pas gardé)
+
+    UnknownPeriod si la période n'a pas encore commencé.
+    """
+    granularity, start, end = period_bounds(period)
+    # Clé recalculée à partir des bornes : rien n'est lu ni gardé sous une autre forme
+    period = period_key(granularity, start.date())
+    now = now or datetime.utcnow()
+    if start > now:
+        raise UnknownPeriod(f"Period {period} has not started yet")
+    if end > now:
+        # Période en cours : état à l'instant présent
+        body = compute(db, kind, start, now)
+        return json.dumps(_content(kind, period, start, now, now, body, True), separators=(",", ":")), None
+    report = db.get(models.Report, (kind, period))
+    if report is None and end <= _history_start(now):
+        # Hors de l'historique gardé : calculée à la demande, sans écriture
+        body = compute(db, kind, start, end)
+        return json.dumps(_content(kind, period, start, end, now, body, False), separators=(",", ":")), None
+    report = report or store(db, kind, period)
+    return report.content, report
+
+
+def closed_periods(now=None, history_days=None):
+    """Périodes closes des `history_days` derniers jours, de la plus récente à la plus ancienne"""
+    now = now or datetime.utcnow()
+    history_days = settings.REPORTS_HISTORY_DAYS if history_days is None else history_days
+    today = now.date()
+    periods = []
+    for granularity in GRANULARITIES:
+        seen = set()
+        for offset in range(1, history_days + 1):
+            day = today - timedelta(days=offset)
+            period = period_key(granularity, day)
+            if period not in seen and period_bounds(period)[2] <= now:
+                seen.add(period)
+                periods.append(period)
+    return periods
+
+
+def generate_missing(db: Session, now=None, limit=None):
+    """Calcule les rapports des périodes closes récentes qui manquent ; renvoie le nombre calculé"""
+    periods = closed_periods(now)
+    existing = set(db.execute(
+        select(models.Report.kind, models.Report.period).where(models.Report.period.in_(periods))
+    ).all())
+    db.rollback()
+    generated = 0
+    for period in periods:
+        for kind in KINDS:
+            if (kind, period) not in existing:
+                store(db, kind, period)
+                generated += 1
+                if limit is not None and generated >= limit:
+                    return generated
+    return generated
+
+
+def index(db: Session, kind=None, granularity=None, now=None):
+    """Rapports gardés, plus ceux de la période en cours (calculés à la demande)"""
+    now = now or datetime.utcnow()
+    query = select(
+        models.Report.kind, models.Report.period, models.Report.granularity, models.Report.start,
+        models.Report.end, models.Report.generated_at, models.Report.tickets,
+    ).order_by(models.Report.start.desc(), models.Report.granularity, models.Report.kind)
+    if kind is not None:
+        query = query.where(models.Report.kind == kind)
+    if granularity is not None:
+        query = query.where(models.Report.granularity == granularity)
+    current = []
+    for period_granularity in GRANULARITIES:
+        if granularity not in (None, period_granularity):
+            continue
+        period = period_key(period_granularity, now.date())
+        _, start, end = period_bounds(period)
+        current += [
+            {
+                "kind": report_kind, "period": period, "granularity": period_granularity, "start": start,
+                "end": end, "generated_at": None, "tickets": None, "live": True,
+            }
+            for report_kind in KINDS if kind in (None, report_kind)
+        ]
+    return current + [{**row._asdict(), "live": False} for row in db.execute(query)]
+
+
+def forget_all(db: Session):
+    """Efface les rapports gardés (données remplacées), dans la transaction en cours"""
+    db.execute(delete(models.Report))
+
+
+def to_csv(content):
+    """Lignes du rapport au format CSV (une colonne par indicateur)"""
+    rows = content["rows"]
+    output = io.StringIO()
+    if rows:
+        writer = csv.DictWriter(output, fieldnames=list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
+    return output.getvalue()
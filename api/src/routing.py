@@ -0,0 +1,88 @@
+"""Routage multi-agences : une base SQLite par agence
+
+Chaque agence a son propre fichier de base (et donc son propre verrou
+d'écriture) : les écritures de plusieurs agences ne se bloquent plus entre
+elles. L'agence par défaut utilise `DATABASE_URL`, les autres le gabarit
+`AGENCE_DATABASE_URL`. Les agrégats réseau interrogent toutes les agences
+en parallèle puis fusionnent les résultats.
+"""
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import Session, sessionmaker
+
+from ..config import settings
+from .database import SessionLocal, engine as default_engine, make_engine
+
+BRANCH_CODE = re.compile(r"^[a-z0-9_-]{1,32}$")
+
+
+class UnknownBranch(LookupError):
+    pass
+
+
+def _create_branch_engine(code):
+    url = make_url(settings.AGENCE_DATABASE_URL.format(agence=code))
+    if url.get_backend_name() == "sqlite" and url.database:
+        directory = os.path.dirname(url.database)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+    return make_engine(url)
+
+
+class BranchRouter:
+    def __init__(self, codes, default):
+        for code in codes:
+            if not BRANCH_CODE.match(code):
+                raise ValueError(f"Code d'agence invalide : {code!r}")
+        if default not in codes:
+            raise ValueError(f"Agence par défaut inconnue : {default!r}")
+        self.default = default
+        self.engines = {}
+        self.sessionmakers = {}
+        for code in codes:
+            if code == default:
+                self.engines[code] = default_engine
+                self.sessionmakers[code] = SessionLocal
+            else:
+                engine = _create_branch_engine(code)
+                self.engines[code] = engine
+                self.sessionmakers[code] = sessionmaker(
+                    autocommit=False, autoflush=False, bind=engine, info={"agence": code}
+                )
+        self._executor = ThreadPoolExecutor(
+            max_workers=min(len(codes), 16), thread_name_prefix="agences"
+        )
+
+    @property
+    def codes(self):
+        return list(self.engines)
+
+    def session(self, code=None) -> Session:
+        """Session sur la base de l'agence `code` (agence par défaut si None)"""
+        maker = self.sessionmakers.get(code or self.default)
+        if maker is None:
+            raise UnknownBranch(code)
+        return maker()
+
+    def fan_out(self, fn):
+        """Exécute `fn(db)` sur chaque agence en parallèle ; renvoie {code: résultat}"""
+
+        def _run(code):
+            db = self.session(code)
+            try:
+                return fn(db)
+            finally:
+                db.close()
+
+        futures = {code: self._executor.submit(_run, code) for code in self.engines}
+        return {code: future.result() for code, future in futures.items()}
+
+
+def branch_of(db: Session):
+    return db.info.get("agence", settings.AGENCE_PAR_DEFAUT)
+
+
+router = BranchRouter(settings.AGENCES, settings.AGENCE_PAR_DEFAUT)
@@ -0,0 +1,68 @@
+from sqlalchemy import MetaData, inspect, text
+from sqlalchemy.schema import CreateColumn, CreateTable
+
+from . import models, search
+
+# À incrémenter à chaque modification du schéma (tables, colonnes, index)
+SCHEMA_VERSION = 11
+
+
+def _current_version(conn):
+    return conn.execute(text("PRAGMA user_version")).scalar()
+
+
+def _drop_email_constraint(conn):
+    """Retire la contrainte UNIQUE de l'email des tables d'agents créées avant les départs
+
+    L'unicité ne vaut plus que pour les agents présents (index partiel). SQLite
+    ne sait pas supprimer une contrainte : la table est recréée puis recopiée.
+    Les clés étrangères ne sont pas vérifiées, les tickets et événements gardent
+    leurs références vers `agents`.
+    """
+    if not any(row[3] == "u" for row in conn.execute(text("PRAGMA index_list(agents)"))):
+        return
+    agents = models.Agent.__table__
+    rebuilt = agents.to_metadata(MetaData(), name="agents_rebuilt")
+    columns = ", ".join(column.name for column in agents.columns)
+    conn.execute(text("DROP TABLE IF EXISTS agents_rebuilt"))
+    conn.execute(CreateTable(rebuilt))
+    conn.execute(text(f"INSERT INTO agents_rebuilt ({columns}) SELECT {columns} FROM agents"))
+    conn.execute(text("DROP TABLE agents"))
+    conn.execute(text("ALTER TABLE agents_rebuilt RENAME TO agents"))
+
+
+def ensure_schema(engine):
+    """Met le schéma à jour ; une seule requête quand il est déjà à jour
+
+    Sous SQLite, la version appliquée est mémorisée dans `PRAGMA user_version`.
+    """
+    sqlite = engine.dialect.name == "sqlite"
+    with engine.connect() as conn:
+        if sqlite:
+            if _current_version(conn) == SCHEMA_VERSION:
+                return False
+            if conn.execute(text("PRAGMA page_count")).scalar() == 0:
+                # Base neuve : les pages libérées pourront être rendues au système
+                # par étapes (PRAGMA incremental_vacuum), sans VACUUM bloquant
+                conn.execute(text("PRAGMA auto_vacuum = INCREMENTAL"))
+        # Tables manquantes, puis colonnes et index ajoutés après coup sur des tables existantes
+        # (une colonne ajoutée doit accepter NULL ou avoir une valeur par défaut côté serveur)
+        models.Base.metadata.create_all(bind=conn)
+        inspector = inspect(conn)
+        for table in models.Base.metadata.sorted_tables:
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing:
+                    ddl = CreateColumn(column).compile(dialect=conn.dialect)
+                    conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {ddl}"))
+        if sqlite:
+            _drop_email_constraint(conn)
+        for table in models.Base.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(bind=conn, checkfirst=True)
+        if sqlite:
+            # Index de recherche FTS5 (hors métadonnées SQLAlchemy), rempli à sa création
+            search.create(conn)
+            conn.execute(text(f"PRAGMA user_version = {SCHEMA_VERSION}"))
+        conn.commit()
+    return True
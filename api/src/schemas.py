@@ -1,4 +1,4 @@
-from pydantic import BaseModel, EmailStr
+from pydantic import BaseModel, Field, field_validator
 from typing import Optional
 from datetime import datetime
 from enum import Enum
@@ -18,19 +18,71 @@ class AgentBase(BaseModel):
     prenoms: str
     annee_naissance: Optional[int]
     categorie: AgentCategory
-    email: Optional[EmailStr]
+    email: Optional[str] = Field(json_schema_extra={"format": "email"})
     telephone: Optional[str]
 
+def _validate_email(value):
+    # Validation équivalente à EmailStr, mais email-validator n'est importé qu'à la première
+    # écriture d'agent et les réponses (emails déjà validés) ne sont plus revérifiées
+    if value is None:
+        return value
+    from pydantic.networks import validate_email
+    return validate_email(value)[1]
+
 class AgentCreate(AgentBase):
-    pass
+    @field_validator("email")
+    @classmethod
+    def validate_email(cls, value):
+        return _validate_email(value)
+
+class AgentPatch(BaseModel):
+    # Seuls les champs envoyés sont modifiés ; un champ obligatoire ne peut pas être envoyé à null
+    nom: str = None
+    prenoms: str = None
+    annee_naissance: Optional[int] = None
+    categorie: AgentCategory = None
+    email: Optional[str] = Field(default=None, json_schema_extra={"format": "email"})
+    telephone: Optional[str] = None
+    # Version lue par le client : la modification est refusée (409) si l'agent a changé depuis
+    version: Optional[int] = None
+
+    @field_validator("email")
+    @classmethod
+    def validate_email(cls, value):
+        return _validate_email(value)
 
 class Agent(AgentBase):
     id: int
     date_enregistrement: datetime
+    version: int
+    # Renseignée au départ de l'agent (rapport de départ)
+    deleted_at: Optional[datetime] = None
 
     class Config:
         orm_mode = True
 
+class AgentSummary(BaseModel):
+    # Fiche résumée de l'agent embarquée dans les tickets (cache des agents, sans jointure)
+    id: int
+    nom: str
+    prenoms: str
+    categorie: AgentCategory
+
+class AgentOffboarding(BaseModel):
+    agent_ids: list[int] = Field(min_length=1, max_length=1000)
+    # Répartir les tickets ouverts entre les agents restants de la même catégorie
+    reassign: bool = True
+
+class TicketReassignment(BaseModel):
+    ticket_id: int
+    agent_id: int
+
+class OffboardingReport(BaseModel):
+    deleted: list[Agent]
+    reassigned: list[TicketReassignment]
+    # Tickets ouverts restés sans agent (aucun agent restant dans la catégorie)
+    unassigned: list[int]
+
 class TicketBase(BaseModel):
     categorie_service: str
     description: Optional[str]
@@ -38,14 +90,64 @@ class TicketBase(BaseModel):
 class TicketCreate(TicketBase):
     agent_id: int
 
+class TicketPatch(BaseModel):
+    # Seuls les champs envoyés sont modifiés
+    categorie_service: str = None
+    description: Optional[str] = None
+    agent_id: int = None
+    # Version lue par le client : la modification est refusée (409) si le ticket a changé depuis
+    version: Optional[int] = None
+
 class Ticket(TicketBase):
     id: int
     date_creation: datetime
-    agent_id: int
+    # NULL après suppression de l'agent
+    agent_id: Optional[int]
+    version: int
 
     class Config:
         orm_mode = True
 
+class TicketWithState(Ticket):
+    statut: TicketStatus
+    # None si le ticket n'a pas (ou plus) d'agent
+    agent: Optional[AgentSummary] = None
+
+class TicketPage(BaseModel):
+    items: list[TicketWithState]
+    total: int
+    page: int
+    page_size: int
+
+class TicketBatchUpdate(BaseModel):
+    ticket_ids: list[int] = Field(min_length=1, max_length=1000)
+    # Nouveau statut (événement pour chaque ticket) et/ou agent à qui réaffecter les tickets
+    statut: Optional[TicketStatus] = None
+    agent_id: Optional[int] = None
+
+class OpenTicket(BaseModel):
+    id: int
+    agent_id: Optional[int]
+    categorie_service: str
+    statut: str
+    date_creation: datetime
+    updated_at: datetime
+
+class OpenTicketQueue(BaseModel):
+    total: int
+    items: list[OpenTicket]
+
+class OpenTicketCounts(BaseModel):
+    pending: int
+    in_progress: int
+    by_agent: dict[int, dict[str, int]]
+    by_service: dict[str, dict[str, int]]
+    evicted: int
+
+class TicketReceipt(Ticket):
+    queue_ahead: Optional[int] = None
+    estimated_wait_minutes: Optional[float] = None
+
 class EvenementBase(BaseModel):
     statut: TicketStatus
 
@@ -56,7 +158,104 @@ class Evenement(EvenementBase):
     id: int
     ticket_id: int
     date: datetime
-    agent_id: int
+    # NULL après suppression de l'agent
+    agent_id: Optional[int]
 
     class Config:
-        orm_mode = True
\ No newline at end of file
+        orm_mode = True
+
+class TicketState(BaseModel):
+    ticket_id: int
+    statut: TicketStatus
+    transitions: list[TicketStatus]
+
+class WorkloadBucket(BaseModel):
+    start: datetime
+    end: datetime
+    busy_seconds: float
+    ticket_seconds: float
+    utilisation: float
+    peak_concurrent: int
+    done: int
+    throughput_per_hour: float
+
+class AgentWorkload(BaseModel):
+    agent_id: int
+    nom: str
+    prenoms: str
+    categorie: AgentCategory
+    buckets: list[WorkloadBucket]
+
+class WorkloadReport(BaseModel):
+    start: datetime
+    end: datetime
+    bucket_minutes: Optional[int]
+    agents: list[AgentWorkload]
+
+class BranchSummary(BaseModel):
+    agence: str
+    agents: int
+    tickets: int
+    tickets_by_service: dict[str, int]
+    tickets_by_status: dict[str, int]
+
+class NetworkSummary(BaseModel):
+    agences: list[BranchSummary]
+    total: BranchSummary
+
+class WaitForecast(BaseModel):
+    categorie_service: str
+    queue_ahead: int
+    estimated_wait_minutes: Optional[float]
+    mean_service_minutes: Optional[float]
+
+class ServiceProfile(BaseModel):
+    categorie_service: str
+    arrivals_per_hour: list[float]
+    service_rate_per_hour: list[float]
+    mean_service_minutes: Optional[float]
+
+class Change(BaseModel):
+    seq: int
+    table: str
+    row_id: Optional[int]
+    operation: str
+    date: datetime
+    # État courant de la ligne (absent après suppression)
+    data: Optional[dict] = None
+
+class ChangeFeed(BaseModel):
+    last_seq: int
+    # Curseur à renvoyer au prochain appel
+    next_since: int
+    has_more: bool
+    # Journal purgé ou base remise à zéro : recharger les listes complètes, puis reprendre à `next_since`
+    resync: bool
+    changes: list[Change]
+
+class MaintenanceReport(BaseModel):
+    agence: str
+    created: dict[str, int] = {}
+    duration_ms: float
+
+class MaintenanceJob(BaseModel):
+    agence: str
+    job: str
+    interval_seconds: float
+    runs: int
+    last_started: Optional[datetime]
+    last_duration_ms: Optional[float]
+    last_status: Optional[str]
+    last_detail: Optional[str]
+    next_run: datetime
+
+class ReportEntry(BaseModel):
+    kind: str
+    period: str
+    granularity: str
+    start: datetime
+    end: datetime
+    # Absents pour la période en cours, calculée à chaque demande
+    generated_at: Optional[datetime]
+    tickets: Optional[int]
+    live: bool
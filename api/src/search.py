@@ -0,0 +1,150 @@
+"""Recherche d'agents par préfixe (saisie semi-automatique)
+
+Sous SQLite, un index plein texte FTS5 (`agents_search`, une ligne par agent,
+`rowid` = identifiant de l'agent) couvre le nom, les prénoms, l'email et le
+téléphone. Le tokenizer `unicode61 remove_diacritics 2` ignore la casse et
+les accents, à l'indexation comme dans les requêtes : « eloise » trouve
+« Éloïse ». Les index de préfixes d'un à trois caractères servent les
+premières frappes. Les résultats sont triés par nom : le classement par
+pertinence (bm25) coûterait plusieurs fois plus cher sur un préfixe court qui
+désigne des milliers d'agents.
+
+Chaque mot saisi est un préfixe, tous doivent se retrouver dans la fiche
+(« kou jea » trouve « Kouassi Jean »). Un numéro de téléphone est indexé sans
+séparateurs, en entier et sans l'indicatif pays : « 07 12 3 » trouve
+« +225 07 12 34 56 78 ».
+
+L'index est tenu à jour par crud (création, modification, suppression) et
+reconstruit après un chargement de données. Sur une autre base que SQLite,
+la recherche se rabat sur des LIKE préfixes, sans l'insensibilité aux accents.
+"""
+import re
+
+from sqlalchemy import column, func, insert, or_, select, table, text
+from sqlalchemy.orm import Session
+
+from . import models
+
+TABLE = "agents_search"
+
+_CREATE = (
+    f"CREATE VIRTUAL TABLE {TABLE} USING fts5("
+    "nom, prenoms, email, telephone, "
+    "tokenize = 'unicode61 remove_diacritics 2', prefix = '1 2 3')"
+)
+
+_index = table(TABLE, column("rowid"), column("nom"), column("prenoms"), column("email"), column("telephone"))
+
+_WORD = re.compile(r"\w+")
+_PHONE_QUERY = re.compile(r"[\d\s+().-]*\d[\d\s+().-]*")
+
+
+def _dialect(conn):
+    bind = conn.get_bind() if isinstance(conn, Session) else conn
+    return bind.dialect.name
+
+
+def create(conn):
+    """Crée l'index s'il manque (SQLite) et le remplit ; True s'il a été créé"""
+    if _dialect(conn) != "sqlite":
+        return False
+    exists = conn.execute(
+        text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"), {"name": TABLE}
+    ).first()
+    if exists:
+        return False
+    conn.execute(text(_CREATE))
+    rebuild(conn)
+    return True
+
+
+def _phone_terms(telephone):
+    if not telephone:
+        return ""
+    groups = re.findall(r"\d+", telephone)
+    terms = ["".join(groups)]
+    if telephone.lstrip().startswith("+") and len(groups) > 1:
+        # Numéro national, sans l'indicatif pays
+        terms.append("".join(groups[1:]))
+    return " ".join(terms)
+
+
+def _document(agent_id, nom, prenoms, email, telephone):
+    return {
+        "rowid": agent_id,
+        "nom": nom or "",
+        "prenoms": prenoms or "",
+        "email": email or "",
+        "telephone": _phone_terms(telephone),
+    }
+
+
+def index(db: Session, agents):
+    """Ajoute ou remplace les agents dans l'index, dans la transaction en cours"""
+    if not agents or _dialect(db) != "sqlite":
+        return
+    unindex(db, [agent.id for agent in agents])
+    db.execute(insert(_index), [
+        _document(agent.id, agent.nom, agent.prenoms, agent.email, agent.telephone) for agent in agents
+    ])
+
+
+def unindex(db: Session, agent_ids):
+    if not agent_ids or _dialect(db) != "sqlite":
+        return
+    db.execute(_index.delete().where(_index.c.rowid.in_(agent_ids)))
+
+
+def rebuild(conn):
+    """Reconstruit l'index à partir de la table des agents (après un chargement en masse)"""
+    if _dialect(conn) != "sqlite":
+        return
+    conn.execute(_index.delete())
+    agent = models.Agent.__table__.c
+    rows = conn.execute(
+        select(agent.id, agent.nom, agent.prenoms, agent.email, agent.telephone).where(agent.deleted_at.is_(None))
+    ).all()
+    if rows:
+        conn.execute(insert(_index), [_document(*row) for row in rows])
+
+
+def _match_expression(query):
+    """Expression FTS5 : chaque mot est un préfixe ; None si la saisie ne contient aucun mot"""
+    query = query.strip()
+    if _PHONE_QUERY.fullmatch(query):
+        digits = "".join(re.findall(r"\d", query))
+        return f'telephone : "{digits}" *'
+    words = _WORD.findall(query)
+    if not words:
+        return None
+    return " ".join(f'"{word}" *' for word in words)
+
+
+def search_agents(db: Session, query: str, limit: int = 20):
+    """Agents dont la fiche contient des mots commençant par ceux saisis, par ordre alphabétique"""
+    if _dialect(db) != "sqlite":
+        return _search_like(db, query, limit)
+    expression = _match_expression(query)
+    if expression is None:
+        return []
+    statement = (
+        select(models.Agent)
+        .join(_index, _index.c.rowid == models.Agent.id)
+        .where(text(f"{TABLE} MATCH :expression").bindparams(expression=expression))
+        .where(models.Agent.deleted_at.is_(None))
+        .order_by(models.Agent.nom, models.Agent.prenoms, models.Agent.id)
+        .limit(limit)
+    )
+    return db.scalars(statement).all()
+
+
+def _search_like(db: Session, query, limit):
+    words = _WORD.findall(query.lower())
+    if not words:
+        return []
+    columns = (models.Agent.nom, models.Agent.prenoms, models.Agent.email, models.Agent.telephone)
+    statement = select(models.Agent).where(models.Agent.deleted_at.is_(None))
+    for word in words:
+        statement = statement.where(or_(*(func.lower(col).like(f"{word}%") for col in columns)))
+    statement = statement.order_by(models.Agent.nom, models.Agent.prenoms, models.Agent.id)
+    return db.scalars(statement.limit(limit)).all()
@@ -0,0 +1,177 @@
+"""Jeux de données synthétiques reproductibles et remise à zéro de la base
+
+Utilisé par les bancs d'essai et par les endpoints de maintenance
+(`POST /reset`, `POST /seed`) : les lignes sont insérées en masse
+(`executemany` par blocs), sans passer par l'ORM.
+"""
+import itertools
+import random
+import threading
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine, select
+from sqlalchemy.pool import StaticPool
+
+from . import models, schema, search
+
+SERVICE_CATEGORIES = ["Consultation", "Transaction", "Support", "Réclamation", "Information"]
+# Poids relatifs des catégories de service observés en agence
+SERVICE_WEIGHTS = [20, 40, 15, 10, 15]
+SERVICE_CUM_WEIGHTS = list(itertools.accumulate(SERVICE_WEIGHTS))
+
+NOMS = ["Koffi", "Kouassi", "Yao", "Konan", "Kouadio", "Traoré", "Coulibaly", "Bamba", "Ouattara", "Diallo"]
+PRENOMS = ["Paul", "Aya", "Awa", "Jean", "Marie", "Ibrahim", "Fatou", "Serge", "Adjoua", "Moussa"]
+
+CHUNK_SIZE = 5000
+
+
+def _agent_category_for(service):
+    # Les opérations de caisse vont aux agents "transaction", le reste au conseil
+    if service == "Transaction":
+        return models.AgentCategory.transaction
+    return models.AgentCategory.conseil
+
+
+def _stored(date):
+    # Format des colonnes DateTime de SQLAlchemy sous SQLite
+    return date.isoformat(" ", "microseconds")
+
+
+def _bulk_insert(conn, table, columns, rows):
+    """executemany direct sur le pilote, par blocs de CHUNK_SIZE lignes"""
+    sql = f"INSERT INTO {table.name} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+    for i in range(0, len(rows), CHUNK_SIZE):
+        conn.exec_driver_sql(sql, rows[i:i + CHUNK_SIZE])
+
+
+def _status_chain(rng, age_hours):
+    """Tire une chaîne de statuts valide : pending -> in_progress -> done/canceled"""
+    # Les tickets récents ont plus de chances d'être encore ouverts
+    if age_hours < 2:
+        return rng.choice([
+            [models.TicketStatus.pending],
+            [models.TicketStatus.pending, models.TicketStatus.in_progress],
+        ])
+    draw = rng.random()
+    if draw < 0.08:
+        return [models.TicketStatus.pending, models.TicketStatus.canceled]
+    if draw < 0.13:
+        return [models.TicketStatus.pending, models.TicketStatus.in_progress, models.TicketStatus.canceled]
+    return [models.TicketStatus.pending, models.TicketStatus.in_progress, models.TicketStatus.done]
+
+
+_template = None
+_template_lock = threading.Lock()
+
+
+def _empty_template():
+    """Base SQLite vide en mémoire, au schéma courant, construite une fois par processus"""
+    global _template
+    if _template is None:
+        engine = create_engine(
+            "sqlite://", poolclass=StaticPool, connect_args={"check_same_thread": False}
+        )
+        schema.ensure_schema(engine)
+        _template = engine
+    return _template
+
+
+def truncate(conn):
+    """Vide toutes les tables dans la transaction en cours"""
+    # Tables dépendantes d'abord (clés étrangères)
+    for table in reversed(models.Base.metadata.sorted_tables):
+        conn.execute(table.delete())
+
+
+def reset(engine):
+    """Remplace le contenu de la base par une base vide, en une transaction
+
+    Sous SQLite, la base vide pré-construite est copiée par l'API de
+    sauvegarde en ligne : le coût ne dépend que de la taille de la copie
+    (quelques pages), alors qu'un DELETE ou un DROP libère les pages de la
+    table une à une (plusieurs secondes pour quelques millions de lignes).
+    La copie passe par le gestionnaire de pages, comme une écriture normale :
+    les connexions ouvertes, y compris celles des autres workers, voient la
+    base vide, et le mode WAL est conservé. Les identifiants repartent de 1.
+    """
+    if engine.dialect.name != "sqlite":
+        with engine.begin() as conn:
+            truncate(conn)
+        return
+    with _template_lock:
+        template = _empty_template().raw_connection()
+        target = engine.raw_connection()
+        try:
+            template.driver_connection.backup(target.driver_connection)
+        finally:
+            target.close()
+            template.close()
+
+
+def is_empty(conn):
+    return all(
+        conn.scalar(select(table.c.id).limit(1)) is None
+        for table in (models.Agent.__table__, models.Ticket.__table__)
+    )
+
+
+def generate(engine, agents=50, tickets=10000, days=30, seed=42, now=None):
+    """Insère un jeu de données synthétique dans une base vide et renvoie les volumes créés"""
+    with engine.begin() as conn:
+        return populate(conn, agents=agents, tickets=tickets, days=days, seed=seed, now=now)
+
+
+def populate(conn, agents=50, tickets=10000, days=30, seed=42, now=None):
+    """Comme `generate`, dans la transaction en cours de `conn`"""
+    rng = random.Random(seed)
+    now = now or datetime.utcnow()
+    start = now - timedelta(days=days)
+
+    agent_rows = []
+    agents_by_category = {category: [] for category in models.AgentCategory}
+    for agent_id in range(1, agents + 1):
+        # Environ 60 % d'agents de caisse, le reste en conseil
+        category = models.AgentCategory.transaction if rng.random() < 0.6 else models.AgentCategory.conseil
+        nom, prenoms = rng.choice(NOMS), rng.choice(PRENOMS)
+        agent_rows.append({
+            "id": agent_id,
+            "nom": nom,
+            "prenoms": prenoms,
+            "annee_naissance": rng.randint(1965, 2002),
+            "categorie": category,
+            "email": f"{prenoms.lower()}.{nom.lower()}.{agent_id}@smartagence.ci",
+            "telephone": f"+225 07 {rng.randint(10, 99)} {rng.randint(10, 99)} {rng.randint(10, 99)} {rng.randint(10, 99)}",
+            "date_enregistrement": start - timedelta(days=rng.randint(1, 365)),
+        })
+        agents_by_category[category].append(agent_id)
+    all_agent_ids = list(range(1, agents + 1))
+
+    # Tickets et événements : tuples déjà au format stocké par SQLite (dates ISO,
+    # noms d'enum), insérés sans traitement des types par SQLAlchemy
+    ticket_rows = []
+    event_rows = []
+    span = (now - start).total_seconds()
+    # Dates de création triées : les identifiants suivent l'ordre chronologique
+    offsets = sorted(rng.random() * span for _ in range(tickets))
+    for ticket_id, offset in enumerate(offsets, start=1):
+        created = start + timedelta(seconds=offset)
+        service = rng.choices(SERVICE_CATEGORIES, cum_weights=SERVICE_CUM_WEIGHTS)[0]
+        candidates = agents_by_category[_agent_category_for(service)] or all_agent_ids
+        agent_id = rng.choice(candidates)
+        ticket_rows.append((
+            ticket_id, agent_id, _stored(created), service, f"Demande {service.lower()} #{ticket_id}",
+        ))
+        event_date = created
+        for statut in _status_chain(rng, (now - created).total_seconds() / 3600):
+            event_rows.append((ticket_id, agent_id, _stored(event_date), statut.name))
+            # Attente puis traitement : quelques minutes entre deux statuts
+            event_date = min(event_date + timedelta(minutes=rng.expovariate(1 / 12)), now)
+
+    for i in range(0, len(agent_rows), CHUNK_SIZE):
+        conn.execute(models.Agent.__table__.insert(), agent_rows[i:i + CHUNK_SIZE])
+    search.rebuild(conn)
+    _bulk_insert(conn, models.Ticket.__table__,
+                 ("id", "agent_id", "date_creation", "categorie_service", "description"), ticket_rows)
+    _bulk_insert(conn, models.Evenement.__table__, ("ticket_id", "agent_id", "date", "statut"), event_rows)
+
+    return {"agents": len(agent_rows), "tickets": len(ticket_rows), "evenements": len(event_rows)}
@@ -0,0 +1,250 @@
+import threading
+from collections import OrderedDict
+from contextlib import ExitStack, contextmanager
+
+from sqlalchemy import String, bindparam, func, select
+from sqlalchemy.orm import Session
+
+from ..config import settings
+from . import models
+from .coordination import coordinator
+
+# Statut implicite d'un ticket sans événement
+INITIAL_STATUS = "pending"
+
+# Transitions autorisées : pending -> in_progress -> done, annulation possible avant la fin
+ALLOWED_TRANSITIONS = {
+    "pending": frozenset({"in_progress", "canceled"}),
+    "in_progress": frozenset({"done", "canceled"}),
+    "done": frozenset(),
+    "canceled": frozenset(),
+}
+
+LOCK_STRIPES = 64
+
+
+class InvalidTransition(ValueError):
+    def __init__(self, current, target):
+        self.current = current
+        self.target = target
+        super().__init__(f"Transition {current} -> {target} non autorisée")
+
+
+class InvalidBatch(ValueError):
+    """Lot refusé en entier : au moins un ticket est absent ou ne peut pas changer de statut"""
+
+    def __init__(self, errors):
+        self.errors = errors
+        super().__init__(f"{len(errors)} ticket(s) refusé(s), aucune modification appliquée")
+
+
+class TicketStateCache:
+    """Cache LRU borné du statut courant (chaîne) de chaque ticket"""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # Verrous par ticket (répartis) : vérification et écriture d'une transition sont atomiques
+        self._ticket_locks = [threading.Lock() for _ in range(LOCK_STRIPES)]
+        self.hits = 0
+        self.misses = 0
+
+    def ticket_lock(self, ticket_id):
+        return self._ticket_locks[ticket_id % LOCK_STRIPES]
+
+    @contextmanager
+    def tickets_lock(self, ticket_ids):
+        """Verrous de plusieurs tickets, pris dans un ordre fixe (pas d'interblocage)"""
+        with ExitStack() as stack:
+            for stripe in sorted({ticket_id % LOCK_STRIPES for ticket_id in ticket_ids}):
+                stack.enter_context(self._ticket_locks[stripe])
+            yield
+
+    def get(self, ticket_id):
+        with self._lock:
+            statut = self._entries.get(ticket_id)
+            if statut is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(ticket_id)
+            self.hits += 1
+            return statut
+
+    def put(self, ticket_id, statut):
+        with self._lock:
+            self._entries[ticket_id] = statut
+            self._entries.move_to_end(ticket_id)
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+
+    def discard(self, ticket_id):
+        with self._lock:
+            self._entries.pop(ticket_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def warm(self, db: Session):
+        """Charge le statut courant des tickets les plus récents, en deux requêtes
+
+        Peut s'exécuter pendant que l'API sert déjà des requêtes : les entrées
+        déjà présentes ne sont pas écrasées.
+        """
+        max_id = db.execute(select(func.max(models.Ticket.id))).scalar()
+        if max_id is None:
+            return 0
+        lower = max_id - self.capacity
+        latest = (
+            select(models.Evenement.ticket_id, func.max(models.Evenement.id).label("last_id"))
+            .where(models.Evenement.ticket_id > lower)
+            .group_by(models.Evenement.ticket_id)
+            .subquery()
+        )
+        rows = db.execute(
+            select(models.Ticket.id, models.Evenement.statut)
+            .outerjoin(latest, latest.c.ticket_id == models.Ticket.id)
+            .outerjoin(models.Evenement, models.Evenement.id == latest.c.last_id)
+            .where(models.Ticket.id > lower)
+            .order_by(models.Ticket.id)
+        ).all()
+        with self._lock:
+            for ticket_id, statut in rows:
+                # Une écriture concurrente au préchargement a déjà placé un statut plus frais
+                if ticket_id not in self._entries:
+                    self._entries[ticket_id] = statut.value if statut else INITIAL_STATUS
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+        return len(rows)
+
+
+# Existence du ticket et dernier statut connu, en une requête construite une seule fois :
+# sa forme compilée est réutilisée, seul `ticket_id` change
+_STATE = select(
+    models.Ticket.id,
+    select(models.Evenement.statut)
+    .where(models.Evenement.ticket_id == models.Ticket.id)
+    .order_by(models.Evenement.id.desc())
+    .limit(1)
+    .scalar_subquery(),
+).where(models.Ticket.id == bindparam("ticket_id"))
+
+
+def _load_state(db: Session, ticket_id: int):
+    row = db.execute(_STATE, {"ticket_id": ticket_id}).first()
+    if row is None:
+        return None
+    statut = row[1]
+    if isinstance(statut, models.TicketStatus):
+        statut = statut.value
+    return statut or INITIAL_STATUS
+
+
+def _load_states(db: Session, ticket_ids):
+    # Même requête que le préchargement, restreinte aux tickets demandés
+    latest = (
+        select(models.Evenement.ticket_id, func.max(models.Evenement.id).label("last_id"))
+        .where(models.Evenement.ticket_id.in_(ticket_ids))
+        .group_by(models.Evenement.ticket_id)
+        .subquery()
+    )
+    rows = db.execute(
+        select(models.Ticket.id, models.Evenement.statut)
+        .outerjoin(latest, latest.c.ticket_id == models.Ticket.id)
+        .outerjoin(models.Evenement, models.Evenement.id == latest.c.last_id)
+        .where(models.Ticket.id.in_(ticket_ids))
+    ).all()
+    return {ticket_id: statut.value if statut else INITIAL_STATUS for ticket_id, statut in rows}
+
+
+def state_cache_for(db: Session):
+    """Cache de l'agence à laquelle la session est rattachée"""
+    return state_caches[db.info.get("agence", settings.AGENCE_PAR_DEFAUT)]
+
+
+def current_state(db: Session, ticket_id: int):
+    """Statut courant d'un ticket, depuis le cache ou la base ; None si le ticket n'existe pas"""
+    coordinator.sync()
+    state_cache = state_cache_for(db)
+    statut = state_cache.get(ticket_id)
+    if statut is None:
+        statut = _load_state(db, ticket_id)
+        if statut is not None:
+            state_cache.put(ticket_id, statut)
+    return statut
+
+
+def current_states(db: Session, ticket_ids):
+    """Statut courant de plusieurs tickets : cache, puis une seule requête pour les absents
+
+    Les tickets inexistants ne figurent pas dans le résultat.
+    """
+    coordinator.sync()
+    state_cache = state_cache_for(db)
+    states = {}
+    missing = []
+    for ticket_id in ticket_ids:
+        statut = state_cache.get(ticket_id)
+        if statut is None:
+            missing.append(ticket_id)
+        else:
+            states[ticket_id] = statut
+    if missing:
+        for ticket_id, statut in _load_states(db, missing).items():
+            state_cache.put(ticket_id, statut)
+            states[ticket_id] = statut
+    return states
+
+
+def record_status(db: Session, ticket_id: int, statut: str):
+    """Met à jour le cache après une transition validée et prévient les autres workers"""
+    agence = db.info.get("agence", settings.AGENCE_PAR_DEFAUT)
+    state_caches[agence].put(ticket_id, statut)
+    coordinator.publish(_cache_ids[agence], ticket_id)
+
+
+def forget_all(db: Session):
+    """Vide le cache de l'agence (base réinitialisée) dans tous les workers"""
+    agence = db.info.get("agence", settings.AGENCE_PAR_DEFAUT)
+    state_caches[agence].clear()
+    coordinator.publish_clear(_cache_ids[agence])
+
+
+def allows(target: str):
+    """Condition SQL sur `tickets` : le statut courant en base autorise la transition vers `target`
+
+    Évaluée par l'INSERT ... SELECT qui écrit l'événement : SQLite prend le verrou
+    d'écriture avant de lire, la vérification et l'écriture sont donc atomiques
+    entre workers (le cache et les verrous par ticket ne valent que dans un worker).
+    """
+    last_status = (
+        select(models.Evenement.statut)
+        .where(models.Evenement.ticket_id == models.Ticket.id)
+        .order_by(models.Evenement.id.desc())
+        .limit(1)
+        .correlate(models.Ticket)
+        .scalar_subquery()
+    )
+    sources = [statut for statut, targets in ALLOWED_TRANSITIONS.items() if target in targets]
+    return func.coalesce(last_status, INITIAL_STATUS, type_=String).in_(sources)
+
+
+def check_transition(current: str, target: str):
+    if target not in ALLOWED_TRANSITIONS[current]:
+        raise InvalidTransition(current, target)
+
+
+def allowed_transitions(current: str):
+    return sorted(ALLOWED_TRANSITIONS[current])
+
+
+# Un cache par agence (les identifiants de tickets se recoupent d'une base à l'autre),
+# enregistrés dans le même ordre par tous les workers
+state_caches = {agence: TicketStateCache(settings.TICKET_STATE_CACHE_SIZE) for agence in settings.AGENCES}
+_cache_ids = {
+    agence: coordinator.register(cache.discard, cache.clear) for agence, cache in state_caches.items()
+}
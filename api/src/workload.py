@@ -0,0 +1,149 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy import DateTime, func, select
+from sqlalchemy.orm import Session
+
+from ..config import settings
+from . import models
+
+
+def _in_progress_intervals(db: Session, start: datetime, end: datetime):
+    """Intervalles in_progress (agent, début, fin) chevauchant la fenêtre et dates de clôture
+
+    Une seule requête : la fin d'un intervalle est la date de l'événement
+    suivant du même ticket (fonction de fenêtre LEAD). Seuls les événements
+    postérieurs à `start - WORKLOAD_LOOKBACK_HOURS` sont lus (index sur la
+    date) : un ticket resté en cours plus longtemps avant la fenêtre est ignoré.
+    """
+    ev = models.Evenement
+    timeline = (
+        select(
+            ev.agent_id,
+            ev.statut,
+            ev.date.label("debut"),
+            func.lead(ev.date, type_=DateTime).over(partition_by=ev.ticket_id, order_by=ev.id).label("fin"),
+        )
+        .where(ev.date >= start - timedelta(hours=settings.WORKLOAD_LOOKBACK_HOURS), ev.date < end)
+        .subquery()
+    )
+    rows = db.execute(
+        select(timeline.c.agent_id, timeline.c.statut, timeline.c.debut, timeline.c.fin)
+        .where(
+            ((timeline.c.statut == models.TicketStatus.done) & (timeline.c.debut >= start))
+            | (
+                (timeline.c.statut == models.TicketStatus.in_progress)
+                & ((timeline.c.fin.is_(None)) | (timeline.c.fin > start))
+            )
+        )
+    )
+    intervals = []
+    closures = []
+    for agent_id, statut, debut, fin in rows:
+        if statut == models.TicketStatus.done:
+            closures.append((agent_id, debut))
+            continue
+        # Sans événement suivant, le ticket est toujours en cours : l'intervalle court jusqu'à la fin
+        intervals.append((agent_id, max(debut, start), min(fin or end, end)))
+    return intervals, closures
+
+
+class _AgentSweep:
+    __slots__ = ("active", "since", "busy", "ticket_seconds", "peak", "done")
+
+    def __init__(self, bucket_count):
+        self.active = 0
+        self.since = None
+        self.busy = [0.0] * bucket_count
+        self.ticket_seconds = [0.0] * bucket_count
+        self.peak = [0] * bucket_count
+        self.done = [0] * bucket_count
+
+
+def compute_workload(db: Session, start: datetime, end: datetime, bucket_minutes: int = None):
+    """Charge de travail par agent et par tranche de temps, en un seul balayage trié
+
+    - busy_seconds : temps pendant lequel l'agent a au moins un ticket en cours
+    - ticket_seconds : somme des durées in_progress (compte chaque ticket simultané)
+    - peak_concurrent : nombre maximal de tickets en cours simultanément
+    - throughput_per_hour : tickets terminés par heure
+    """
+    bucket = timedelta(minutes=bucket_minutes) if bucket_minutes else end - start
+    bucket_seconds = bucket.total_seconds()
+    bucket_count = max(int(-(-(end - start).total_seconds() // bucket_seconds)), 1)
+
+    intervals, closures = _in_progress_intervals(db, start, end)
+
+    # Points de changement : +1 au début d'un intervalle, -1 à la fin ; les fins passent d'abord
+    points = []
+    for agent_id, debut, fin in intervals:
+        if fin > debut:
+            points.append(((debut - start).total_seconds(), 1, agent_id))
+            points.append(((fin - start).total_seconds(), -1, agent_id))
+    points.sort(key=lambda point: (point[0], point[1]))
+
+    sweeps = {}
+
+    def _sweep(agent_id):
+        state = sweeps.get(agent_id)
+        if state is None:
+            state = sweeps[agent_id] = _AgentSweep(bucket_count)
+        return state
+
+    def _accumulate(state, t0, t1):
+        # Répartit le segment [t0, t1] (concurrence constante) sur les tranches qu'il couvre
+        index = min(int(t0 // bucket_seconds), bucket_count - 1)
+        while t0 < t1 and index < bucket_count:
+            edge = min(t1, (index + 1) * bucket_seconds)
+            state.busy[index] += edge - t0
+            state.ticket_seconds[index] += (edge - t0) * state.active
+            state.peak[index] = max(state.peak[index], state.active)
+            t0 = edge
+            index += 1
+
+    for offset, delta, agent_id in points:
+        state = _sweep(agent_id)
+        if state.active > 0:
+            _accumulate(state, state.since, offset)
+        state.active += delta
+        state.since = offset
+        if state.active > 0:
+            index = min(int(offset // bucket_seconds), bucket_count - 1)
+            state.peak[index] = max(state.peak[index], state.active)
+
+    for agent_id, date in closures:
+        index = min(int((date - start).total_seconds() // bucket_seconds), bucket_count - 1)
+        _sweep(agent_id).done[index] += 1
+
+    # Agents partis : seulement s'ils ont travaillé pendant la fenêtre
+    active_in_window = [agent_id for agent_id in sweeps if agent_id is not None]
+    agents = db.execute(
+        select(models.Agent.id, models.Agent.nom, models.Agent.prenoms, models.Agent.categorie)
+        .where(models.Agent.deleted_at.is_(None) | models.Agent.id.in_(active_in_window))
+        .order_by(models.Agent.id)
+    ).all()
+    report = []
+    for agent_id, nom, prenoms, categorie in agents:
+        state = sweeps.get(agent_id) or _AgentSweep(bucket_count)
+        buckets = []
+        for index in range(bucket_count):
+            bucket_start = start + bucket * index
+            bucket_end = min(bucket_start + bucket, end)
+            duration = (bucket_end - bucket_start).total_seconds()
+            buckets.append({
+                "start": bucket_start,
+                "end": bucket_end,
+                "busy_seconds": round(state.busy[index], 1),
+                "ticket_seconds": round(state.ticket_seconds[index], 1),
+                "utilisation": round(state.busy[index] / duration, 4) if duration else 0.0,
+                "peak_concurrent": state.peak[index],
+                "done": state.done[index],
+                "throughput_per_hour": round(state.done[index] / duration * 3600, 2) if duration else 0.0,
+            })
+        report.append({
+            "agent_id": agent_id,
+            "nom": nom,
+            "prenoms": prenoms,
+            "categorie": categorie.value,
+            "buckets": buckets,
+        })
+    return {"start": start, "end": end, "bucket_minutes": bucket_minutes, "agents": report}
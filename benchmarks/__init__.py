@@ -0,0 +1 @@
+"""Bancs d'essai de performance de l'API Smart Agence"""
@@ -0,0 +1,84 @@
+"""Client ASGI minimal pour piloter l'application FastAPI dans le même processus"""
+import asyncio
+import json
+from urllib.parse import urlsplit
+
+
+class InProcessClient:
+    """Envoie des requêtes HTTP directement à l'application ASGI, sans réseau"""
+
+    def __init__(self, app):
+        self.app = app
+        self._lifespan_task = None
+        self._lifespan_queue = None
+
+    async def __aenter__(self):
+        self._lifespan_queue = asyncio.Queue()
+        started = asyncio.get_running_loop().create_future()
+
+        async def receive():
+            return await self._lifespan_queue.get()
+
+        async def send(message):
+            if message["type"] in ("lifespan.startup.complete", "lifespan.startup.failed"):
+                if not started.done():
+                    started.set_result(message)
+
+        self._lifespan_task = asyncio.create_task(
+            self.app({"type": "lifespan", "asgi": {"version": "3.0"}}, receive, send)
+        )
+        await self._lifespan_queue.put({"type": "lifespan.startup"})
+        message = await started
+        if message["type"] == "lifespan.startup.failed":
+            raise RuntimeError(message.get("message", "échec du démarrage de l'application"))
+        return self
+
+    async def __aexit__(self, *exc):
+        await self._lifespan_queue.put({"type": "lifespan.shutdown"})
+        await self._lifespan_task
+
+    async def request(self, method, url, json_body=None, headers=None):
+        """Renvoie (statut, en-têtes, corps) pour une requête"""
+        parts = urlsplit(url)
+        body = b""
+        raw_headers = [(b"host", b"benchmark")]
+        if json_body is not None:
+            body = json.dumps(json_body).encode()
+            raw_headers.append((b"content-type", b"application/json"))
+        for name, value in (headers or {}).items():
+            raw_headers.append((name.lower().encode(), value.encode()))
+        raw_headers.append((b"content-length", str(len(body)).encode()))
+        scope = {
+            "type": "http",
+            "asgi": {"version": "3.0"},
+            "http_version": "1.1",
+            "method": method,
+            "scheme": "http",
+            "path": parts.path,
+            "raw_path": parts.path.encode(),
+            "query_string": parts.query.encode(),
+            "root_path": "",
+            "headers": raw_headers,
+            "client": ("127.0.0.1", 50000),
+            "server": ("benchmark", 80),
+        }
+        request_sent = False
+        response = {"status": None, "headers": [], "body": bytearray()}
+
+        async def receive():
+            nonlocal request_sent
+            if not request_sent:
+                request_sent = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            if message["type"] == "http.response.start":
+                response["status"] = message["status"]
+                response["headers"] = message.get("headers", [])
+            elif message["type"] == "http.response.body":
+                response["body"] += message.get("body", b"")
+
+        await self.app(scope, receive, send)
+        headers = {k.decode().lower(): v.decode() for k, v in response["headers"]}
+        return response["status"], headers, bytes(response["body"])
@@ -0,0 +1,351 @@
+"""Générateur de charge local simulant le trafic des bornes et des tableaux de bord
+
+Rejoue un mélange configurable de créations de tickets (bornes), de changements
+de statut (guichets) et de lectures de tableau de bord contre une instance
+API, en montant progressivement la concurrence jusqu'à saturation.
+
+Usage :
+    # contre une instance déjà démarrée
+    python -m benchmarks.loadtest --url http://127.0.0.1:8000
+    # démarre lui-même l'API (api.serve) avec 4 workers sur une base synthétique
+    python -m benchmarks.loadtest --spawn-workers 4 --tickets 20000
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import deque
+from pathlib import Path
+from urllib.parse import urlsplit
+
+from benchmarks.run import percentile
+
+DEFAULT_MIX = "kiosk=60,status=25,dashboard=15"
+DEFAULT_LEVELS = "1,2,4,8,16,32,64"
+
+
+class HTTPConnection:
+    """Connexion HTTP/1.1 persistante minimale au-dessus d'asyncio"""
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.reader = None
+        self.writer = None
+
+    async def _connect(self):
+        self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except OSError:
+                pass
+            self.writer = None
+
+    async def request(self, method, path, json_body=None):
+        """Renvoie (statut, corps) ; rouvre la connexion si le serveur l'a fermée"""
+        if self.writer is None:
+            await self._connect()
+        body = json.dumps(json_body).encode() if json_body is not None else b""
+        head = (
+            f"{method} {path} HTTP/1.1\r\n"
+            f"Host: {self.host}:{self.port}\r\n"
+            f"Content-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"\r\n"
+        ).encode()
+        try:
+            self.writer.write(head + body)
+            await self.writer.drain()
+            return await self._read_response()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            await self.close()
+            raise
+
+    async def _read_response(self):
+        status_line = await self.reader.readuntil(b"\r\n")
+        status_code = int(status_line.split()[1])
+        headers = {}
+        while True:
+            line = await self.reader.readuntil(b"\r\n")
+            if line == b"\r\n":
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        if headers.get("transfer-encoding") == "chunked":
+            body = bytearray()
+            while True:
+                size = int((await self.reader.readuntil(b"\r\n")).strip(), 16)
+                chunk = await self.reader.readexactly(size + 2)
+                if size == 0:
+                    break
+                body += chunk[:-2]
+            body = bytes(body)
+        else:
+            body = await self.reader.readexactly(int(headers.get("content-length", 0)))
+        if headers.get("connection") == "close":
+            await self.close()
+        return status_code, body
+
+
+class TrafficMix:
+    """Tire les opérations selon les poids du mélange et suit l'état des tickets créés"""
+
+    def __init__(self, weights, agent_ids, rng):
+        self.operations = list(weights)
+        self.weights = [weights[name] for name in self.operations]
+        self.agent_ids = agent_ids
+        self.rng = rng
+        # Tickets créés pendant le test, avec le prochain statut valide à poster
+        self.open_tickets = deque()
+
+    def next_request(self):
+        operation = self.rng.choices(self.operations, weights=self.weights)[0]
+        if operation == "status" and self.open_tickets:
+            ticket_id, statut = self.open_tickets.popleft()
+            return operation, "POST", f"/tickets/{ticket_id}/status", {
+                "statut": statut,
+                "agent_id": self.rng.choice(self.agent_ids),
+            }, (ticket_id, statut)
+        if operation == "dashboard":
+            path = self.rng.choice(["/agents/", "/tickets/"])
+            return operation, "GET", path, None, None
+        return "kiosk", "POST", "/tickets/", {
+            "agent_id": self.rng.choice(self.agent_ids),
+            "categorie_service": self.rng.choice(["Consultation", "Transaction", "Support", "Information"]),
+            "description": "Ticket borne",
+        }, None
+
+    def record(self, operation, status_code, payload, context):
+        if status_code >= 400:
+            return
+        if operation == "kiosk":
+            self.open_tickets.append((json.loads(payload)["id"], "in_progress"))
+        elif operation == "status" and context[1] == "in_progress":
+            self.open_tickets.append((context[0], "done"))
+
+
+def classify_error(status_code, payload):
+    if status_code == 503 and b"locked" in payload:
+        return "sqlite_locked"
+    if status_code == 429:
+        return "rate_limited"
+    if status_code >= 500:
+        return "server_error"
+    return "client_error"
+
+
+async def _virtual_client(conn, mix, deadline, samples, errors):
+    while time.perf_counter() < deadline:
+        operation, method, path, body, context = mix.next_request()
+        start = time.perf_counter()
+        try:
+            status_code, payload = await conn.request(method, path, body)
+        except (OSError, asyncio.IncompleteReadError):
+            errors["connection"] = errors.get("connection", 0) + 1
+            continue
+        samples.setdefault(operation, []).append(time.perf_counter() - start)
+        if status_code >= 400:
+            kind = classify_error(status_code, payload)
+            errors[kind] = errors.get(kind, 0) + 1
+        mix.record(operation, status_code, payload, context)
+
+
+async def run_level(host, port, mix, concurrency, duration):
+    """Maintient `concurrency` clients actifs pendant `duration` secondes"""
+    connections = [HTTPConnection(host, port) for _ in range(concurrency)]
+    samples = {}
+    errors = {}
+    start = time.perf_counter()
+    deadline = start + duration
+    await asyncio.gather(*(
+        _virtual_client(conn, mix, deadline, samples, errors) for conn in connections
+    ))
+    elapsed = time.perf_counter() - start
+    for conn in connections:
+        await conn.close()
+
+    total = sum(len(values) for values in samples.values())
+    operations = {}
+    for operation, values in samples.items():
+        values.sort()
+        operations[operation] = {
+            "requests": len(values),
+            "p50_ms": round(percentile(values, 50) * 1000, 2),
+            "p95_ms": round(percentile(values, 95) * 1000, 2),
+            "p99_ms": round(percentile(values, 99) * 1000, 2),
+        }
+    error_count = sum(errors.values())
+    return {
+        "concurrency": concurrency,
+        "throughput_rps": round(total / elapsed, 1),
+        "requests": total,
+        "error_rate": round(error_count / max(total + errors.get("connection", 0), 1), 4),
+        "errors": errors,
+        "operations": operations,
+    }
+
+
+def parse_mix(text):
+    weights = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in ("kiosk", "status", "dashboard"):
+            raise argparse.ArgumentTypeError(f"opération inconnue : {name}")
+        weights[name] = float(weight)
+    return weights
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def spawn_server(workers, agents, tickets, seed):
+    """Génère une base synthétique et démarre l'API dessus ; renvoie (processus, url)
+
+    Lancée par `api.serve`, comme en production : schéma préparé une seule fois,
+    WAL et caches coordonnés entre workers (sans quoi les workers gardent des
+    caches périmés et renvoient de faux 404).
+    """
+    workdir = tempfile.mkdtemp(prefix="smart_agence_load_")
+    database_url = f"sqlite:///{os.path.join(workdir, 'load.db')}"
+    os.environ["DATABASE_URL"] = database_url
+    from api.src import schema
+    from api.src.database import engine
+    from api.src.seed import generate
+
+    schema.ensure_schema(engine)
+    generate(engine, agents=agents, tickets=tickets, seed=seed)
+    engine.dispose()
+
+    port = _free_port()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "api.serve",
+         "--host", "127.0.0.1", "--port", str(port),
+         "--workers", str(workers), "--log-level", "warning"],
+        # Capacité brute du serveur : pas de limitation de débit par client (sauf ADMISSION_ENABLED=1)
+        env={**os.environ, "DATABASE_URL": database_url,
+             "ADMISSION_ENABLED": os.environ.get("ADMISSION_ENABLED", "0")},
+        cwd=Path(__file__).resolve().parent.parent,
+    )
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.5):
+                return process, f"http://127.0.0.1:{port}"
+        except OSError:
+            if process.poll() is not None:
+                raise RuntimeError("api.serve s'est arrêté au démarrage")
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError("api.serve n'a pas répondu dans les 30 s")
+
+
+async def _fetch_agent_ids(host, port):
+    conn = HTTPConnection(host, port)
+    try:
+        status_code, payload = await conn.request("GET", "/agents/?limit=1000")
+    finally:
+        await conn.close()
+    if status_code != 200:
+        raise RuntimeError(f"impossible de lister les agents ({status_code})")
+    agent_ids = [agent["id"] for agent in json.loads(payload)]
+    if not agent_ids:
+        raise RuntimeError("aucun agent en base : créez-en ou utilisez --spawn-workers")
+    return agent_ids
+
+
+async def run_load(url, weights, levels, duration, seed):
+    parts = urlsplit(url)
+    host, port = parts.hostname, parts.port or 80
+    agent_ids = await _fetch_agent_ids(host, port)
+    mix = TrafficMix(weights, agent_ids, random.Random(seed))
+    results = []
+    for concurrency in levels:
+        level = await run_level(host, port, mix, concurrency, duration)
+        results.append(level)
+        _print_level(level)
+    return results
+
+
+def saturation_point(results, tolerance=0.05):
+    """Premier palier au-delà duquel le débit ne progresse plus de `tolerance`"""
+    best = None
+    for level in results:
+        if best is not None and level["throughput_rps"] < best["throughput_rps"] * (1 + tolerance):
+            return best
+        best = level
+    return best
+
+
+def _print_level(level):
+    ops = "  ".join(
+        f"{name}: p50 {stats['p50_ms']} / p99 {stats['p99_ms']} ms"
+        for name, stats in sorted(level["operations"].items())
+    )
+    print(
+        f"concurrence {level['concurrency']:>4} | {level['throughput_rps']:>8} req/s"
+        f" | erreurs {level['error_rate'] * 100:5.2f}% {level['errors'] or ''} | {ops}"
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Test de charge Smart Agence")
+    parser.add_argument("--url", default=None, help="instance uvicorn déjà démarrée")
+    parser.add_argument("--spawn-workers", type=int, default=None,
+                        help="démarre api.serve avec N workers sur une base synthétique")
+    parser.add_argument("--agents", type=int, default=50)
+    parser.add_argument("--tickets", type=int, default=10000)
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix(DEFAULT_MIX),
+                        help=f"poids des opérations (défaut : {DEFAULT_MIX})")
+    parser.add_argument("--levels", default=DEFAULT_LEVELS, help="paliers de concurrence")
+    parser.add_argument("--duration", type=float, default=10.0, help="durée de chaque palier (s)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", type=Path, default=None, help="fichier JSON de résultats")
+    args = parser.parse_args(argv)
+
+    if (args.url is None) == (args.spawn_workers is None):
+        parser.error("indiquez soit --url, soit --spawn-workers")
+
+    process = None
+    url = args.url
+    if args.spawn_workers:
+        process, url = spawn_server(args.spawn_workers, args.agents, args.tickets, args.seed)
+    try:
+        levels = [int(value) for value in args.levels.split(",")]
+        results = asyncio.run(run_load(url, args.mix, levels, args.duration, args.seed))
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+    saturation = saturation_point(results)
+    print(
+        f"\nSaturation : ~{saturation['throughput_rps']} req/s"
+        f" atteinte à {saturation['concurrency']} clients concurrents"
+    )
+    if args.output:
+        args.output.parent.mkdir(parents=True, exist_ok=True)
+        args.output.write_text(json.dumps({
+            "url": url,
+            "workers": args.spawn_workers,
+            "mix": args.mix,
+            "levels": results,
+            "saturation": saturation,
+        }, indent=2))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,171 @@
+"""Coût CPU des endpoints à une ligne : requêtes reconstruites à chaque appel ou précompilées
+
+Chaque scénario est mesuré deux fois dans le même processus, sur la même
+base : avec les lectures d'origine de crud (`db.query(...)` construite,
+convertie et compilée à chaque requête) puis avec les lectures actuelles
+(`Session.get` et requêtes construites une seule fois, dont la forme
+compilée est réutilisée). Le temps CPU du processus est relevé par requête,
+réseau exclu.
+
+Usage :
+    python -m benchmarks.queries --iterations 2000
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+from benchmarks.run import RESULTS_DIR, _git_revision
+
+
+def _legacy_readers(models, select, initial_status):
+    """Lectures de crud et transitions telles qu'écrites avant les requêtes précompilées"""
+
+    def get_agent(db, agent_id):
+        return db.query(models.Agent).filter(models.Agent.id == agent_id).first()
+
+    def get_ticket(db, ticket_id):
+        return db.query(models.Ticket).filter(models.Ticket.id == ticket_id).first()
+
+    def get_agents(db, skip=0, limit=100):
+        return db.query(models.Agent).offset(skip).limit(limit).all()
+
+    def load_state(db, ticket_id):
+        last_status = (
+            select(models.Evenement.statut)
+            .where(models.Evenement.ticket_id == models.Ticket.id)
+            .order_by(models.Evenement.id.desc())
+            .limit(1)
+            .scalar_subquery()
+        )
+        row = db.execute(select(models.Ticket.id, last_status).where(models.Ticket.id == ticket_id)).first()
+        if row is None:
+            return None
+        statut = row[1]
+        return statut.value if isinstance(statut, models.TicketStatus) else statut or initial_status
+
+    return {"get_agent": get_agent, "get_ticket": get_ticket, "get_agents": get_agents, "_load_state": load_state}
+
+
+def _scenarios(agents, tickets, state_cache):
+    def uncached_status(rng):
+        # Statut absent du cache : lecture en base à chaque requête
+        ticket_id = rng.randint(1, tickets)
+        state_cache.discard(ticket_id)
+        return f"/tickets/{ticket_id}/status"
+
+    return {
+        "GET /agents/{id}": lambda rng: f"/agents/{rng.randint(1, agents)}",
+        "GET /tickets/{id}": lambda rng: f"/tickets/{rng.randint(1, tickets)}",
+        "GET /tickets/{id}/status (hors cache)": uncached_status,
+        "GET /agents/?limit=20": lambda rng: f"/agents/?skip={rng.randint(0, max(agents - 20, 0))}&limit=20",
+    }
+
+
+async def _measure(client, build, iterations, warmup, seed):
+    rng = random.Random(seed)
+    cpu = []
+    for i in range(warmup + iterations):
+        url = build(rng)
+        start = time.process_time()
+        status_code, _, _ = await client.request("GET", url)
+        elapsed = time.process_time() - start
+        if status_code != 200:
+            raise RuntimeError(f"{url} : réponse {status_code}")
+        if i >= warmup:
+            cpu.append(elapsed)
+    return {
+        "mean_us": round(statistics.fmean(cpu) * 1e6, 1),
+        "median_us": round(statistics.median(cpu) * 1e6, 1),
+    }
+
+
+def run(agents, tickets, iterations, warmup, seed):
+    workdir = tempfile.mkdtemp(prefix="smart_agence_queries_")
+    # Configuration lue à l'import ; pas de limitation de débit pendant la mesure
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(workdir, 'queries.db')}"
+    os.environ["ADMISSION_ENABLED"] = "0"
+    os.environ["MAINTENANCE_ENABLED"] = "0"
+    from sqlalchemy import select
+
+    from api.config import settings
+    from api.main import app
+    from api.src import crud, models, schema, transitions
+    from api.src.database import engine
+    from api.src.seed import generate
+    from benchmarks.asgi import InProcessClient
+
+    schema.ensure_schema(engine)
+    generate(engine, agents=agents, tickets=tickets, seed=seed)
+    legacy = _legacy_readers(models, select, transitions.INITIAL_STATUS)
+    current = {name: getattr(transitions if name == "_load_state" else crud, name) for name in legacy}
+    scenarios = _scenarios(agents, tickets, transitions.state_caches[settings.AGENCE_PAR_DEFAUT])
+
+    def install(readers):
+        for name, reader in readers.items():
+            setattr(transitions if name == "_load_state" else crud, name, reader)
+
+    async def _main():
+        results = {}
+        async with InProcessClient(app) as client:
+            for name, build in scenarios.items():
+                install(legacy)
+                before = await _measure(client, build, iterations, warmup, seed)
+                install(current)
+                after = await _measure(client, build, iterations, warmup, seed)
+                results[name] = {"db.query": before, "précompilé": after}
+        return results
+
+    try:
+        endpoints = asyncio.run(_main())
+    finally:
+        install(current)
+    return {
+        "meta": {
+            "date": datetime.now().isoformat(timespec="seconds"),
+            "git_revision": _git_revision(),
+            "agents": agents,
+            "tickets": tickets,
+            "iterations": iterations,
+            "query_cache_size": settings.QUERY_CACHE_SIZE,
+            "sqlite_statement_cache": settings.SQLITE_STATEMENT_CACHE,
+        },
+        "endpoints": endpoints,
+    }
+
+
+def print_report(report):
+    print(f"\n{'Endpoint (CPU par requête, µs)':<40} {'db.query':>10} {'précompilé':>11} {'gain':>8}")
+    for name, stats in report["endpoints"].items():
+        before, after = stats["db.query"]["mean_us"], stats["précompilé"]["mean_us"]
+        gain = (before - after) / before * 100 if before else 0.0
+        print(f"{name:<40} {before:>10} {after:>11} {gain:>7.1f}%")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Coût CPU des lectures à une ligne")
+    parser.add_argument("--agents", type=int, default=200)
+    parser.add_argument("--tickets", type=int, default=10000)
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--warmup", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", type=Path, default=None, help="fichier JSON de résultats")
+    args = parser.parse_args(argv)
+
+    report = run(args.agents, args.tickets, args.iterations, args.warmup, args.seed)
+    print_report(report)
+    output = args.output or RESULTS_DIR / f"queries-{datetime.now():%Y%m%d-%H%M%S}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2, ensure_ascii=False))
+    print(f"\nRésultats enregistrés dans {output}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
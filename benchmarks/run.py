@@ -0,0 +1,228 @@
+"""Banc d'essai reproductible des endpoints de l'API
+
+Usage :
+    python -m benchmarks.run --agents 50 --tickets 20000 --iterations 300
+    python -m benchmarks.run --compare benchmarks/results/bench-20250101-120000.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+RESULTS_DIR = Path(__file__).parent / "results"
+
+
+class Scenario:
+    """Un endpoint mesuré : `build(ctx)` renvoie (méthode, url, corps JSON)"""
+
+    def __init__(self, name, build):
+        self.name = name
+        self.build = build
+
+
+def _new_ticket(ctx):
+    return ("POST", "/tickets/", {
+        "agent_id": ctx["rng"].randint(1, ctx["agents"]),
+        "categorie_service": ctx["rng"].choice(["Consultation", "Transaction", "Support"]),
+        "description": "Ticket de banc d'essai",
+    })
+
+
+def _status_update(ctx):
+    # Fait avancer les tickets créés par le scénario précédent
+    ticket_id = ctx["created_tickets"].pop(0)
+    return ("POST", f"/tickets/{ticket_id}/status", {
+        "statut": "in_progress",
+        "agent_id": ctx["rng"].randint(1, ctx["agents"]),
+    })
+
+
+def _update_agent(ctx):
+    agent_id = ctx["rng"].randint(1, ctx["agents"])
+    return ("PUT", f"/agents/{agent_id}", {
+        "nom": "Bench",
+        "prenoms": f"Agent {agent_id}",
+        "annee_naissance": 1990,
+        "categorie": "conseil",
+        "email": f"bench.{agent_id}@smartagence.ci",
+        "telephone": None,
+    })
+
+
+SCENARIOS = [
+    Scenario("GET /agents/", lambda ctx: ("GET", "/agents/", None)),
+    Scenario("GET /tickets/", lambda ctx: ("GET", "/tickets/", None)),
+    Scenario("GET /tickets/?skip=N", lambda ctx: (
+        "GET", f"/tickets/?skip={ctx['rng'].randint(0, max(ctx['tickets'] - 100, 0))}&limit=100", None
+    )),
+    Scenario("GET /agents/{id}", lambda ctx: ("GET", f"/agents/{ctx['rng'].randint(1, ctx['agents'])}", None)),
+    Scenario("GET /tickets/{id}", lambda ctx: ("GET", f"/tickets/{ctx['rng'].randint(1, ctx['tickets'])}", None)),
+    Scenario("GET /agents/workload", lambda ctx: ("GET", "/agents/workload?bucket_minutes=60", None)),
+    Scenario("GET /forecast/wait", lambda ctx: (
+        "GET", f"/forecast/wait?categorie_service={ctx['rng'].choice(['Consultation', 'Transaction', 'Support'])}", None
+    )),
+    Scenario("POST /tickets/", _new_ticket),
+    Scenario("POST /tickets/{id}/status", _status_update),
+    Scenario("PUT /agents/{id}", _update_agent),
+]
+
+
+def percentile(sorted_values, pct):
+    """Percentile par rang le plus proche sur une liste triée"""
+    if not sorted_values:
+        return 0.0
+    rank = max(int(round(pct / 100 * len(sorted_values) + 0.5)) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+async def _run_scenarios(client, ctx, iterations, warmup):
+    results = {}
+    for scenario in SCENARIOS:
+        latencies = []
+        errors = 0
+        for i in range(warmup + iterations):
+            method, url, body = scenario.build(ctx)
+            start = time.perf_counter()
+            status_code, _, payload = await client.request(method, url, json_body=body)
+            elapsed = time.perf_counter() - start
+            if scenario.name == "POST /tickets/" and status_code == 201:
+                ctx["created_tickets"].append(json.loads(payload)["id"])
+            if i < warmup:
+                continue
+            if status_code >= 400:
+                errors += 1
+            latencies.append(elapsed)
+        total = sum(latencies)
+        latencies.sort()
+        results[scenario.name] = {
+            "requests": len(latencies),
+            "errors": errors,
+            "throughput_rps": round(len(latencies) / total, 1) if total else 0.0,
+            "mean_ms": round(total / len(latencies) * 1000, 3) if latencies else 0.0,
+            "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+            "p95_ms": round(percentile(latencies, 95) * 1000, 3),
+            "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+        }
+    return results
+
+
+def _git_revision():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(agents, tickets, days, iterations, warmup, seed):
+    """Génère une base neuve, mesure chaque scénario et renvoie le rapport"""
+    workdir = tempfile.mkdtemp(prefix="smart_agence_bench_")
+    # La configuration est lue à l'import : l'URL doit être fixée avant d'importer l'API ;
+    # les requêtes en rafale du banc ne doivent pas être limitées par le contrôle d'admission
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    os.environ.setdefault("ADMISSION_ENABLED", "0")
+    from api.main import app
+    from api.src import schema
+    from api.src.database import engine
+    from api.src.seed import generate
+
+    schema.ensure_schema(engine)
+
+    start = time.perf_counter()
+    volumes = generate(engine, agents=agents, tickets=tickets, days=days, seed=seed)
+    generation_seconds = time.perf_counter() - start
+
+    from benchmarks.asgi import InProcessClient
+
+    async def _main():
+        async with InProcessClient(app) as client:
+            ctx = {
+                "rng": random.Random(seed),
+                "agents": agents,
+                "tickets": tickets,
+                "created_tickets": [],
+            }
+            return await _run_scenarios(client, ctx, iterations, warmup)
+
+    endpoints = asyncio.run(_main())
+    return {
+        "meta": {
+            "date": datetime.now().isoformat(timespec="seconds"),
+            "git_revision": _git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "seed": seed,
+            "iterations": iterations,
+            "warmup": warmup,
+            "dataset": volumes,
+            "generation_seconds": round(generation_seconds, 3),
+        },
+        "endpoints": endpoints,
+    }
+
+
+def compare(current, previous):
+    """Affiche l'évolution du p99 et du débit par rapport à un rapport précédent"""
+    print(f"\n{'Endpoint':<32} {'p99 (ms)':>22} {'débit (req/s)':>26}")
+    for name, stats in current["endpoints"].items():
+        old = previous.get("endpoints", {}).get(name)
+        if old is None:
+            print(f"{name:<32} {stats['p99_ms']:>22} {stats['throughput_rps']:>26}")
+            continue
+        p99_delta = (stats["p99_ms"] - old["p99_ms"]) / old["p99_ms"] * 100 if old["p99_ms"] else 0.0
+        rps_delta = (
+            (stats["throughput_rps"] - old["throughput_rps"]) / old["throughput_rps"] * 100
+            if old["throughput_rps"] else 0.0
+        )
+        print(
+            f"{name:<32} {old['p99_ms']:>8} -> {stats['p99_ms']:>8} ({p99_delta:+.1f}%)"
+            f" {old['throughput_rps']:>8} -> {stats['throughput_rps']:>8} ({rps_delta:+.1f}%)"
+        )
+
+
+def print_report(report):
+    meta = report["meta"]
+    print(f"Jeu de données : {meta['dataset']} (généré en {meta['generation_seconds']} s)")
+    print(f"\n{'Endpoint':<32} {'req/s':>10} {'p50 ms':>10} {'p95 ms':>10} {'p99 ms':>10} {'erreurs':>8}")
+    for name, stats in report["endpoints"].items():
+        print(
+            f"{name:<32} {stats['throughput_rps']:>10} {stats['p50_ms']:>10}"
+            f" {stats['p95_ms']:>10} {stats['p99_ms']:>10} {stats['errors']:>8}"
+        )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Banc d'essai des endpoints Smart Agence")
+    parser.add_argument("--agents", type=int, default=50)
+    parser.add_argument("--tickets", type=int, default=10000)
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", type=Path, default=None, help="fichier JSON de résultats")
+    parser.add_argument("--compare", type=Path, default=None, help="rapport précédent à comparer")
+    args = parser.parse_args(argv)
+
+    report = run(args.agents, args.tickets, args.days, args.iterations, args.warmup, args.seed)
+    print_report(report)
+
+    output = args.output or RESULTS_DIR / f"bench-{datetime.now():%Y%m%d-%H%M%S}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2, ensure_ascii=False))
+    print(f"\nRésultats enregistrés dans {output}")
+
+    if args.compare:
+        compare(report, json.loads(args.compare.read_text()))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
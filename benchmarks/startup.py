@@ -0,0 +1,103 @@
+"""Profil de démarrage de l'API : temps d'import et délai avant la première réponse
+
+Usage :
+    python -m benchmarks.startup --runs 5 --tickets 20000
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+from pathlib import Path
+
+from benchmarks.loadtest import _free_port
+
+ROOT = Path(__file__).resolve().parent.parent
+# Objectif de délai entre le lancement du processus et la première réponse
+TARGET_FIRST_REQUEST_MS = 1500
+
+
+def import_profile(env):
+    """Temps d'import cumulé par paquet de premier niveau, via `python -X importtime`"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import api.main"],
+        env=env, cwd=ROOT, capture_output=True, text=True, check=True,
+    )
+    packages = {}
+    total_us = 0
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, _, name = line[len("import time:"):].split("|")
+        self_us = int(self_us)
+        package = name.strip().split(".")[0]
+        packages[package] = packages.get(package, 0) + self_us
+        total_us += self_us
+    return total_us, sorted(packages.items(), key=lambda item: item[1], reverse=True)
+
+
+def time_to_first_request(env, timeout=30):
+    """Millisecondes entre le lancement d'uvicorn et la première réponse 200"""
+    port = _free_port()
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "api.main:app",
+         "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        env=env, cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        deadline = start + timeout
+        while time.perf_counter() < deadline:
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/agents/?limit=1", timeout=1) as response:
+                    if response.status == 200:
+                        return (time.perf_counter() - start) * 1000
+            except (urllib.error.URLError, ConnectionError):
+                time.sleep(0.005)
+        raise RuntimeError("l'API n'a pas répondu à temps")
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Profil de démarrage de l'API")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--tickets", type=int, default=10000)
+    parser.add_argument("--top", type=int, default=12)
+    parser.add_argument("--target-ms", type=float, default=TARGET_FIRST_REQUEST_MS)
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix="smart_agence_startup_")
+    env = {**os.environ, "DATABASE_URL": f"sqlite:///{os.path.join(workdir, 'startup.db')}"}
+    os.environ.update(env)
+    from api.src import schema
+    from api.src.database import engine
+    from api.src.seed import generate
+
+    schema.ensure_schema(engine)
+    generate(engine, tickets=args.tickets)
+    engine.dispose()
+
+    total_us, packages = import_profile(env)
+    print(f"Import de api.main : {total_us / 1000:.1f} ms")
+    for package, self_us in packages[:args.top]:
+        print(f"  {package:<24} {self_us / 1000:8.1f} ms")
+
+    timings = [time_to_first_request(env) for _ in range(args.runs)]
+    median = statistics.median(timings)
+    verdict = "OK" if median <= args.target_ms else "AU-DESSUS DE L'OBJECTIF"
+    print(
+        f"\nPremière réponse : médiane {median:.0f} ms"
+        f" (min {min(timings):.0f}, max {max(timings):.0f}) sur {args.runs} démarrages"
+        f" — objectif {args.target_ms:.0f} ms : {verdict}"
+    )
+    return 0 if median <= args.target_ms else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
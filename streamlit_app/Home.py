@@ -1,9 +1,13 @@
 import streamlit as st
 import requests
 import pandas as pd
+import uuid
 from datetime import datetime
 import plotly.express as px
 
+from cached_api import get_json
+from ticket_table import ticket_table
+
 st.set_page_config(
     page_title="Smart Agence - Gestion de Clients",
     page_icon="🏢",
@@ -27,20 +31,14 @@ st.markdown("""
 
 def get_agents():
     try:
-        response = requests.get(f"{API_BASE_URL}/agents/")
-        if response.status_code == 200:
-            return response.json()
-        return []
+        return get_json(f"{API_BASE_URL}/agents/") or []
     except requests.exceptions.RequestException:
         st.error("Impossible de se connecter à l'API")
         return []
 
 def get_tickets():
     try:
-        response = requests.get(f"{API_BASE_URL}/tickets/")
-        if response.status_code == 200:
-            return response.json()
-        return []
+        return get_json(f"{API_BASE_URL}/tickets/") or []
     except requests.exceptions.RequestException:
         st.error("Impossible de se connecter à l'API")
         return []
@@ -55,19 +53,36 @@ def create_agent(agent_data):
         st.error(f"Erreur de connexion: {e}")
         return False
 
-def create_ticket(ticket_data):
+def create_ticket(ticket_data, idempotency_key=None):
+    headers = {"Idempotency-Key": idempotency_key} if idempotency_key else {}
     try:
-        response = requests.post(f"{API_BASE_URL}/tickets/", json=ticket_data)
+        response = requests.post(f"{API_BASE_URL}/tickets/", json=ticket_data, headers=headers)
         if response.status_code != 201:
             st.error(f"Erreur API: {response.status_code} - {response.text}")
-        return response.status_code == 201
+            return None
+        # Reçu : ticket créé et attente estimée
+        return response.json()
     except requests.exceptions.RequestException as e:
         st.error(f"Erreur de connexion: {e}")
-        return False
+        return None
+
+def get_ticket_state(ticket_id):
+    try:
+        response = requests.get(f"{API_BASE_URL}/tickets/{ticket_id}/status")
+        if response.status_code == 200:
+            return response.json()
+        return None
+    except requests.exceptions.RequestException:
+        return None
 
-def update_ticket_status(ticket_id, status_data):
+def update_ticket_status(ticket_id, status_data, idempotency_key=None):
+    headers = {"Idempotency-Key": idempotency_key} if idempotency_key else {}
     try:
-        response = requests.post(f"{API_BASE_URL}/tickets/{ticket_id}/status", json=status_data)
+        response = requests.post(
+            f"{API_BASE_URL}/tickets/{ticket_id}/status", json=status_data, headers=headers
+        )
+        if response.status_code == 409:
+            st.error(f"Transition refusée : {response.json().get('detail')}")
         return response.status_code == 200
     except requests.exceptions.RequestException:
         return False
@@ -172,15 +187,9 @@ def show_dashboard():
             # Données pour le graphique en barres
             agent_tickets = {}
             for ticket in tickets:
-                agent_id = ticket.get('agent_id', 'Non assigné')
-                agent_name = "Agent inconnu"
-                
-                # Trouver le nom de l'agent
-                for agent in agents:
-                    if agent.get('agent_id') == agent_id:
-                        agent_name = f"{agent.get('nom', '')} {agent.get('prenoms', '')}"
-                        break
-                
+                # Fiche de l'agent embarquée dans le ticket par l'API
+                agent = ticket.get('agent')
+                agent_name = f"{agent['nom']} {agent['prenoms']}" if agent else "Agent inconnu"
                 agent_tickets[agent_name] = agent_tickets.get(agent_name, 0) + 1
             
             if agent_tickets:
@@ -332,7 +341,17 @@ def show_tickets_management():
     
     with tab1:
         st.subheader("Créer un nouveau ticket")
-        
+
+        # Reçu du dernier ticket créé, avec l'attente estimée
+        receipt = st.session_state.pop('last_receipt', None)
+        if receipt:
+            st.success(f"✅ Ticket n°{receipt['id']} créé avec succès!")
+            if receipt.get('estimated_wait_minutes') is not None:
+                st.info(
+                    f"⏳ Attente estimée : {receipt['estimated_wait_minutes']:.0f} min"
+                    f" ({receipt.get('queue_ahead', 0)} personne(s) devant)"
+                )
+
         agents = get_agents()
         for a in agents:
             if 'agent_id' not in a and 'id' in a:
@@ -365,6 +384,10 @@ def show_tickets_management():
                 
                 priorite = st.selectbox("Priorité", ["Basse", "Normale", "Haute", "Urgente"])
             
+            # Clé stable tant que le ticket n'est pas créé : une relance ne crée pas de doublon
+            if 'ticket_idempotency_key' not in st.session_state:
+                st.session_state['ticket_idempotency_key'] = str(uuid.uuid4())
+            
             submitted = st.form_submit_button("🎫 Créer le ticket", type="primary")
             
             if submitted:
@@ -377,8 +400,10 @@ def show_tickets_management():
                     "statut": "pending"
                 }
                 
-                if create_ticket(ticket_data):
-                    st.success("✅ Ticket créé avec succès!")
+                receipt = create_ticket(ticket_data, st.session_state['ticket_idempotency_key'])
+                if receipt:
+                    del st.session_state['ticket_idempotency_key']
+                    st.session_state['last_receipt'] = receipt
                     st.rerun()
                 else:
                     st.error("❌ Erreur lors de la création du ticket")
@@ -386,92 +411,17 @@ def show_tickets_management():
     with tab2:
         st.subheader("Liste des tickets")
         
-        tickets = get_tickets()
         agents = get_agents()
-        
-        if tickets:
-            # Enrichissement des données avec les noms des agents
-            enriched_tickets = []
-            for ticket in tickets:
-                enriched_ticket = ticket.copy()
-                agent_name = "Agent inconnu"
-                for agent in agents:
-                    if agent.get('agent_id') == ticket.get('agent_id'):
-                        agent_name = f"{agent.get('nom', '')} {agent.get('prenoms', '')}"
-                        break
-                enriched_ticket['agent_name'] = agent_name
-                enriched_tickets.append(enriched_ticket)
-            
-            df_tickets = pd.DataFrame(enriched_tickets)
-            
-            # Filtres
-            col1, col2, col3 = st.columns(3)
-
-            filter_status = 'Tous'
-            filter_service = 'Toutes'
-            filter_agent = 'Tous'
-
-            with col1:
-                if 'statut' in df_tickets.columns:
-                    statuts = ['Tous'] + list(df_tickets['statut'].unique())
-                    filter_status = st.selectbox("Filtrer par statut", statuts)
-
-            with col2:
-                if 'categorie_service' in df_tickets.columns:
-                    categories = ['Toutes'] + list(df_tickets['categorie_service'].unique())
-                    filter_service = st.selectbox("Filtrer par service", categories)
-
-            with col3:
-                if 'agent_name' in df_tickets.columns:
-                    agents_list = ['Tous'] + list(df_tickets['agent_name'].unique())
-                    filter_agent = st.selectbox("Filtrer par agent", agents_list)
-
-            # Application des filtres
-            filtered_df = df_tickets.copy()
-
-            if filter_status != 'Tous':
-                filtered_df = filtered_df[filtered_df['statut'] == filter_status]
-
-            if filter_service != 'Toutes':
-                filtered_df = filtered_df[filtered_df['categorie_service'] == filter_service]
-
-            if filter_agent != 'Tous':
-                filtered_df = filtered_df[filtered_df['agent_name'] == filter_agent]
-            
-            # Affichage du tableau avec style conditionnel
-            def color_status(val):
-                color_map = {
-                    'pending': 'background-color: #fff3cd',
-                    'in_progress': 'background-color: #cce5ff',
-                    'done': 'background-color: #d4edda',
-                    'canceled': 'background-color: #f8d7da'
-                }
-                return color_map.get(val, '')
-            
-            styled_df = filtered_df.style.applymap(color_status, subset=['statut'] if 'statut' in filtered_df.columns else [])
-            
-            st.dataframe(
-                styled_df,
-                use_container_width=True,
-                column_config={
-                    "ticket_id": "ID Ticket",
-                    "agent_name": "Agent assigné",
-                    "categorie_service": "Service",
-                    "statut": "Statut",
-                    "priorite": "Priorité",
-                    "date_creation": "Date création",
-                    "description": "Description"
-                }
-            )
-            
-            st.info(f"📊 Total: {len(filtered_df)} ticket(s) affiché(s)")
-        else:
-            st.info("Aucun ticket créé pour le moment.")
+        # Page courante uniquement, filtrée et triée par l'API
+        ticket_table(API_BASE_URL, agents, key="home_tickets")
     
     with tab3:
         st.subheader("Changer le statut d'un ticket")
         
         tickets = get_tickets()
+        for t in tickets:
+            if 'ticket_id' not in t and 'id' in t:
+                t['ticket_id'] = t['id']
         
         if tickets:
             col1, col2 = st.columns(2)
@@ -479,7 +429,7 @@ def show_tickets_management():
             with col1:
                 # Sélection du ticket
                 ticket_options = {
-                    f"Ticket #{t.get('ticket_id')} - {t.get('categorie_service', 'N/A')} ({t.get('statut', 'N/A')})": t.get('ticket_id')
+                    f"Ticket #{t.get('ticket_id')} - {t.get('categorie_service', 'N/A')}": t.get('ticket_id')
                     for t in tickets
                 }
                 
@@ -489,26 +439,39 @@ def show_tickets_management():
                 # Trouver le ticket sélectionné pour afficher les détails
                 selected_ticket = next((t for t in tickets if t.get('ticket_id') == selected_ticket_id), None)
                 
-                if selected_ticket:
-                    st.info(f"**Statut actuel:** {selected_ticket.get('statut', 'N/A')}")
+                # Statut courant et transitions possibles fournis par l'API
+                ticket_state = get_ticket_state(selected_ticket_id)
+                if ticket_state:
+                    st.info(f"**Statut actuel:** {ticket_state['statut']}")
+            
+            allowed_statuses = ticket_state['transitions'] if ticket_state else []
             
             with col2:
                 new_status = st.selectbox(
                     "Nouveau statut",
-                    ["pending", "in_progress", "done", "canceled"],
-                    help="Choisissez le nouveau statut pour le ticket"
+                    allowed_statuses,
+                    help="Seules les transitions autorisées depuis le statut actuel sont proposées",
+                    disabled=not allowed_statuses
                 )
                 
                 commentaire = st.text_area("Commentaire (optionnel)", placeholder="Raison du changement de statut...")
             
-            if st.button("🔄 Mettre à jour le statut", type="primary"):
+            # Une clé par soumission : un double clic ou une relance ne crée pas deux événements
+            if 'status_idempotency_key' not in st.session_state:
+                st.session_state['status_idempotency_key'] = str(uuid.uuid4())
+            
+            if not allowed_statuses:
+                st.caption("Ce ticket est clôturé : aucun changement de statut possible.")
+            elif st.button("🔄 Mettre à jour le statut", type="primary"):
                 status_data = {
                     "statut": new_status,
+                    "agent_id": selected_ticket.get('agent_id'),
                     "commentaire": commentaire if commentaire else None,
                     "date_modification": datetime.now().isoformat()
                 }
                 
-                if update_ticket_status(selected_ticket_id, status_data):
+                if update_ticket_status(selected_ticket_id, status_data, st.session_state['status_idempotency_key']):
+                    del st.session_state['status_idempotency_key']
                     st.success(f"✅ Statut du ticket #{selected_ticket_id} mis à jour vers '{new_status}'!")
                     st.rerun()
                 else:
@@ -0,0 +1,41 @@
+"""Lectures de l'API avec requêtes conditionnelles, partagées par les pages Streamlit
+
+La dernière réponse de chaque URL est gardée avec son ETag (un seul cache
+pour toutes les sessions) ; la requête suivante envoie `If-None-Match` et,
+si la liste n'a pas changé, l'API répond `304` sans corps. `requests`
+demande et décompresse déjà les réponses gzip.
+
+Le corps brut est gardé et décodé à chaque appel : les pages modifient les
+listes reçues, elles ne doivent pas partager les mêmes objets.
+"""
+import json
+
+import requests
+import streamlit as st
+
+
+@st.cache_resource
+def _responses():
+    # {url complète: (etag, corps JSON)}
+    return {}
+
+
+def get_json(url, params=None):
+    """Données JSON de l'URL ; None si l'API répond par une erreur
+
+    Les erreurs de connexion (`requests.exceptions.RequestException`) sont
+    laissées à l'appelant.
+    """
+    key = requests.Request("GET", url, params=params).prepare().url
+    cache = _responses()
+    cached = cache.get(key)
+    headers = {"If-None-Match": cached[0]} if cached else {}
+    response = requests.get(key, headers=headers)
+    if response.status_code == 304 and cached:
+        return json.loads(cached[1])
+    if response.status_code != 200:
+        return None
+    etag = response.headers.get("ETag")
+    if etag:
+        cache[key] = (etag, response.content)
+    return response.json()
@@ -5,6 +5,9 @@ from datetime import datetime, date
 import plotly.express as px
 import json
 
+from cached_api import get_json
+from ticket_table import ticket_table
+
 API_BASE_URL = "http://localhost:8000"
 
 st.set_page_config(
@@ -35,14 +38,22 @@ st.markdown("""
 
 def get_api_data(endpoint):
     try:
-        response = requests.get(f"{API_BASE_URL}/{endpoint}")
-        if response.status_code == 200:
-            return response.json()
-        return []
+        # Requête conditionnelle : une liste inchangée n'est pas retransférée
+        data = get_json(f"{API_BASE_URL}/{endpoint}")
+        return data if data is not None else []
     except requests.exceptions.RequestException as e:
         st.error(f"Erreur de connexion à l'API pour {endpoint}: {str(e)}")
         return []
 
+def search_agents(term):
+    try:
+        # Recherche par préfixe côté API (index plein texte, insensible aux accents)
+        data = get_json(f"{API_BASE_URL}/agents/search", params={"q": term, "limit": 100})
+        return data if data is not None else []
+    except requests.exceptions.RequestException as e:
+        st.error(f"Erreur de connexion à l'API pour la recherche: {str(e)}")
+        return []
+
 def delete_agent(agent_id):
     try:
         response = requests.delete(f"{API_BASE_URL}/agents/{agent_id}")
@@ -50,24 +61,56 @@ def delete_agent(agent_id):
     except requests.exceptions.RequestException:
         return False
 
-def update_agent(agent_id, agent_data):
+def update_agent(agent_id, agent_data, version=None):
+    """Envoie les seuls champs modifiés ; renvoie le code HTTP (409 : agent modifié entre-temps), None si l'API est injoignable"""
     try:
-        response = requests.put(f"{API_BASE_URL}/agents/{agent_id}", json=agent_data)
-        return response.status_code == 200
+        response = requests.patch(f"{API_BASE_URL}/agents/{agent_id}", json={**agent_data, "version": version})
+        return response.status_code
     except requests.exceptions.RequestException:
-        return False
+        return None
+
+def update_tickets_batch(batch):
+    """Action groupée en un seul appel ; renvoie (tickets mis à jour, erreurs)"""
+    try:
+        response = requests.post(f"{API_BASE_URL}/tickets/batch", json=batch)
+        if response.status_code == 200:
+            return response.json(), []
+        detail = response.json().get('detail')
+        if isinstance(detail, dict):
+            return None, detail.get('errors', [])
+        return None, [{"ticket_id": None, "detail": detail}]
+    except requests.exceptions.RequestException as e:
+        return None, [{"ticket_id": None, "detail": str(e)}]
+
+def get_report(kind, period, fmt="json"):
+    try:
+        # Rapport d'une période close : calculé une fois par l'API, 304 aux visites suivantes
+        if fmt == "csv":
+            response = requests.get(f"{API_BASE_URL}/reports/{kind}/{period}", params={"format": "csv"})
+            return response.content if response.status_code == 200 else None
+        return get_json(f"{API_BASE_URL}/reports/{kind}/{period}")
+    except requests.exceptions.RequestException as e:
+        st.error(f"Erreur de connexion à l'API pour le rapport {kind} {period}: {str(e)}")
+        return None
 
 def get_agent_statistics():
     agents = get_api_data("agents")
-    tickets = get_api_data("tickets")
+    # Nombre total seulement : une page d'un ticket suffit
+    tickets_page = get_api_data("tickets/page?page_size=1")
+    # Charge des dernières 24 h calculée par l'API à partir des intervalles d'événements
+    workload = get_api_data("agents/workload") or {}
+    workload_agents = workload.get('agents', [])
     stats = {
         'total_agents': len(agents),
         'agents_transaction': len([a for a in agents if a.get('categorie') == 'transaction']),
         'agents_conseil': len([a for a in agents if a.get('categorie') == 'conseil']),
-        'total_tickets': len(tickets),
-        'active_agents': len(set([t.get('agent_id') for t in tickets if t.get('agent_id')]))
+        'total_tickets': tickets_page.get('total', 0) if tickets_page else 0,
+        'active_agents': len([
+            a for a in workload_agents
+            if any(b['busy_seconds'] > 0 or b['done'] > 0 for b in a['buckets'])
+        ])
     }
-    return stats, agents, tickets
+    return stats, agents, workload_agents
 
 def export_data():
     agents = get_api_data("agents")
@@ -123,13 +166,10 @@ def show_agent_management():
     with col3:
         sort_by = st.selectbox("Trier par", ['nom', 'prenoms', 'categorie', 'date_enregistrement'])
     filtered_df = df_agents.copy()
+    if search_term:
+        filtered_df = pd.DataFrame(search_agents(search_term), columns=df_agents.columns)
     if filter_category != 'Toutes':
         filtered_df = filtered_df[filtered_df['categorie'] == filter_category]
-    if search_term:
-        filtered_df = filtered_df[
-            filtered_df['nom'].str.contains(search_term, case=False, na=False) |
-            filtered_df['prenoms'].str.contains(search_term, case=False, na=False)
-        ]
     if sort_by in filtered_df.columns:
         filtered_df = filtered_df.sort_values(sort_by)
     for idx, agent in filtered_df.iterrows():
@@ -153,21 +193,30 @@ def show_agent_management():
                     col_a, col_b = st.columns(2)
                     with col_a:
                         if st.form_submit_button("✏️ Modifier", type="primary"):
-                            updated_data = {
+                            submitted = {
                                 "nom": new_nom,
                                 "prenoms": new_prenoms,
                                 "email": new_email,
                                 "telephone": new_telephone,
                                 "categorie": new_categorie,
-                                "annee_naissance": agent.get('annee_naissance')
                             }
-                            # Ne tente la modif que si agent_id existe
-                            if agent.get('agent_id'):
-                                if update_agent(agent.get('agent_id'), updated_data):
-                                    st.success("✅ Agent modifié avec succès!")
-                                    st.rerun()
+                            # Seuls les champs modifiés sont envoyés, avec la version affichée
+                            updated_data = {
+                                key: value for key, value in submitted.items()
+                                if value != ("" if pd.isna(agent.get(key)) else agent.get(key))
+                            }
+                            if agent.get('id'):
+                                if not updated_data:
+                                    st.info("Aucune modification.")
                                 else:
-                                    st.error("❌ Erreur lors de la modification")
+                                    result = update_agent(int(agent['id']), updated_data, int(agent['version']))
+                                    if result == 200:
+                                        st.success("✅ Agent modifié avec succès!")
+                                        st.rerun()
+                                    elif result == 409:
+                                        st.warning("⚠️ Cet agent a été modifié entre-temps : rechargez la page avant de réessayer.")
+                                    else:
+                                        st.error("❌ Erreur lors de la modification")
                             else:
                                 st.warning("Impossible de modifier cet agent (pas d'identifiant unique).")
                     with col_b:
@@ -195,111 +244,148 @@ def show_agent_management():
 
 def show_ticket_management():
     st.markdown('<div class="section-header"><h2>🎫 Gestion Avancée des Tickets</h2></div>', unsafe_allow_html=True)
-    tickets = get_api_data("tickets")
+    # Compteurs agrégés par l'API : aucune liste complète de tickets à télécharger
+    summary = get_api_data("agences/summary")
+    by_status = summary.get('total', {}).get('tickets_by_status', {}) if summary else {}
     agents = get_api_data("agents")
-    if not tickets:
+    if not summary or not summary['total']['tickets']:
         st.warning("Aucun ticket trouvé dans le système.")
         return
+    for agent in agents:
+        agent.setdefault('agent_id', agent.get('id'))
     col1, col2, col3, col4 = st.columns(4)
-    pending_count = len([t for t in tickets if t.get('statut') == 'pending'])
-    progress_count = len([t for t in tickets if t.get('statut') == 'in_progress'])
-    done_count = len([t for t in tickets if t.get('statut') == 'done'])
-    canceled_count = len([t for t in tickets if t.get('statut') == 'canceled'])
     with col1:
-        st.metric("⏳ En attente", pending_count)
+        st.metric("⏳ En attente", by_status.get('pending', 0))
     with col2:
-        st.metric("🔄 En cours", progress_count)
+        st.metric("🔄 En cours", by_status.get('in_progress', 0))
     with col3:
-        st.metric("✅ Terminés", done_count)
+        st.metric("✅ Terminés", by_status.get('done', 0))
     with col4:
-        st.metric("❌ Annulés", canceled_count)
+        st.metric("❌ Annulés", by_status.get('canceled', 0))
     st.divider()
     st.subheader("🔍 Filtres avancés")
-    col1, col2, col3 = st.columns(3)
-    with col1:
-        status_filter = st.selectbox(
-            "Statut",
-            ["Tous", "pending", "in_progress", "done", "canceled"]
-        )
-    with col2:
-        if 'categorie_service' in pd.DataFrame(tickets).columns:
-            categories = ["Toutes"] + list(set([t.get('categorie_service') for t in tickets if t.get('categorie_service')]))
-            category_filter = st.selectbox("Catégorie de service", categories)
-        else:
-            category_filter = "Toutes"
-    with col3:
-        if 'priorite' in pd.DataFrame(tickets).columns:
-            priorities = ["Toutes"] + list(set([t.get('priorite') for t in tickets if t.get('priorite')]))
-            priority_filter = st.selectbox("Priorité", priorities)
-        else:
-            priority_filter = "Toutes"
-    filtered_tickets = tickets.copy()
-    if status_filter != "Tous":
-        filtered_tickets = [t for t in filtered_tickets if t.get('statut') == status_filter]
-    if category_filter != "Toutes":
-        filtered_tickets = [t for t in filtered_tickets if t.get('categorie_service') == category_filter]
-    if priority_filter != "Toutes":
-        filtered_tickets = [t for t in filtered_tickets if t.get('priorite') == priority_filter]
-    st.write(f"**{len(filtered_tickets)}** tickets correspondent aux critères")
-    if filtered_tickets:
-        for ticket in filtered_tickets[:20]:
-            with st.expander(f"🎫 Ticket #{ticket.get('ticket_id')} - {ticket.get('categorie_service', 'N/A')} ({ticket.get('statut', 'N/A')})"):
-                col1, col2 = st.columns([2, 1])
-                with col1:
-                    st.write(f"**Description:** {ticket.get('description', 'Aucune description')}")
-                    st.write(f"**Statut:** {ticket.get('statut', 'N/A')}")
-                    st.write(f"**Priorité:** {ticket.get('priorite', 'N/A')}")
-                    st.write(f"**Catégorie:** {ticket.get('categorie_service', 'N/A')}")
-                    agent_name = "Agent inconnu"
-                    for agent in agents:
-                        if agent.get('agent_id') == ticket.get('agent_id'):
-                            agent_name = f"{agent.get('nom', '')} {agent.get('prenoms', '')}"
-                            break
-                    st.write(f"**Agent assigné:** {agent_name}")
-                with col2:
-                    st.write(f"**ID:** {ticket.get('ticket_id')}")
-                    st.write(f"**Date création:** {ticket.get('date_creation', 'N/A')[:10] if ticket.get('date_creation') else 'N/A'}")
-                    # Actions rapides (à implémenter selon API)
-                    # if st.button(f"🚀 Passer en cours", key=f"progress_{ticket.get('ticket_id')}"):
-                    #     st.success("Statut mis à jour!")
-                    # if st.button(f"✅ Marquer terminé", key=f"done_{ticket.get('ticket_id')}"):
-                    #     st.success("Ticket terminé!")
+    page_tickets = ticket_table(API_BASE_URL, agents, key="admin_tickets")
+    if page_tickets:
+        for ticket in page_tickets:
+            ticket.setdefault('ticket_id', ticket.get('id'))
+        show_bulk_actions(page_tickets, agents)
+
+def show_bulk_actions(tickets, agents):
+    """Sélection multiple et action groupée : un seul appel API, une seule transaction"""
+    st.subheader("⚡ Actions groupées")
+    actions = {
+        "Réaffecter à un agent": None,
+        "🚀 Passer en cours": "in_progress",
+        "✅ Marquer terminé": "done",
+        "❌ Annuler": "canceled",
+    }
+    agent_options = {"— Agent actuel —": None}
+    agent_options.update({f"{a.get('nom', '')} {a.get('prenoms', '')} (#{a['agent_id']})": a['agent_id'] for a in agents})
+    ticket_labels = {
+        f"#{t['ticket_id']} - {t.get('categorie_service', 'N/A')} ({t.get('statut', 'N/A')})": t['ticket_id']
+        for t in tickets
+    }
+    with st.form("bulk_actions"):
+        select_all = st.checkbox(f"Sélectionner les {len(tickets)} tickets de la page")
+        selected = st.multiselect("Tickets", list(ticket_labels.keys()))
+        col1, col2 = st.columns(2)
+        with col1:
+            action = st.selectbox("Action", list(actions.keys()))
+        with col2:
+            agent_label = st.selectbox("Agent", list(agent_options.keys()))
+        submitted = st.form_submit_button("Appliquer", type="primary")
+    if not submitted:
+        return
+    ticket_ids = list(ticket_labels.values()) if select_all else [ticket_labels[label] for label in selected]
+    statut = actions[action]
+    agent_id = agent_options[agent_label]
+    if not ticket_ids:
+        st.warning("Aucun ticket sélectionné.")
+        return
+    if statut is None and agent_id is None:
+        st.warning("Choisissez l'agent à qui réaffecter les tickets.")
+        return
+    updated, errors = update_tickets_batch({"ticket_ids": ticket_ids, "statut": statut, "agent_id": agent_id})
+    if updated is not None:
+        st.success(f"✅ {len(updated)} ticket(s) mis à jour")
+        st.dataframe(pd.DataFrame(updated), use_container_width=True, hide_index=True)
+    else:
+        st.error("❌ Lot refusé, aucune modification appliquée")
+        st.dataframe(pd.DataFrame(errors), use_container_width=True, hide_index=True)
 
 def show_statistics():
     st.markdown('<div class="section-header"><h2>📊 Statistiques Avancées</h2></div>', unsafe_allow_html=True)
-    stats, agents, tickets = get_agent_statistics()
+    stats, agents, workload_agents = get_agent_statistics()
     col1, col2, col3 = st.columns(3)
     with col1:
         st.metric("👥 Total agents", stats['total_agents'])
     with col2:
         st.metric("🎫 Total tickets", stats['total_tickets'])
     with col3:
-        st.metric("🟢 Agents actifs", stats['active_agents'])
+        st.metric("🟢 Agents actifs (24 h)", stats['active_agents'])
     st.divider()
+    if workload_agents:
+        df_workload = pd.DataFrame([
+            {
+                'agent': f"{a['nom']} {a['prenoms']}",
+                'occupation_pct': a['buckets'][0]['utilisation'] * 100,
+                'pic_simultane': a['buckets'][0]['peak_concurrent'],
+                'tickets_par_heure': a['buckets'][0]['throughput_per_hour'],
+            }
+            for a in workload_agents if a['buckets']
+        ])
+        fig_workload = px.bar(
+            df_workload, x='agent', y='occupation_pct',
+            hover_data=['pic_simultane', 'tickets_par_heure'],
+            title="Taux d'occupation des agents sur 24 h (%)"
+        )
+        st.plotly_chart(fig_workload, use_container_width=True)
     df_agents = pd.DataFrame(agents)
     if not df_agents.empty and 'categorie' in df_agents.columns:
         fig = px.pie(df_agents, names='categorie', title="Répartition des agents par catégorie")
         st.plotly_chart(fig, use_container_width=True)
-    df_tickets = pd.DataFrame(tickets)
-    if (
-        not df_tickets.empty and
-        not df_agents.empty and
-        'agent_id' in df_tickets.columns and
-        'agent_id' in df_agents.columns
-    ):
-        ticket_counts = df_tickets.groupby('agent_id').size().reset_index(name='nb_tickets')
-        merged = pd.merge(ticket_counts, df_agents, left_on='agent_id', right_on='agent_id', how='left')
-        merged['nom_complet'] = merged['nom'].fillna('') + " " + merged['prenoms'].fillna('')
-        fig2 = px.bar(merged, x='nom_complet', y='nb_tickets', title="Tickets par agent", color='nb_tickets')
-        st.plotly_chart(fig2, use_container_width=True)
-    else:
-        st.info("Impossible d'afficher la répartition des tickets par agent (données manquantes).")
-    if not df_tickets.empty and 'date_creation' in df_tickets.columns:
-        df_tickets['date_creation'] = pd.to_datetime(df_tickets['date_creation'])
-        df_tickets['jour'] = df_tickets['date_creation'].dt.date
-        daily_counts = df_tickets.groupby('jour').size().reset_index(name='nb_tickets')
-        fig3 = px.line(daily_counts, x='jour', y='nb_tickets', title="Évolution quotidienne des tickets")
+    # Rapports précalculés par l'API (périodes closes), la période en cours est calculée à la demande
+    index = get_api_data("reports")
+    daily = [e for e in index if e['kind'] == 'services' and e['granularity'] == 'day' and not e['live']]
+    if daily:
+        df_daily = pd.DataFrame(daily)
+        df_daily['jour'] = pd.to_datetime(df_daily['start']).dt.date
+        fig3 = px.line(df_daily.sort_values('jour'), x='jour', y='tickets', title="Évolution quotidienne des tickets")
         st.plotly_chart(fig3, use_container_width=True)
+    st.subheader("📑 Rapports d'activité")
+    periods = list(dict.fromkeys(e['period'] for e in index))
+    if not periods:
+        st.info("Aucun rapport disponible.")
+        return
+    col1, col2 = st.columns(2)
+    with col1:
+        period = st.selectbox("Période (jour ou semaine ISO)", periods)
+    with col2:
+        kind = st.selectbox("Rapport", ['services', 'agents'], format_func=lambda k: "Par service" if k == 'services' else "Par agent")
+    report = get_report(kind, period)
+    if not report:
+        st.warning("Rapport indisponible.")
+        return
+    totals = report['totals']
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("🎫 Tickets", totals['tickets'])
+    col2.metric("✅ Taux de clôture", f"{totals['completion_rate'] * 100:.1f}%" if totals['completion_rate'] is not None else "—")
+    col3.metric(f"⏱️ SLA ({report['sla_wait_minutes']:g} min)", f"{totals['sla_rate'] * 100:.1f}%" if totals['sla_rate'] is not None else "—")
+    col4.metric("⌛ Attente moyenne", f"{totals['avg_wait_minutes']} min" if totals['avg_wait_minutes'] is not None else "—")
+    df_report = pd.DataFrame(report['rows'])
+    if not df_report.empty:
+        if kind == 'agents':
+            df_report['agent'] = df_report['nom'].fillna('') + " " + df_report['prenoms'].fillna('')
+            fig2 = px.bar(df_report, x='agent', y='tickets', title="Tickets par agent", color='completion_rate')
+        else:
+            fig2 = px.bar(df_report, x='categorie_service', y='tickets', title="Tickets par service", color='sla_rate')
+        st.plotly_chart(fig2, use_container_width=True)
+        st.dataframe(df_report, use_container_width=True)
+    if report['live']:
+        st.caption("Période en cours : rapport calculé à la demande.")
+    csv_data = get_report(kind, period, fmt="csv")
+    if csv_data:
+        st.download_button("📥 Télécharger (CSV)", data=csv_data, file_name=f"{kind}-{period}.csv", mime="text/csv")
 
 def show_import_export():
     st.markdown('<div class="section-header"><h2>📁 Import / Export</h2></div>', unsafe_allow_html=True)
@@ -321,22 +407,80 @@ def show_import_export():
 
 def show_maintenance():
     st.markdown('<div class="section-header"><h2>🔧 Maintenance et sécurité</h2></div>', unsafe_allow_html=True)
+    if 'maintenance_message' in st.session_state:
+        st.success(st.session_state.pop('maintenance_message'))
     with st.expander("🧹 Réinitialiser la base de données"):
         st.warning("⚠️ Attention, cette action supprimera toutes les données actuelles.")
         if st.button("❌ Réinitialiser", type="secondary"):
             try:
                 response = requests.post(f"{API_BASE_URL}/reset")
                 if response.status_code == 200:
-                    st.success("✅ Base de données réinitialisée avec succès.")
+                    report = response.json()
+                    st.session_state['maintenance_message'] = (
+                        f"✅ Base de données réinitialisée avec succès ({report['duration_ms']} ms)."
+                    )
                     st.rerun()
                 else:
                     st.error("❌ Échec de la réinitialisation.")
             except Exception as e:
                 st.error(f"Erreur : {e}")
+    with st.expander("🌱 Charger un jeu de données de démonstration"):
+        with st.form("seed_form"):
+            col1, col2 = st.columns(2)
+            with col1:
+                agents = st.number_input("Nombre d'agents", min_value=1, max_value=10000, value=50)
+                tickets = st.number_input("Nombre de tickets", min_value=0, max_value=5_000_000, value=10000, step=1000)
+            with col2:
+                days = st.number_input("Historique (jours)", min_value=1, max_value=3650, value=30)
+                seed = st.number_input("Graine aléatoire", value=42)
+            reset = st.checkbox("Vider la base avant le chargement")
+            if st.form_submit_button("🌱 Charger"):
+                try:
+                    response = requests.post(f"{API_BASE_URL}/seed", params={
+                        "agents": agents, "tickets": tickets, "days": days, "seed": seed, "reset": reset
+                    })
+                    if response.status_code == 201:
+                        report = response.json()
+                        created = report['created']
+                        st.session_state['maintenance_message'] = (
+                            f"✅ {created['agents']} agents, {created['tickets']} tickets et "
+                            f"{created['evenements']} événements chargés ({report['duration_ms']} ms)."
+                        )
+                        st.rerun()
+                    elif response.status_code == 409:
+                        st.error("❌ La base n'est pas vide : cochez « Vider la base avant le chargement ».")
+                    else:
+                        st.error("❌ Échec du chargement.")
+                except Exception as e:
+                    st.error(f"Erreur : {e}")
     with st.expander("🛠️ Diagnostique système"):
         st.write("📡 Connexion API :", "🟢 OK" if get_api_data("agents") else "🔴 Problème")
         st.write("📦 Version pandas :", f"{pd.__version__}")
-        st.write("📈 Nombre total de tickets :", len(get_api_data("tickets")))
+        summary = get_api_data("agences/summary")
+        st.write("📈 Nombre total de tickets :", summary['total']['tickets'] if summary else 0)
+        st.markdown("**🗄️ Tâches de maintenance de la base**")
+        jobs = get_api_data("maintenance/jobs")
+        if jobs:
+            df_jobs = pd.DataFrame(jobs)
+            for column in ['last_started', 'next_run']:
+                df_jobs[column] = pd.to_datetime(df_jobs[column], format='ISO8601')
+            st.dataframe(
+                df_jobs[['agence', 'job', 'last_status', 'last_duration_ms', 'last_started', 'next_run', 'runs', 'last_detail']],
+                use_container_width=True,
+                hide_index=True,
+                column_config={
+                    "agence": "Agence",
+                    "job": "Tâche",
+                    "last_status": "Dernier résultat",
+                    "last_duration_ms": st.column_config.NumberColumn("Durée (ms)", format="%.1f"),
+                    "last_started": st.column_config.DatetimeColumn("Dernière exécution", format="DD/MM/YYYY HH:mm:ss"),
+                    "next_run": st.column_config.DatetimeColumn("Prochaine exécution", format="DD/MM/YYYY HH:mm:ss"),
+                    "runs": "Exécutions",
+                    "last_detail": "Détail"
+                }
+            )
+        else:
+            st.info("Aucune tâche de maintenance planifiée.")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,3 +1,4 @@
+import time
 import streamlit as st
 import requests
 import pandas as pd
@@ -7,8 +8,11 @@ import plotly.graph_objects as go
 from plotly.subplots import make_subplots
 import numpy as np
 
+from cached_api import get_json
+
 # Configuration
 API_BASE_URL = "http://localhost:8000"
+SERVICE_CATEGORIES = ["Consultation", "Transaction", "Support", "Réclamation", "Information"]
 
 st.set_page_config(
     page_title="Dashboard - Smart Agence",
@@ -63,10 +67,9 @@ st.markdown("""
 def get_api_data(endpoint):
     """Fonction générique pour récupérer des données de l'API"""
     try:
-        response = requests.get(f"{API_BASE_URL}/{endpoint}")
-        if response.status_code == 200:
-            return response.json()
-        return []
+        # Requête conditionnelle : une liste inchangée n'est pas retransférée
+        data = get_json(f"{API_BASE_URL}/{endpoint}")
+        return data if data is not None else []
     except requests.exceptions.RequestException:
         st.error(f"Erreur de connexion à l'API pour {endpoint}")
         return []
@@ -245,49 +248,52 @@ def create_category_distribution_chart(tickets):
     
     return fig
 
-def create_time_evolution_chart(tickets):
+def get_arrival_profile():
+    """Arrivées moyennes par heure de la semaine (0 = lundi 0 h), toutes catégories confondues"""
+    total = np.zeros(168)
+    for categorie in SERVICE_CATEGORIES:
+        profile = get_api_data(f"forecast/profile?categorie_service={categorie}")
+        if profile:
+            total += np.array(profile['arrivals_per_hour'])
+    return total
+
+def create_time_evolution_chart(tickets, arrival_profile):
     """Crée un graphique d'évolution temporelle des tickets"""
     if not tickets:
         return None
     
-    # Simuler des données temporelles (en l'absence de vraies dates)
-    dates = []
-    ticket_counts = []
-    
-    # Générer les 7 derniers jours
-    for i in range(7):
-        date = datetime.now() - timedelta(days=6-i)
-        dates.append(date.strftime('%Y-%m-%d'))
-        # Simuler des données aléatoires basées sur le nombre total de tickets
-        count = np.random.poisson(len(tickets) / 7)
-        ticket_counts.append(count)
+    # Tickets réellement créés sur les 7 derniers jours (dates UTC de l'API)
+    today = pd.Timestamp.utcnow().tz_localize(None).normalize()
+    days = pd.date_range(today - pd.Timedelta(days=6), today + pd.Timedelta(days=1), freq='D')
+    created = pd.to_datetime(pd.DataFrame(tickets)['date_creation'], format='ISO8601').dt.normalize()
+    ticket_counts = created.value_counts().reindex(days[:-1], fill_value=0)
+    dates = [day.strftime('%Y-%m-%d') for day in days]
     
     fig = go.Figure()
     
     fig.add_trace(go.Scatter(
-        x=dates,
-        y=ticket_counts,
+        x=dates[:-1],
+        y=ticket_counts.values,
         mode='lines+markers',
         name='Tickets créés',
         line=dict(color='#1f77b4', width=3),
         marker=dict(size=8, color='#1f77b4')
     ))
     
-    # Ajouter une ligne de tendance
-    z = np.polyfit(range(len(dates)), ticket_counts, 1)
-    p = np.poly1d(z)
+    # Arrivées attendues selon le profil historique du jour de la semaine (jusqu'à demain)
+    expected = arrival_profile.reshape(7, 24).sum(axis=1)[days.weekday]
     
     fig.add_trace(go.Scatter(
         x=dates,
-        y=p(range(len(dates))),
+        y=expected,
         mode='lines',
-        name='Tendance',
+        name='Attendu (historique)',
         line=dict(color='red', width=2, dash='dash')
     ))
     
     fig.update_layout(
         title={
-            'text': "Évolution des tickets sur 7 jours",
+            'text': "Évolution des tickets sur 7 jours et prévision",
             'x': 0.5,
             'xanchor': 'center',
             'font': {'size': 18, 'color': '#2c3e50'}
@@ -474,7 +480,7 @@ def main():
     
     # Graphique d'évolution temporelle (pleine largeur)
     st.markdown('<div class="chart-container">', unsafe_allow_html=True)
-    fig_evolution = create_time_evolution_chart(tickets)
+    fig_evolution = create_time_evolution_chart(tickets, get_arrival_profile())
     if fig_evolution:
         st.plotly_chart(fig_evolution, use_container_width=True)
     else:
@@ -544,6 +550,9 @@ def main():
     
     # Auto-refresh option
     if st.checkbox("🔄 Actualisation automatique (30s)"):
+        # Attente avant de relancer : sans elle, chaque tableau de bord ouvert
+        # interrogerait l'API en boucle
+        time.sleep(30)
         st.rerun()
 
 if __name__ == "__main__":
@@ -0,0 +1,125 @@
+"""Tableau de tickets paginé côté serveur, partagé par les pages Streamlit
+
+Seule la page affichée est demandée à l'API (`GET /tickets/page`) : le coût
+du rendu ne dépend pas du nombre total de tickets. Les couleurs de statut
+sont calculées colonne par colonne (`Series.map`), sans fonction appelée
+pour chaque cellule.
+"""
+import pandas as pd
+import requests
+import streamlit as st
+
+from cached_api import get_json
+
+STATUS_COLORS = {
+    'pending': 'background-color: #fff3cd',
+    'in_progress': 'background-color: #cce5ff',
+    'done': 'background-color: #d4edda',
+    'canceled': 'background-color: #f8d7da'
+}
+STATUSES = ['pending', 'in_progress', 'done', 'canceled']
+SERVICE_CATEGORIES = ["Consultation", "Transaction", "Support", "Réclamation", "Information"]
+SORT_OPTIONS = {
+    "Plus récents": "-id",
+    "Plus anciens": "id",
+    "Date de création ↓": "-date_creation",
+    "Date de création ↑": "date_creation",
+    "Service": "categorie_service",
+    "Agent": "agent_id",
+}
+PAGE_SIZES = [25, 50, 100, 250, 500]
+COLUMNS = ['ticket_id', 'statut', 'categorie_service', 'agent_name', 'date_creation', 'description']
+
+
+def fetch_ticket_page(api_base_url, page, page_size, sort, filters):
+    """Une page de tickets ; renvoie (tickets, total)"""
+    params = {"page": page, "page_size": page_size, "sort": sort}
+    params.update({key: value for key, value in filters.items() if value is not None})
+    try:
+        # Requête conditionnelle : page inchangée depuis la dernière demande, rien n'est retransféré
+        data = get_json(f"{api_base_url}/tickets/page", params=params)
+        if data is not None:
+            return data['items'], data['total']
+        return [], 0
+    except requests.exceptions.RequestException:
+        st.error("Impossible de se connecter à l'API")
+        return [], 0
+
+
+def style_status(column):
+    """Styles de toute la colonne statut en une seule correspondance vectorisée"""
+    return column.map(STATUS_COLORS).fillna('')
+
+
+def ticket_table(api_base_url, agents, key):
+    """Filtres, tri et pagination, puis affichage de la page courante
+
+    Renvoie les tickets de la page affichée (pour les actions groupées).
+    """
+    agent_names = {
+        agent.get('agent_id', agent.get('id')): f"{agent.get('nom', '')} {agent.get('prenoms', '')}"
+        for agent in agents
+    }
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        statut = st.selectbox("Filtrer par statut", ['Tous'] + STATUSES, key=f"{key}_statut")
+    with col2:
+        service = st.selectbox("Filtrer par service", ['Toutes'] + SERVICE_CATEGORIES, key=f"{key}_service")
+    with col3:
+        agent_ids = [None] + list(agent_names)
+        agent_id = st.selectbox(
+            "Filtrer par agent", agent_ids, key=f"{key}_agent",
+            format_func=lambda agent_id: 'Tous' if agent_id is None else agent_names[agent_id],
+        )
+    with col4:
+        sort_label = st.selectbox("Trier par", list(SORT_OPTIONS), key=f"{key}_sort")
+    filters = {
+        "statut": None if statut == 'Tous' else statut,
+        "categorie_service": None if service == 'Toutes' else service,
+        "agent_id": agent_id,
+    }
+
+    col1, col2 = st.columns([1, 3])
+    with col1:
+        page_size = st.selectbox("Lignes par page", PAGE_SIZES, index=1, key=f"{key}_page_size")
+
+    # Retour à la première page quand les critères changent
+    page_key = f"{key}_page"
+    criteria = (tuple(filters.values()), sort_label, page_size)
+    if st.session_state.get(f"{key}_criteria") != criteria:
+        st.session_state[f"{key}_criteria"] = criteria
+        st.session_state[page_key] = 1
+    page = st.session_state[page_key]
+    tickets, total = fetch_ticket_page(api_base_url, page, page_size, SORT_OPTIONS[sort_label], filters)
+    page_count = max((total + page_size - 1) // page_size, 1)
+    with col2:
+        # Changer de page relance le script : seule la nouvelle page est demandée
+        st.number_input(f"Page (sur {page_count})", min_value=1, max_value=max(page_count, page), key=page_key)
+
+    if not tickets:
+        st.info("Aucun ticket ne correspond aux critères.")
+        return []
+
+    df = pd.DataFrame(tickets).rename(columns={'id': 'ticket_id'})
+    # Fiche de l'agent embarquée dans chaque ticket par l'API
+    df['agent_name'] = [
+        f"{agent['nom']} {agent['prenoms']}" if agent else "Agent inconnu" for agent in df['agent']
+    ] if 'agent' in df.columns else "Agent inconnu"
+    df = df.reindex(columns=COLUMNS)
+    st.dataframe(
+        df.style.apply(style_status, subset=['statut']),
+        use_container_width=True,
+        hide_index=True,
+        height=min(len(df), 15) * 35 + 38,
+        column_config={
+            "ticket_id": "ID Ticket",
+            "agent_name": "Agent assigné",
+            "categorie_service": "Service",
+            "statut": "Statut",
+            "date_creation": "Date création",
+            "description": "Description"
+        }
+    )
+    first = (page - 1) * page_size + 1
+    st.caption(f"Tickets {first} à {first + len(df) - 1} sur {total}")
+    return tickets